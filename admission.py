@@ -0,0 +1,269 @@
+import heapq
+import itertools
+import math
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional
+
+# Priority classes; lower values are admitted first
+INTERACTIVE = 0
+BATCH = 1
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BATCH: "batch"}
+
+class AdmissionRejected(Exception):
+    """Raised when a request is shed instead of being sent to the provider."""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class Ticket:
+    """
+    A granted provider slot. release() is idempotent, so a streaming response
+    can release from both its generator's finally block and its close hook.
+    """
+
+    def __init__(self, gate: "ProviderGate", priority: int, wait_seconds: float):
+        self.gate = gate
+        self.priority = priority
+        self.wait_seconds = wait_seconds
+        self.acquired_at = time.monotonic()
+        self._released = False
+        self._lock = threading.Lock()
+
+    def release(self) -> None:
+        with self._lock:
+            if self._released:
+                return
+            self._released = True
+        self.gate._release(time.monotonic() - self.acquired_at)
+
+    def __enter__(self) -> "Ticket":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.release()
+
+class _Waiter:
+    __slots__ = ("priority", "event", "granted", "rejected")
+
+    def __init__(self, priority: int):
+        self.priority = priority
+        self.event = threading.Event()
+        self.granted = False
+        self.rejected = False
+
+class ProviderGate:
+    """
+    Concurrency limiter for one provider with a bounded priority wait queue.
+
+    At most max_concurrent requests are in flight. Further requests wait in a
+    queue ordered by priority, then arrival. When the queue is full a new
+    request is rejected at once, except that an interactive request displaces
+    the most recently queued batch request. Requests that wait longer than
+    max_wait seconds are rejected too.
+    """
+
+    def __init__(self, name: str, max_concurrent: int = 8, max_queue: int = 32, max_wait: float = 10.0):
+        """
+        Initialize the gate.
+
+        Args:
+            name: Provider name (for messages and metrics)
+            max_concurrent: Maximum number of requests in flight
+            max_queue: Maximum number of waiting requests
+            max_wait: Maximum seconds a request may wait for a slot
+        """
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._queue: List[Any] = []  # heap of (priority, sequence, waiter)
+        self._sequence = itertools.count()
+        self._waits: Dict[int, Deque[float]] = {p: deque(maxlen=500) for p in PRIORITY_NAMES}
+        self._service_times: Deque[float] = deque(maxlen=100)
+        self._counters = {"admitted": 0, "enqueued": 0, "rejected_full": 0, "rejected_timeout": 0, "displaced": 0}
+
+    def acquire(self, priority: int = BATCH) -> Ticket:
+        """
+        Wait for a slot.
+
+        Args:
+            priority: INTERACTIVE or BATCH
+
+        Returns:
+            Ticket that must be released when the provider call is done
+
+        Raises:
+            AdmissionRejected: If the queue is full or the wait times out
+        """
+        start = time.monotonic()
+        with self._lock:
+            if self._in_flight < self.max_concurrent and not self._queued_count():
+                return self._admit(priority, 0.0)
+
+            if self._queued_count() >= self.max_queue and not self._displace_batch(priority):
+                self._counters["rejected_full"] += 1
+                raise AdmissionRejected(f"{self.name} request queue is full", self._retry_after())
+
+            waiter = _Waiter(priority)
+            heapq.heappush(self._queue, (priority, next(self._sequence), waiter))
+            self._counters["enqueued"] += 1
+
+        waiter.event.wait(self.max_wait)
+
+        with self._lock:
+            if waiter.granted:
+                return Ticket(self, priority, self._record_wait(priority, start))
+            if not waiter.rejected:
+                # Timed out: leave the queue
+                waiter.rejected = True
+                self._queue = [entry for entry in self._queue if entry[2] is not waiter]
+                heapq.heapify(self._queue)
+                self._counters["rejected_timeout"] += 1
+                raise AdmissionRejected(f"Timed out waiting for a {self.name} slot", self._retry_after())
+        raise AdmissionRejected(f"{self.name} request was displaced by interactive traffic", self._retry_after())
+
+    def stats(self) -> Dict[str, Any]:
+        """Return queue depth, in-flight count, counters and wait-time percentiles."""
+        with self._lock:
+            queued = {name: 0 for name in PRIORITY_NAMES.values()}
+            for priority, _, waiter in self._queue:
+                if not waiter.rejected:
+                    queued[PRIORITY_NAMES[priority]] += 1
+            waits = {PRIORITY_NAMES[p]: latency_percentiles(list(values)) for p, values in self._waits.items()}
+            return {
+                "in_flight": self._in_flight,
+                "max_concurrent": self.max_concurrent,
+                "queued": queued,
+                "max_queue": self.max_queue,
+                "wait_ms": waits,
+                **self._counters,
+            }
+
+    def _admit(self, priority: int, wait_seconds: float) -> Ticket:
+        self._in_flight += 1
+        self._counters["admitted"] += 1
+        self._waits[priority].append(wait_seconds)
+        return Ticket(self, priority, wait_seconds)
+
+    def _record_wait(self, priority: int, start: float) -> float:
+        wait_seconds = time.monotonic() - start
+        self._waits[priority].append(wait_seconds)
+        return wait_seconds
+
+    def _release(self, held_seconds: float) -> None:
+        with self._lock:
+            self._in_flight -= 1
+            self._service_times.append(held_seconds)
+            self._grant_waiters()
+
+    def _grant_waiters(self) -> None:
+        while self._queue and self._in_flight < self.max_concurrent:
+            _, _, waiter = heapq.heappop(self._queue)
+            if waiter.rejected:
+                continue
+            waiter.granted = True
+            self._in_flight += 1
+            self._counters["admitted"] += 1
+            waiter.event.set()
+
+    def _queued_count(self) -> int:
+        return sum(1 for _, _, waiter in self._queue if not waiter.rejected)
+
+    def _displace_batch(self, priority: int) -> bool:
+        """Reject the newest queued batch request to make room for an interactive one."""
+        if priority != INTERACTIVE:
+            return False
+        batch = [entry for entry in self._queue if entry[0] == BATCH and not entry[2].rejected]
+        if not batch:
+            return False
+        victim = max(batch, key=lambda entry: entry[1])[2]
+        victim.rejected = True
+        victim.event.set()
+        self._counters["displaced"] += 1
+        return True
+
+    def _retry_after(self) -> int:
+        """Estimate how long until the queue drains, in whole seconds."""
+        average = (sum(self._service_times) / len(self._service_times)) if self._service_times else 1.0
+        backlog = self._queued_count() + self._in_flight
+        return max(1, math.ceil(average * backlog / max(1, self.max_concurrent)))
+
+class AdmissionController:
+    """Per-provider admission gates sharing one set of limits."""
+
+    def __init__(self, max_concurrent: int = 8, max_queue: int = 32, max_wait: float = 10.0):
+        """
+        Initialize the controller.
+
+        Args:
+            max_concurrent: Maximum requests in flight per provider
+            max_queue: Maximum waiting requests per provider
+            max_wait: Maximum seconds a request may wait for a slot
+        """
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self._gates: Dict[str, ProviderGate] = {}
+        self._lock = threading.Lock()
+
+    def gate(self, provider: str) -> ProviderGate:
+        """Return the gate of a provider, creating it on first use."""
+        with self._lock:
+            gate = self._gates.get(provider)
+            if gate is None:
+                gate = ProviderGate(provider, self.max_concurrent, self.max_queue, self.max_wait)
+                self._gates[provider] = gate
+            return gate
+
+    def acquire(self, provider: str, priority: int = BATCH) -> Ticket:
+        """
+        Wait for a slot with a provider.
+
+        Args:
+            provider: Provider name
+            priority: INTERACTIVE or BATCH
+
+        Returns:
+            Ticket that must be released when the provider call is done
+
+        Raises:
+            AdmissionRejected: If the request is shed
+        """
+        return self.gate(provider).acquire(priority)
+
+    def update_limits(self, max_concurrent: int, max_queue: int, max_wait: float) -> None:
+        """Apply new limits to all gates (e.g. after a configuration reload)."""
+        with self._lock:
+            self.max_concurrent = max_concurrent
+            self.max_queue = max_queue
+            self.max_wait = max_wait
+            gates = list(self._gates.values())
+        for gate in gates:
+            with gate._lock:
+                gate.max_concurrent = max_concurrent
+                gate.max_queue = max_queue
+                gate.max_wait = max_wait
+                gate._grant_waiters()
+
+    def stats(self) -> Dict[str, Any]:
+        """Return the stats of every provider gate."""
+        with self._lock:
+            gates = dict(self._gates)
+        return {name: gate.stats() for name, gate in gates.items()}
+
+def latency_percentiles(values: List[float]) -> Dict[str, Optional[float]]:
+    """Summarize durations in seconds as p50, p95 and max in milliseconds."""
+    if not values:
+        return {"p50": None, "p95": None, "max": None}
+    ordered = sorted(values)
+
+    def pick(pct: float) -> float:
+        return round(ordered[min(len(ordered) - 1, int(pct * len(ordered)))] * 1000, 1)
+
+    return {"p50": pick(0.5), "p95": pick(0.95), "max": round(ordered[-1] * 1000, 1)}
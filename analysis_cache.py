@@ -0,0 +1,208 @@
+import os
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+import logging
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS analyses (
+    key TEXT PRIMARY KEY,
+    provider TEXT,
+    model TEXT,
+    analysis TEXT NOT NULL,
+    tts TEXT,
+    tts_voice TEXT,
+    tts_segments TEXT,
+    tts_segments_voice TEXT,
+    created_at REAL NOT NULL,
+    last_used REAL NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS analyses_last_used ON analyses (last_used);
+"""
+
+# Columns added after the first release, created on databases that predate them
+_ADDED_COLUMNS = {"tts_segments": "TEXT", "tts_segments_voice": "TEXT"}
+
+def analysis_key(image_id: str, prompt: str, provider: str, model: str) -> str:
+    """
+    Compute the cache key of an analysis.
+
+    Args:
+        image_id: Content hash of the image (or the URL for remote images)
+        prompt: Analysis prompt
+        provider: LLM provider name
+        model: Model identifier
+
+    Returns:
+        Hex digest identifying the analysis
+    """
+    encoded = json.dumps([image_id, prompt, provider, model], separators=(",", ":"))
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+@dataclass
+class CachedAnalysis:
+    """An analysis served from the cache, with its speech if it was synthesized."""
+    analysis: str
+    tts: Optional[Dict[str, Any]]
+    tts_voice: Optional[str]
+    # Sentence-by-sentence speech of a pipelined analysis
+    tts_segments: Optional[List[Dict[str, Any]]] = None
+    tts_segments_voice: Optional[str] = None
+
+class AnalysisCache:
+    """
+    Persistent cache of /analyze results in SQLite.
+
+    Entries expire ttl_seconds after they were created; when there are more
+    than max_entries, the least recently used ones are dropped. The speech
+    generated for an analysis is stored on the same entry, together with the
+    voice it was synthesized with: the whole text for plain requests, and the
+    sentence segments for pipelined ones.
+    """
+
+    def __init__(self, db_path: str, ttl_seconds: float = 7 * 24 * 3600, max_entries: int = 10000):
+        """
+        Initialize the cache.
+
+        Args:
+            db_path: SQLite database file
+            ttl_seconds: Maximum age of an entry
+            max_entries: Maximum number of entries (0 disables the cache)
+        """
+        self.db_path = db_path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "stores": 0, "expired": 0, "evicted": 0, "errors": 0}
+
+        directory = os.path.dirname(os.path.abspath(db_path))
+        os.makedirs(directory, exist_ok=True)
+        # Lookups are a single indexed read, so one shared connection is enough
+        self._conn = sqlite3.connect(db_path, timeout=10, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_SCHEMA)
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(analyses)")}
+        with self._conn:
+            for column, column_type in _ADDED_COLUMNS.items():
+                if column not in columns:
+                    self._conn.execute(f"ALTER TABLE analyses ADD COLUMN {column} {column_type}")
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    def get(self, key: str) -> Optional[CachedAnalysis]:
+        """
+        Look up an analysis.
+
+        Args:
+            key: Key from analysis_key()
+
+        Returns:
+            The cached analysis, or None on a miss or an expired entry
+        """
+        if not self.enabled:
+            return None
+        now = time.time()
+        try:
+            with self._lock:
+                row = self._conn.execute(
+                    "SELECT analysis, tts, tts_voice, tts_segments, tts_segments_voice, created_at "
+                    "FROM analyses WHERE key = ?", (key,)
+                ).fetchone()
+                if row is None:
+                    self._stats["misses"] += 1
+                    return None
+                analysis, tts, tts_voice, tts_segments, tts_segments_voice, created_at = row
+                if now - created_at > self.ttl_seconds:
+                    with self._conn:
+                        self._conn.execute("DELETE FROM analyses WHERE key = ?", (key,))
+                    self._stats["expired"] += 1
+                    self._stats["misses"] += 1
+                    return None
+                with self._conn:
+                    self._conn.execute("UPDATE analyses SET last_used = ?, hits = hits + 1 WHERE key = ?",
+                                       (now, key))
+                self._stats["hits"] += 1
+        except sqlite3.Error as e:
+            self._error("read", e)
+            return None
+        return CachedAnalysis(analysis=analysis, tts=json.loads(tts) if tts else None, tts_voice=tts_voice,
+                              tts_segments=json.loads(tts_segments) if tts_segments else None,
+                              tts_segments_voice=tts_segments_voice)
+
+    def put(self, key: str, analysis: str, provider: Optional[str] = None, model: Optional[str] = None) -> None:
+        """Store an analysis (replacing any previous one and its speech)."""
+        if not self.enabled:
+            return
+        now = time.time()
+        try:
+            with self._lock, self._conn:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO analyses (key, provider, model, analysis, created_at, last_used) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (key, provider, model, analysis, now, now)
+                )
+                self._stats["stores"] += 1
+                self._evict(now)
+        except sqlite3.Error as e:
+            self._error("write", e)
+
+    def put_tts(self, key: str, tts: Dict[str, Any], voice: Optional[str]) -> None:
+        """Attach the speech generated for an analysis to its entry."""
+        if not self.enabled:
+            return
+        try:
+            with self._lock, self._conn:
+                self._conn.execute("UPDATE analyses SET tts = ?, tts_voice = ? WHERE key = ?",
+                                   (json.dumps(tts), voice, key))
+        except sqlite3.Error as e:
+            self._error("write", e)
+
+    def put_tts_segments(self, key: str, segments: List[Dict[str, Any]], voice: Optional[str]) -> None:
+        """Attach the sentence segments synthesized for a pipelined analysis to its entry."""
+        if not self.enabled:
+            return
+        try:
+            with self._lock, self._conn:
+                self._conn.execute("UPDATE analyses SET tts_segments = ?, tts_segments_voice = ? WHERE key = ?",
+                                   (json.dumps(segments), voice, key))
+        except sqlite3.Error as e:
+            self._error("write", e)
+
+    def stats(self) -> Dict[str, Any]:
+        """Return the number of entries and hit, miss, store and eviction counts."""
+        with self._lock:
+            try:
+                entries = self._conn.execute("SELECT COUNT(*) FROM analyses").fetchone()[0]
+            except sqlite3.Error:
+                entries = None
+            return {"entries": entries, "max_entries": self.max_entries,
+                    "ttl_seconds": self.ttl_seconds, **self._stats}
+
+    def _evict(self, now: float) -> None:
+        """Drop expired entries, then the least recently used ones beyond max_entries."""
+        expired = self._conn.execute("DELETE FROM analyses WHERE created_at < ?",
+                                     (now - self.ttl_seconds,)).rowcount
+        count = self._conn.execute("SELECT COUNT(*) FROM analyses").fetchone()[0]
+        evicted = 0
+        if count > self.max_entries:
+            evicted = self._conn.execute(
+                "DELETE FROM analyses WHERE key IN "
+                "(SELECT key FROM analyses ORDER BY last_used ASC LIMIT ?)",
+                (count - self.max_entries,)
+            ).rowcount
+        self._stats["expired"] += max(expired, 0)
+        self._stats["evicted"] += max(evicted, 0)
+
+    def _error(self, operation: str, error: Exception) -> None:
+        # The cache is an optimization: failures fall back to a fresh analysis
+        self._stats["errors"] += 1
+        logger.error(f"[Analysis cache] {operation} failed: {str(error)}")
@@ -1,32 +1,46 @@
 import os
 import base64
-import requests
 from typing import Dict, List, Optional, Union, Any
-from io import BytesIO
 
 from llm_service import LLMService
+from image_payload import ImagePayload
+from profiling import stage
+from http_pool import get_session, probe
+from image_resolver import resolve_image_parts
+from conversion_cache import ConversionCache, Incomplete, unwrap
+from deadline import call_timeout
 
 class AnthropicService(LLMService):
     """
     Anthropic implementation of the LLMService interface.
     Handles communication with Anthropic's API for chat completions and image processing.
+    
+    The Messages API is stateless, so every turn sends the whole conversation;
+    converted messages are memoized per session_id so that only the messages
+    appended since the previous turn are converted.
     """
     
-    def __init__(self, api_key: Optional[str] = None):
+    def __init__(self, api_key: Optional[str] = None, base_url: Optional[str] = None):
         """
         Initialize the Anthropic service with an API key.
         
         Args:
             api_key: Anthropic API key (will use environment variable if not provided)
+            base_url: API base URL (will use ANTHROPIC_BASE_URL if set, e.g. for a local stand-in)
         """
         self.api_key = api_key or os.environ.get("ANTHROPIC_API_KEY")
-        self.api_url = "https://api.anthropic.com/v1/messages"
+        base_url = base_url or os.environ.get("ANTHROPIC_BASE_URL") or "https://api.anthropic.com"
+        self.base_url = base_url.rstrip('/')
+        self.api_url = f"{self.base_url}/v1/messages"
+        self._conversion_cache = ConversionCache()
         
     def chat_completion(self, 
                        messages: List[Dict[str, Any]], 
                        model: Optional[str] = "claude-3-opus-20240229",
                        temperature: Optional[float] = 0.7,
-                       stream: bool = False) -> Union[Dict[str, Any], Any]:
+                       max_tokens: Optional[int] = None,
+                       stream: bool = False,
+                       session_id: Optional[str] = None) -> Union[Dict[str, Any], Any]:
         """
         Generate a chat completion using Anthropic's API.
         
@@ -34,13 +48,17 @@ class AnthropicService(LLMService):
             messages: List of message objects with role and content (OpenAI format)
             model: Anthropic model to use (default: claude-3-opus-20240229)
             temperature: Temperature parameter (default: 0.7)
+            max_tokens: Maximum number of tokens to generate (default: 4096, which the API requires)
             stream: Whether to stream the response
+            session_id: Conversation identifier; when given, earlier turns' converted
+                messages are reused
             
         Returns:
             Either a completion response object or a stream
         """
         # Convert OpenAI format messages to Anthropic format
-        anthropic_messages = self._convert_to_anthropic_format(messages)
+        with stage("anthropic.convert"):
+            anthropic_messages = self._conversion_cache.convert(session_id, messages, self._convert_messages)
         
         headers = {
             "x-api-key": self.api_key,
@@ -53,27 +71,56 @@ class AnthropicService(LLMService):
             "messages": anthropic_messages,
             "temperature": temperature,
             "stream": stream,
-            "max_tokens": 4096
+            "max_tokens": max_tokens if max_tokens is not None else 4096
         }
         
-        response = requests.post(self.api_url, headers=headers, json=data, stream=stream)
+        with stage("anthropic.request"):
+            # Bounded by the turn's deadline, if any (no timeout otherwise)
+            response = get_session().post(self.api_url, headers=headers, json=data, stream=stream,
+                                          timeout=call_timeout(step="anthropic.request"))
         response.raise_for_status()
         
         if stream:
-            return response.iter_lines()
+            return self._iter_stream(response)
         else:
             return response.json()
     
-    def process_image(self, image_data: Union[str, bytes]) -> Dict[str, Any]:
+    def _iter_stream(self, response: Any) -> Any:
+        """Yield the SSE lines of a streamed response; closing the iterator drops the connection."""
+        try:
+            yield from response.iter_lines()
+        finally:
+            response.close()
+    
+    def warmup(self) -> None:
+        """Open a pooled connection to the API host."""
+        probe(self.base_url, timeout=10.0)
+    
+    def stats(self) -> Dict[str, Any]:
+        """Return hit, miss and eviction counts of the conversion cache."""
+        return {"conversion_cache": self._conversion_cache.stats()}
+    
+    def process_image(self, image_data: Union[str, bytes, ImagePayload]) -> Dict[str, Any]:
         """
         Process an image for inclusion in an Anthropic message.
         
         Args:
-            image_data: Either a URL string or raw image bytes
+            image_data: A URL string, raw image bytes, or an ImagePayload
             
         Returns:
             Processed image data in the format expected by Anthropic
         """
+        # ImagePayload memoizes its base64 text, so it is encoded at most once
+        if isinstance(image_data, ImagePayload):
+            return {
+                "type": "image",
+                "source": {
+                    "type": "base64",
+                    "media_type": image_data.mime_type,
+                    "data": image_data.base64()
+                }
+            }
+        
         # If image_data is a URL, return it in Anthropic's format
         if isinstance(image_data, str) and (image_data.startswith('http://') or image_data.startswith('https://')):
             return {
@@ -124,9 +171,26 @@ class AnthropicService(LLMService):
         Returns:
             Messages in Anthropic format
         """
-        anthropic_messages = []
+        return [unwrap(msg) for msg in self._convert_messages(openai_messages) if msg is not None]
+    
+    def _convert_messages(self, openai_messages: List[Dict[str, Any]]) -> List[Any]:
+        """
+        Convert messages from OpenAI format to Anthropic format, one by one.
         
-        for msg in openai_messages:
+        Args:
+            openai_messages: Messages in OpenAI format
+            
+        Returns:
+            The Anthropic message for each input message (None for roles
+            Anthropic has no equivalent for, wrapped in Incomplete if an image
+            of the message could not be converted)
+        """
+        anthropic_messages: List[Any] = []
+        
+        # Encode all images of the conversation up front, in parallel
+        resolved_images = resolve_image_parts(openai_messages, self._image_block)
+        
+        for i, msg in enumerate(openai_messages):
             role = msg["role"]
             
             # Map OpenAI roles to Anthropic roles
@@ -140,56 +204,70 @@ class AnthropicService(LLMService):
             elif role == "user" or role == "assistant":
                 # Convert content to Anthropic's format
                 content = []
+                complete = True
                 
                 # Handle string content
                 if isinstance(msg["content"], str):
                     content.append({"type": "text", "text": msg["content"]})
                 # Handle array content (for multimodal)
                 elif isinstance(msg["content"], list):
-                    for item in msg["content"]:
+                    for j, item in enumerate(msg["content"]):
                         if item.get("type") == "text":
                             content.append({"type": "text", "text": item["text"]})
-                        elif item.get("type") == "image_url":
-                            # Process image URL
-                            image_url = item["image_url"]
-                            if isinstance(image_url, str):
-                                content.append({
-                                    "type": "image",
-                                    "source": {
-                                        "type": "url",
-                                        "url": image_url
-                                    }
-                                })
-                            elif isinstance(image_url, dict) and "url" in image_url:
-                                # Handle base64 images
-                                if image_url["url"].startswith("data:"):
-                                    media_type = "image/jpeg"
-                                    if ";" in image_url["url"]:
-                                        media_type = image_url["url"].split(";")[0].split(":")[1]
-                                    
-                                    base64_data = image_url["url"].split(",")[1]
-                                    content.append({
-                                        "type": "image",
-                                        "source": {
-                                            "type": "base64",
-                                            "media_type": media_type,
-                                            "data": base64_data
-                                        }
-                                    })
-                                else:
-                                    content.append({
-                                        "type": "image",
-                                        "source": {
-                                            "type": "url",
-                                            "url": image_url["url"]
-                                        }
-                                    })
+                        elif item.get("type") in ("image_url", "image_data"):
+                            block = resolved_images[(i, j)]
+                            # Images that could not be converted are left out (this time only;
+                            # the message is not memoized)
+                            if isinstance(block, Exception):
+                                complete = False
+                            elif block is not None:
+                                content.append(block)
                 
                 # Map the role and add the content
                 anthropic_role = "user" if role == "user" else "assistant"
-                anthropic_messages.append({
+                anthropic_message = {
                     "role": anthropic_role,
                     "content": content
-                })
+                }
+                anthropic_messages.append(anthropic_message if complete else Incomplete(anthropic_message))
+            else:
+                anthropic_messages.append(None)
         
         return anthropic_messages
+    
+    def _image_block(self, item: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        Convert an image_url or image_data content part to an Anthropic image block.
+        
+        Args:
+            item: OpenAI-format content part
+            
+        Returns:
+            Anthropic image block, or None if the part has no usable image
+        """
+        if item["type"] == "image_data":
+            return self.process_image(item["image_data"])
+        
+        image_url = item["image_url"]
+        if isinstance(image_url, str):
+            return {
+                "type": "image",
+                "source": {
+                    "type": "url",
+                    "url": image_url
+                }
+            }
+        elif isinstance(image_url, dict) and isinstance(image_url.get("url"), ImagePayload):
+            return self.process_image(image_url["url"])
+        elif isinstance(image_url, dict) and "url" in image_url:
+            # Handle base64 images (the base64 text is reused, not decoded)
+            if image_url["url"].startswith("data:"):
+                return self.process_image(ImagePayload.from_data_url(image_url["url"]))
+            return {
+                "type": "image",
+                "source": {
+                    "type": "url",
+                    "url": image_url["url"]
+                }
+            }
+        return None
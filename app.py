@@ -1,26 +1,65 @@
+import time 
+# Measured so the cost of module imports (cold start) shows up in /metrics
+_import_started = time.perf_counter()
 import os
 import json
 import uuid
+import io
+import hashlib
 import base64 
 import requests 
 from werkzeug.utils import secure_filename
-from flask import Flask, request, jsonify, Response, stream_with_context, send_from_directory, render_template 
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.security import safe_join
+from flask import Flask, request, jsonify, Response, stream_with_context, send_from_directory, send_file, render_template, g 
 from flask_cors import CORS
 from dotenv import load_dotenv
-from llm_factory import create_llm_service 
+from llm_factory import get_llm_service, clear_llm_service_cache, pooled_service_stats, provider_import_stats
 from llm_service import LLMService 
-import time 
+from tts_pipeline import iter_completion_text, pipeline_speech
+from signed_url_pool import SignedUrlPool
+from config import ConfigStore
+from janitor import StorageJanitor
+from conversion_cache import message_fingerprint
+from image_renditions import RENDITIONS, RenditionPolicy, RenditionWorker, rendition_filename, rendition_filenames
+from image_store import (UploadTooLarge, HotImageCache, ingest_upload, normalize_extension,
+                         content_hash_from_name, file_sha256)
+from image_payload import ImagePayload
+from admission import AdmissionController, AdmissionRejected, BATCH, INTERACTIVE
+from single_flight import SingleFlight, request_fingerprint
+from usage_ledger import UsageLedger
+from profiling import NULL_PROFILE, Profiler, join, stage
+from tracing import Tracer
+from http_pool import configure as configure_http_pool, get_session, probe
+from warmup import DependencyWarmer
+from analysis_cache import AnalysisCache, analysis_key
+from image_fetcher import configure_default_fetcher, default_fetcher
+from deadline import Deadline, DeadlineExceeded, TurnStats, close_upstream
+from vision_ack import TtftStats, ack_chunk
+from model_router import RouteStats, RoutingPolicy
 import logging
 
-# Load environment variables from .env file
+STARTUP_IMPORT_MS = round((time.perf_counter() - _import_started) * 1000, 1)
+
+# Load environment variables from .env file (for modules that read os.environ
+# directly); the config store keeps the environment from before, so keys
+# removed from .env stop applying on reload
+_process_environ = dict(os.environ)
 load_dotenv()
 
+# --- Configuration --- #
+# Loaded and validated once at startup. Handlers read the current immutable
+# snapshot via config_store.current; it is swapped atomically on SIGHUP or
+# when the .env file changes.
+config_store = ConfigStore(env_path='.env', base_env=_process_environ)
+
 # Debug environment variables
+_startup_config = config_store.current
 print(f"\n=== ENVIRONMENT VARIABLES DEBUG ===")
-print(f"ELEVENLABS_API_KEY: {'*' * 20 + os.getenv('ELEVENLABS_API_KEY')[-4:] if os.getenv('ELEVENLABS_API_KEY') else 'Not set'}")
-print(f"ELEVENLABS_AGENT_ID: {os.getenv('ELEVENLABS_AGENT_ID') or 'Not set'}")
-print(f"LLM_PROVIDER: {os.getenv('LLM_PROVIDER') or 'Not set'}")
-print(f"DEFAULT_MODEL: {os.getenv('DEFAULT_MODEL') or 'Not set'}")
+print(f"ELEVENLABS_API_KEY: {'*' * 20 + _startup_config.elevenlabs_api_key[-4:] if _startup_config.elevenlabs_api_key else 'Not set'}")
+print(f"ELEVENLABS_AGENT_ID: {_startup_config.elevenlabs_agent_id}")
+print(f"LLM_PROVIDER: {_startup_config.llm_provider}")
+print(f"DEFAULT_MODEL: {_startup_config.default_model}")
 print(f"=== END ENVIRONMENT VARIABLES DEBUG ===\n")
 
 app = Flask(__name__)
@@ -39,9 +78,107 @@ CORS(app, origins=["*"], methods=["GET", "POST", "OPTIONS"], allow_headers=["Con
 image_context = {} 
 session_map = {}
 pending_session_id = None
+# Last activity time per session_id; idle sessions are expired by the storage janitor
+session_last_seen = {}
+# (image filename, served filename, detail) last injected into each session. Providers that
+# keep the chat on their side get the choice of the image's first turn on every later turn,
+# so the conversation history stays the same from turn to turn
+injected_image_choice = {}
+# Fingerprints of the user messages of each session that asked for detail and got the
+# full-resolution image as an extra turn (re-inserted on later turns, see chat_completions)
+detail_turns = {}
 
 # Define required configuration keys
 app.config['UPLOAD_FOLDER'] = os.path.abspath('./uploads')
+# Reject oversized request bodies before they are parsed (leave room for multipart overhead)
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
+app.config['MAX_CONTENT_LENGTH'] = _startup_config.max_upload_bytes + MULTIPART_OVERHEAD_BYTES
+# Let a fronting server (nginx/Apache) send image files itself when configured
+app.config['USE_X_SENDFILE'] = _startup_config.use_x_sendfile
+
+# Recently uploaded images, served from memory on repeat fetches
+hot_image_cache = HotImageCache(max_bytes=_startup_config.image_hot_cache_bytes)
+
+# Downscaled renditions are generated in the background; until they exist the original is served
+rendition_worker = RenditionWorker()
+
+# Content-addressed images never change, so clients may cache them for a year
+IMMUTABLE_IMAGE_MAX_AGE = 365 * 24 * 3600
+
+# Decides which rendition (and provider detail level) each chat turn injects
+rendition_policy = RenditionPolicy(zoom_pattern=_startup_config.image_zoom_pattern)
+
+def build_routing_policy(config):
+    """Create the per-turn model routing policy of a configuration snapshot."""
+    return RoutingPolicy(
+        fast_model=config.routing_fast_model,
+        vision_model=config.routing_vision_model,
+        fast_pattern=config.routing_fast_pattern,
+        fast_max_chars=config.routing_fast_max_chars,
+        image_pattern=config.routing_image_pattern,
+        rules=config.routing_rules
+    )
+
+# Decides which model each chat turn goes to; outcomes are kept per route for tuning
+routing_policy = build_routing_policy(_startup_config)
+route_stats = RouteStats()
+
+# Per-provider concurrency limits with a bounded priority queue: live voice
+# turns (/v1/chat/completions) are admitted ahead of batch /analyze calls
+admission = AdmissionController(
+    max_concurrent=_startup_config.admission_max_concurrent,
+    max_queue=_startup_config.admission_max_queue,
+    max_wait=_startup_config.admission_max_wait_seconds
+)
+
+# In-flight streamed completions, so a turn that is re-sent while the first copy
+# is still streaming shares the same upstream call
+single_flight = SingleFlight()
+
+# Voice turns cut short by the client (barge-in) or by their deadline
+turn_stats = TurnStats()
+
+# Time to first token as heard by the user versus from the model, per streamed turn
+ttft_stats = TtftStats()
+
+# Token usage per request, written to SQLite in the background
+usage_ledger = UsageLedger(_startup_config.usage_db_path, flush_interval=_startup_config.usage_flush_seconds)
+
+# Results of /analyze by image hash, prompt, provider and model, with their speech
+analysis_cache = AnalysisCache(
+    _startup_config.analysis_cache_path,
+    ttl_seconds=_startup_config.analysis_cache_ttl_seconds,
+    max_entries=_startup_config.analysis_cache_max_entries
+)
+
+# Opt-in stage timers / cProfile captures of single requests (X-Profile header or sampling)
+profiler = Profiler(
+    directory=_startup_config.profile_dir,
+    sample_rate=_startup_config.profile_sample_rate,
+    header=_startup_config.profile_header,
+    sample_mode=_startup_config.profile_sample_mode
+)
+
+def configure_fetching(config):
+    """Apply the remote image fetcher and HTTP connection pool settings of a config snapshot."""
+    configure_default_fetcher(
+        cache_dir=config.image_fetch_cache_dir,
+        memory_bytes=config.image_fetch_memory_bytes,
+        disk_bytes=config.image_fetch_disk_bytes,
+        max_bytes=config.image_fetch_max_bytes,
+        read_timeout=config.image_fetch_timeout_seconds
+    )
+    configure_http_pool(config.http_pool_maxsize)
+
+configure_fetching(_startup_config)
+
+# Spans of sampled requests (TRACE_SAMPLE_RATE or a sampled traceparent header), exported as OTLP JSON
+tracer = Tracer(
+    path=_startup_config.trace_file,
+    sample_rate=_startup_config.trace_sample_rate,
+    service_name=_startup_config.trace_service_name,
+    max_bytes=_startup_config.trace_max_bytes
+)
 
 # Ensure the upload folder exists
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
@@ -50,10 +187,149 @@ os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 # Simple in-memory session storage (kept for potential other uses)
 sessions = {}
 
+# Generated speech files are written here and served from /static
+AUDIO_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+
+def touch_session(session_id):
+    """Record activity for a session so the janitor keeps it (and its image) alive."""
+    if session_id:
+        session_last_seen[session_id] = time.time()
+
+def expire_idle_sessions():
+    """
+    Drop sessions that have been idle longer than SESSION_TTL_SECONDS.
+    Runs on the janitor thread; it only works on snapshots of the session dicts.
+    
+    Returns:
+        Number of sessions expired
+    """
+    global pending_session_id
+    now = time.time()
+    cutoff = now - config_store.current.session_ttl_seconds
+    # Sessions created before tracking started get a fresh timestamp
+    for session_id in list(image_context.keys()):
+        session_last_seen.setdefault(session_id, now)
+    
+    expired = [sid for sid, seen in list(session_last_seen.items()) if seen < cutoff]
+    for session_id in expired:
+        session_last_seen.pop(session_id, None)
+        image_context.pop(session_id, None)
+        injected_image_choice.pop(session_id, None)
+        detail_turns.pop(session_id, None)
+        for user_id, mapped_session_id in list(session_map.items()):
+            if mapped_session_id == session_id:
+                session_map.pop(user_id, None)
+        if pending_session_id == session_id:
+            pending_session_id = None
+    return len(expired)
+
+def live_image_files():
+    """Return the filenames of images (and their renditions) referenced by live sessions."""
+    live = set()
+    for filename in list(image_context.values()):
+        live.update(rendition_filenames(filename))
+    return live
+
+# --- Storage Janitor ---
+# Deletes unreferenced uploads and enforces a disk quota on a background thread.
+storage_janitor = StorageJanitor(
+    upload_dir=app.config['UPLOAD_FOLDER'],
+    audio_dir=AUDIO_FOLDER,
+    live_files=live_image_files,
+    expire_sessions=expire_idle_sessions,
+    quota_bytes=_startup_config.storage_quota_bytes,
+    interval=_startup_config.janitor_interval_seconds,
+    grace_seconds=_startup_config.janitor_grace_seconds,
+    on_delete=lambda path: hot_image_cache.discard(os.path.basename(path))
+)
+# --- End Storage Janitor ---
+
 # Configure logging
 logging.basicConfig(level=logging.INFO) 
 app.logger.setLevel(logging.INFO) 
 
+def store_uploaded_image(image_file):
+    """
+    Stream an uploaded file into the upload store under its content-addressed name.
+    
+    Args:
+        image_file: Werkzeug FileStorage from request.files
+        
+    Returns:
+        StoredImage for the saved file
+        
+    Raises:
+        UploadTooLarge: If the file exceeds MAX_UPLOAD_BYTES
+    """
+    config = config_store.current
+    stored_image = ingest_upload(
+        image_file.stream,
+        app.config['UPLOAD_FOLDER'],
+        extension=normalize_extension(image_file.filename),
+        max_bytes=config.max_upload_bytes,
+        chunk_size=config.upload_chunk_bytes
+    )
+    # Provider fetchers will request this image on the next turns
+    hot_image_cache.put_file(os.path.basename(stored_image.path), stored_image.path)
+    # Create the thumbnail and standard renditions once, off the request (decoding a large photo takes a while)
+    rendition_worker.schedule(stored_image.path, on_ready=cache_renditions)
+    return stored_image
+
+def cache_renditions(renditions):
+    """Put freshly generated renditions into the hot image cache."""
+    for name, path in renditions.items():
+        if name != "full":
+            hot_image_cache.put_file(os.path.basename(path), path)
+
+@app.errorhandler(413)
+def request_entity_too_large(error):
+    """Return a JSON error when a request body exceeds MAX_CONTENT_LENGTH."""
+    return jsonify({
+        "error": f"Upload too large. Maximum size is {config_store.current.max_upload_bytes} bytes."
+    }), 413
+
+@app.before_request
+def start_request_trace():
+    """Start the trace of a sampled request; stages anywhere in the request record spans into it."""
+    g.trace = tracer.start(request.headers, name=request.endpoint or request.path)
+
+@app.after_request
+def finish_request_profile(response):
+    """Write the profile and the trace of a request once its response (or stream) is done."""
+    profile = g.pop('profile', None)
+    if profile is not None and profile.enabled:
+        response.headers['X-Profile-Id'] = profile.profile_id
+        # For streams this runs after the last chunk was sent
+        response.call_on_close(profile.finish)
+    trace = g.pop('trace', None)
+    if trace is not None and trace.enabled:
+        trace.annotate(**{"http.status_code": response.status_code})
+        response.headers['X-Trace-Id'] = trace.trace_id
+        response.headers['traceparent'] = trace.traceparent
+        response.call_on_close(trace.finish)
+    return response
+
+def admission_rejected(error, openai_format=False):
+    """
+    Build a 429 response for a request shed by admission control.
+    
+    Args:
+        error: The AdmissionRejected exception
+        openai_format: Whether to use the OpenAI error body shape
+        
+    Returns:
+        Flask response with a Retry-After header
+    """
+    app.logger.warning(f"[Admission] Rejected request: {str(error)} (retry after {error.retry_after}s)")
+    if openai_format:
+        body = {"error": {"message": str(error), "type": "rate_limit_error", "code": 429}}
+    else:
+        body = {"error": str(error)}
+    response = jsonify(body)
+    response.status_code = 429
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response
+
 # Define the root route to serve the test form
 @app.route('/')
 def index():
@@ -65,19 +341,24 @@ def analyze_image():
     """
     Endpoint for image analysis that sends results to ElevenLabs for vocalization.
     Accepts image data as file upload or URL and returns analysis.
+    With ?voice=true&pipeline=true the analysis is streamed and vocalized
+    sentence by sentence as Server-Sent Events.
     """
     try:
         # Check if we have image data
-        image_data = None
+        stored_image = None
         image_url = None
         
-        # Check for file upload
+        # Check for file upload (streamed to disk, never read fully into memory)
         if 'image' in request.files:
-            image_file = request.files['image']
-            image_data = image_file.read()
+            stored_image = store_uploaded_image(request.files['image'])
         # Check for URL in JSON body
         elif request.is_json and 'image_url' in request.json:
             image_url = request.json['image_url']
+            if not isinstance(image_url, str) or not image_url:
+                return jsonify({
+                    "error": "image_url must be a non-empty string."
+                }), 400
         else:
             return jsonify({
                 "error": "No image provided. Please upload an image file or provide an image_url."
@@ -88,17 +369,19 @@ def analyze_image():
         if request.is_json and 'prompt' in request.json:
             prompt = request.json['prompt']
             
-        # Get LLM configuration from environment variables
-        llm_provider = os.getenv('LLM_PROVIDER', 'openai').lower()
-        api_key = os.getenv(f"{llm_provider.upper()}_API_KEY")
+        # Get LLM configuration from the current config snapshot
+        config = config_store.current
+        llm_provider = config.llm_provider
+        api_key = config.llm_api_key
 
-        if not api_key:
+        # Replaying recordings needs no provider key
+        if not api_key and llm_provider != "replay":
             return jsonify({
                 "error": f"API key for '{llm_provider}' not configured."
             }), 500
 
-        # Create LLM service
-        llm_service = create_llm_service(provider=llm_provider, api_key=api_key)
+        # Get the pooled LLM service
+        llm_service = get_llm_service(provider=llm_provider, api_key=api_key)
         
         # Prepare message with image
         messages = [
@@ -115,31 +398,93 @@ def analyze_image():
                 "type": "image_url",
                 "image_url": {"url": image_url}
             })
-        elif image_data:
-            # Process image dataa
-            base64_image = base64.b64encode(image_data).decode('utf-8')
-            data_url = f"data:image/jpeg;base64,{base64_image}"
+        elif stored_image:
+            # Pass the stored image as a memory-mapped payload; each provider
+            # encodes it (at most once) into the format it needs
             messages[1]["content"].append({
                 "type": "image_url",
-                "image_url": {"url": data_url}
+                "image_url": {"url": ImagePayload.from_file(stored_image.path)}
             })
             
+        # Check if we should send to ElevenLabs
+        send_to_elevenlabs = request.args.get('voice', 'false').lower() == 'true'
+        pipelined = request.args.get('pipeline', 'false').lower() == 'true'
+        
+        # Repeated analyses are answered from the cache (?cache=false forces a fresh one)
+        if stored_image:
+            image_id = stored_image.sha256
+        elif image_url.startswith('data:'):
+            image_id = hashlib.sha256(image_url.encode('utf-8')).hexdigest()
+        else:
+            # Remote images aren't downloaded here, so they are keyed by URL; the TTL
+            # bounds how long a changed image keeps its old analysis
+            image_id = image_url
+        cache_key = analysis_key(image_id, prompt, llm_provider, config.default_model)
+        cached = analysis_cache.get(cache_key) if request.args.get('cache', 'true').lower() != 'false' else None
+        if cached is not None:
+            app.logger.info(f"[Analysis cache] Hit for {cache_key[:12]}")
+            if send_to_elevenlabs and pipelined:
+                segments = cached_speech_segments(cached)
+                if segments is not None:
+                    return replay_pipelined_analysis(cached.analysis, segments)
+                return stream_pipelined_analysis(
+                    [cached.analysis],
+                    on_segments=lambda segments: analysis_cache.put_tts_segments(cache_key, segments,
+                                                                                 pipelined_speech_voice())
+                )
+            result = {
+                "status": "success",
+                "analysis": cached.analysis,
+                "cached": True
+            }
+            if send_to_elevenlabs:
+                elevenlabs_response = analysis_speech(cache_key, cached.analysis, cached)
+                if elevenlabs_response:
+                    result["elevenlabs"] = elevenlabs_response
+            return jsonify(result), 200
+        
+        # Analysis is batch work: it waits behind live voice turns for a provider slot
+        ticket = admission.acquire(llm_provider, BATCH)
+        usage = usage_ledger.tracker(llm_provider, config.default_model, endpoint="analyze",
+                                     stream=send_to_elevenlabs and pipelined,
+                                     images=[(stored_image.path if stored_image else None, "high")])
+        
+        if send_to_elevenlabs and pipelined:
+            # Stream the analysis and synthesize it sentence by sentence
+            try:
+                llm_response = llm_service.chat_completion(
+                    messages=messages,
+                    model=config.default_model,
+                    stream=True
+                )
+            except Exception:
+                ticket.release()
+                raise
+            return stream_pipelined_analysis(
+                iter_completion_text(usage.watch(llm_response)), ticket,
+                on_complete=lambda text: analysis_cache.put(cache_key, text, llm_provider, config.default_model),
+                on_segments=lambda segments: analysis_cache.put_tts_segments(cache_key, segments,
+                                                                             pipelined_speech_voice())
+            )
+        
         # Call LLM for analysis
-        response = llm_service.chat_completion(
-            messages=messages,
-            model=os.getenv('DEFAULT_MODEL', 'gpt-4o')
-        )
+        with ticket:
+            response = llm_service.chat_completion(
+                messages=messages,
+                model=config.default_model
+            )
+        usage.observe(response)
+        usage.finish()
         
         # Extract the analysis text
         analysis_text = response.choices[0].message.content
+        analysis_cache.put(cache_key, analysis_text, llm_provider, config.default_model)
         
-        # Check if we should send to ElevenLabs
-        send_to_elevenlabs = request.args.get('voice', 'false').lower() == 'true'
         elevenlabs_response = None
         
         if send_to_elevenlabs:
             # Send to ElevenLabs for vocalization
-            elevenlabs_response = send_to_elevenlabs_tts(analysis_text)
+            elevenlabs_response = analysis_speech(cache_key, analysis_text)
             
         # Return the analysis and optional ElevenLabs response
         result = {
@@ -152,6 +497,12 @@ def analyze_image():
             
         return jsonify(result), 200
             
+    except RequestEntityTooLarge as e:
+        return request_entity_too_large(e)
+    except UploadTooLarge as e:
+        return jsonify({"error": str(e)}), 413
+    except AdmissionRejected as e:
+        return admission_rejected(e)
     except Exception as e:
         print(f"Error in analyze_image: {str(e)}")
         import traceback
@@ -161,6 +512,206 @@ def analyze_image():
             "error": f"Error analyzing image: {str(e)}"
         }), 500
 
+def analysis_speech(cache_key, analysis_text, cached=None):
+    """
+    Vocalize an analysis, reusing the speech cached with it while its audio file exists.
+    
+    Args:
+        cache_key: Analysis cache key
+        analysis_text: The analysis to vocalize
+        cached: The cache entry, if the analysis came from the cache
+        
+    Returns:
+        ElevenLabs response dictionary, or None if failed
+    """
+    config = config_store.current
+    # The result depends on where the text went: the agent if one is set, else the voice
+    voice = f"agent:{config.elevenlabs_agent_id}" if config.elevenlabs_agent_id else f"voice:{config.elevenlabs_voice_id}"
+    if cached is not None and cached.tts and cached.tts_voice == voice:
+        audio_url = cached.tts.get("audio_url")
+        if not audio_url:
+            return cached.tts
+        # The janitor may have evicted the audio file since it was cached
+        audio_path = os.path.join(AUDIO_FOLDER, os.path.basename(audio_url))
+        if os.path.exists(audio_path):
+            storage_janitor.record_access(audio_path)
+            return cached.tts
+    
+    elevenlabs_response = send_to_elevenlabs_tts(analysis_text)
+    if elevenlabs_response and elevenlabs_response.get("status") == "success":
+        analysis_cache.put_tts(cache_key, elevenlabs_response, voice)
+    return elevenlabs_response
+
+def pipelined_speech_voice():
+    """Return the voice pipelined analyses are synthesized with, as stored with their cached segments."""
+    return f"voice:{config_store.current.elevenlabs_voice_id}"
+
+def cached_speech_segments(cached):
+    """
+    Return the pipelined speech cached with an analysis, if it was synthesized
+    with the current voice and all its audio files still exist.
+    
+    Args:
+        cached: The analysis cache entry
+        
+    Returns:
+        List of segments ({"index", "text", "elevenlabs"}), or None
+    """
+    if not cached.tts_segments or cached.tts_segments_voice != pipelined_speech_voice():
+        return None
+    audio_paths = []
+    for segment in cached.tts_segments:
+        audio_url = (segment.get("elevenlabs") or {}).get("audio_url")
+        if not audio_url:
+            return None
+        # The janitor may have evicted the audio file since it was cached
+        audio_path = os.path.join(AUDIO_FOLDER, os.path.basename(audio_url))
+        if not os.path.exists(audio_path):
+            return None
+        audio_paths.append(audio_path)
+    for audio_path in audio_paths:
+        storage_janitor.record_access(audio_path)
+    return cached.tts_segments
+
+def event_stream_response(events):
+    """Wrap a generator of SSE lines in an unbuffered text/event-stream response."""
+    response = Response(stream_with_context(events), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+def replay_pipelined_analysis(analysis_text, segments):
+    """
+    Return the SSE response of a pipelined analysis from its cached segments,
+    with the same events stream_pipelined_analysis() emits.
+    
+    Args:
+        analysis_text: The cached analysis
+        segments: Its cached speech segments (see cached_speech_segments())
+        
+    Returns:
+        Flask streaming response
+    """
+    def generate_segments():
+        for segment in segments:
+            event = {"type": "segment", "elapsed_ms": 0, "cached": True, **segment}
+            yield f"data: {json.dumps(event)}\n\n"
+        event = {
+            "type": "analysis",
+            "status": "success",
+            "analysis": analysis_text,
+            "cached": True
+        }
+        yield f"data: {json.dumps(event)}\n\n"
+        yield "data: [DONE]\n\n"
+    
+    return event_stream_response(generate_segments())
+
+def stream_pipelined_analysis(text_chunks, ticket=None, on_complete=None, on_segments=None):
+    """
+    Return an SSE response that vocalizes a streamed analysis as it is generated.
+    
+    Each complete sentence is sent to ElevenLabs TTS while the LLM keeps generating,
+    and a 'segment' event is emitted as soon as its audio is ready. A final
+    'analysis' event carries the full text.
+    
+    Args:
+        text_chunks: Iterable of analysis text fragments (e.g. from a streamed completion)
+        ticket: Admission ticket, released once the LLM stream is consumed
+        on_complete: Called with the full analysis text when it was generated without error
+        on_segments: Called after on_complete with the segments ({"index", "text",
+            "elevenlabs"}) when every sentence was synthesized successfully
+        
+    Returns:
+        Flask streaming response
+    """
+    api_key = config_store.current.elevenlabs_api_key
+    
+    def synthesize(sentence):
+        if not api_key:
+            return {"status": "error", "message": "ELEVENLABS_API_KEY not configured"}
+        return generate_elevenlabs_audio(sentence, api_key)
+    
+    def generate_segments():
+        start_time = time.time()
+        analysis_parts = []
+        segments = []
+        
+        def text_stream():
+            try:
+                for text in text_chunks:
+                    analysis_parts.append(text)
+                    yield text
+            finally:
+                # TTS may still be running, but the provider slot is free
+                if ticket:
+                    ticket.release()
+        
+        try:
+            for index, sentence, tts_result in pipeline_speech(text_stream(), synthesize):
+                elapsed_ms = int((time.time() - start_time) * 1000)
+                if index == 0:
+                    app.logger.info(f"[Pipelined TTS] First audio segment ready after {elapsed_ms} ms")
+                segments.append({"index": index, "text": sentence, "elevenlabs": tts_result})
+                event = {
+                    "type": "segment",
+                    "index": index,
+                    "text": sentence,
+                    "elapsed_ms": elapsed_ms,
+                    "elevenlabs": tts_result
+                }
+                yield f"data: {json.dumps(event)}\n\n"
+            
+            analysis_text = "".join(analysis_parts)
+            if on_complete:
+                on_complete(analysis_text)
+            if on_segments and segments and all((segment["elevenlabs"] or {}).get("status") == "success"
+                                                for segment in segments):
+                on_segments(segments)
+            event = {
+                "type": "analysis",
+                "status": "success",
+                "analysis": analysis_text
+            }
+            yield f"data: {json.dumps(event)}\n\n"
+        except Exception as e:
+            app.logger.error(f"Error during pipelined analysis: {str(e)}")
+            yield f"data: {json.dumps({'type': 'error', 'error': str(e)})}\n\n"
+        yield "data: [DONE]\n\n"
+    
+    response = event_stream_response(generate_segments())
+    # Also release if the client goes away before the stream starts
+    if ticket:
+        response.call_on_close(ticket.release)
+    return response
+
+def subscription_stream_response(subscription):
+    """
+    Return an SSE response that relays a single-flight subscription.
+    
+    Args:
+        subscription: Subscription to the shared upstream stream
+        
+    Returns:
+        Flask streaming response
+    """
+    def relay():
+        try:
+            for sse_data in subscription:
+                yield sse_data
+        except Exception as e:
+            # The shared upstream call failed or could not be made
+            app.logger.error(f"Error in shared stream {subscription.flight.key[:12]}: {str(e)}")
+            yield f"data: {json.dumps({'error': str(e)})}\n\n"
+            yield "data: [DONE]\n\n"
+    
+    response = Response(stream_with_context(relay()), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    # Leave the flight even if the client goes away before the stream starts
+    response.call_on_close(subscription.close)
+    return response
+
 @app.route('/v1/chat/completions', methods=['POST', 'OPTIONS'])
 @app.route('/v1/chat/completions/chat/completions', methods=['POST', 'OPTIONS'])  # Handle duplicate path pattern from ElevenLabs
 def chat_completions():
@@ -168,6 +719,11 @@ def chat_completions():
     OpenAI-compatible chat completions endpoint for ElevenLabs integration.
     Handles image injection based on session mapping.
     """
+    # Stage timers for this request (a no-op unless it is profiled), recorded into its trace too
+    g.profile = profiler.start(request.headers, name="chat_completions")
+    profile = join(g.profile, g.get('trace', NULL_PROFILE))
+    turn_started = time.perf_counter()
+
     # --- BEGIN ADDED LOGGING ---
     app.logger.info(f"====================\n NEW REQUEST at /v1/chat/completions ====================")
     app.logger.info(f"Timestamp: {time.strftime('%Y-%m-%d %H:%M:%S')}")
@@ -203,6 +759,7 @@ def chat_completions():
         app.logger.error(traceback.format_exc())
     app.logger.info(f"==================== End Request Details ====================")
     # --- END ADDED LOGGING ---
+    profile.lap("request_logging")
 
     # Handle OPTIONS request for CORS preflight
     if request.method == 'OPTIONS':
@@ -248,8 +805,12 @@ def chat_completions():
                 }
             }), 400
         
+        config = config_store.current
+        # Time budget of the whole turn; provider calls and image fetches get what is left
+        turn_deadline = Deadline(config.turn_deadline_seconds)
+        
         # Extract key parameters
-        model = data.get('model', os.getenv('DEFAULT_MODEL', 'gpt-4o')) 
+        model = data.get('model', config.default_model) 
         messages = data.get('messages', [])
         temperature = data.get('temperature') 
         max_tokens = data.get('max_tokens')
@@ -264,6 +825,7 @@ def chat_completions():
                     "code": 400
                 }
             }), 400
+        profile.lap("parse_request")
         
         # --- EXTENSIVE DEBUGGING for ElevenLabs Request ---
         app.logger.info(f"=== FULL REQUEST DATA IN /v1/chat/completions ===\n{json.dumps(data, indent=2)}")
@@ -316,14 +878,16 @@ def chat_completions():
                 app.logger.info(f"📌 FALLBACK: No user_id, but we have pending_session_id: {pending_session_id}")
                 session_id = pending_session_id
         # --- End Session Linking --- 
+        profile.lap("session_linking")
 
         # --- LLM Service Integration --- 
-        # Get LLM configuration from environment variables
-        llm_provider = os.getenv('LLM_PROVIDER', 'openai').lower()
-        api_key = os.getenv(f"{llm_provider.upper()}_API_KEY")
+        # Get LLM configuration from the current config snapshot
+        llm_provider = config.llm_provider
+        api_key = config.llm_api_key
 
-        if not api_key:
-            app.logger.error(f"Error: API key for provider '{llm_provider}' not found in environment variables.")
+        # Replaying recordings needs no provider key
+        if not api_key and llm_provider != "replay":
+            app.logger.error(f"Error: API key for provider '{llm_provider}' not configured.")
             return jsonify({
                 "error": {
                     "message": f"API key for '{llm_provider}' not configured.",
@@ -333,7 +897,7 @@ def chat_completions():
             }), 500
 
         try:
-            llm_service: LLMService = create_llm_service(provider=llm_provider, api_key=api_key)
+            llm_service: LLMService = get_llm_service(provider=llm_provider, api_key=api_key)
         except ValueError as e:
             app.logger.error(f"Error creating LLM service: {str(e)}")
             return jsonify({
@@ -344,6 +908,7 @@ def chat_completions():
                 }
             }), 500
         # --- End LLM Service Integration ---
+        profile.lap("service_lookup")
 
         # --- Image URL Injection Logic --- 
         # Check if an image is associated with this session_id and inject its URL
@@ -362,18 +927,47 @@ def chat_completions():
                 session_map[elevenlabs_user_id] = session_id
                 app.logger.info(f"🔄 Created FALLBACK mapping for elevenlabs_user_id: {elevenlabs_user_id}")
         
+        injected_images = []
+        # Whether this turn is known to be about the image (the first look, or a detail request)
+        image_needed = False
         if session_id: 
+            touch_session(session_id)
+            
             # Check if there's an image associated with this session
             image_filename = image_context.get(session_id)
             app.logger.info(f"🖼️ Looking for image with session_id: {session_id}, found: {image_filename}")
             
             if image_filename:
+                choice = injected_image_choice.get(session_id)
+                first_look = choice is None or choice[0] != image_filename
+                image_needed = first_look
+                # With a provider-side chat the image message must not change between turns
+                pinned = llm_service.keeps_chat_sessions
+                if first_look:
+                    detail_turns.pop(session_id, None)
+                if pinned and not first_look:
+                    _, served_filename, detail = choice
+                else:
+                    if pinned:
+                        rendition, detail = rendition_policy.select_pinned(messages)
+                    else:
+                        rendition, detail = rendition_policy.select(messages, first_look,
+                                                                    trivial=routing_policy.is_trivial(messages))
+                    served_filename = rendition_filename(image_filename, rendition)
+                    if not os.path.exists(os.path.join(app.config['UPLOAD_FOLDER'], served_filename)):
+                        # Rendition not generated yet (or a legacy upload): use the original
+                        served_filename = image_filename
+                        rendition_worker.schedule(os.path.join(app.config['UPLOAD_FOLDER'], image_filename),
+                                                  on_ready=cache_renditions)
+                    injected_image_choice[session_id] = (image_filename, served_filename, detail)
+                
                 # Use the request's host URL instead of relying on environment variable
                 base_url = request.host_url.rstrip('/')
                 
                 # Construct the full public URL for the image
-                public_image_url = f"{base_url}/serve_image/{image_filename}"
-                app.logger.info(f"Injecting image URL: {public_image_url} for session: {session_id}")
+                public_image_url = f"{base_url}/serve_image/{served_filename}"
+                app.logger.info(f"Injecting image URL: {public_image_url} (detail: {detail}) for session: {session_id}")
+                injected_images.append((os.path.join(app.config['UPLOAD_FOLDER'], served_filename), detail))
 
                 # Create the OpenAI-compatible message structure for the image
                 image_message = {
@@ -387,12 +981,39 @@ def chat_completions():
                             "type": "image_url",
                             "image_url": {
                                 "url": public_image_url,
-                                "detail": "auto" 
+                                "detail": detail 
                             }
                         }
                     ]
                 }
                 
+                # With a pinned image message, a later request for detail gets the full image as
+                # an extra turn just before the question. The turn is inserted again before that
+                # question on every later turn, so the history the provider holds stays a prefix
+                if pinned and (served_filename, detail) != (image_filename, "high"):
+                    asked = detail_turns.setdefault(session_id, set())
+                    if not first_look and messages and messages[-1].get('role') == 'user' \
+                            and rendition_policy.wants_detail(messages):
+                        asked.add(message_fingerprint(messages[-1]))
+                        injected_images.append((os.path.join(app.config['UPLOAD_FOLDER'], image_filename), "high"))
+                        image_needed = True
+                    if asked:
+                        full_image_url = f"{base_url}/serve_image/{image_filename}"
+                        full_image_message = {
+                            "role": "user",
+                            "content": [
+                                {"type": "text", "text": "(System note: Full-resolution version of the shared image.)"},
+                                {"type": "image_url", "image_url": {"url": full_image_url, "detail": "high"}}
+                            ]
+                        }
+                        with_detail_turns = []
+                        for msg in messages:
+                            if msg.get('role') == 'user' and message_fingerprint(msg) in asked:
+                                with_detail_turns.append(full_image_message)
+                            with_detail_turns.append(msg)
+                        messages = with_detail_turns
+                        app.logger.info(f"Added full-resolution image turn for detail requests: {full_image_url}")
+                
                 # Insert the image message into the list at position 1 (after system prompt)
                 # This ensures the image is analyzed in the context of the system prompt
                 if messages and len(messages) > 0: 
@@ -420,6 +1041,15 @@ def chat_completions():
             app.logger.warning("Could not determine session_id for image lookup.")
             
         # --- End Image URL Injection Logic ---
+        profile.lap("image_injection")
+        
+        # Pick the model for this turn (e.g. a faster one for "yes" or "thanks")
+        route = routing_policy.route(messages, model, image_needed=image_needed)
+        if route.model != model:
+            app.logger.info(f"[Routing] {route.route}: {model} -> {route.model} ({route.reason})")
+        model = route.model
+        profile.annotate(provider=llm_provider, model=model, stream=stream, session_id=session_id,
+                         messages=len(messages), images=len(injected_images), route=route.route)
 
         # Log the request for debugging (moved down slightly)
         print(f"Received request for /v1/chat/completions using {llm_provider} model {model}")
@@ -430,65 +1060,191 @@ def chat_completions():
         print(f"Request data keys: {list(safe_data.keys())}")
         
         # --- Call LLM Service (MODIFIED FOR TESTING) --- 
+        subscription = None
+        if stream:
+            # ElevenLabs sometimes re-sends a turn (possibly on the duplicated route)
+            # while the first copy is still streaming; the copy joins that stream
+            subscription, is_leader = single_flight.subscribe(request_fingerprint({
+                "provider": llm_provider,
+                "model": model,
+                "temperature": temperature,
+                "max_tokens": max_tokens,
+                "messages": messages
+            }))
+            profile.lap("single_flight")
+            if not is_leader:
+                app.logger.info(f"[Single-flight] Joined in-flight stream {subscription.flight.key[:12]}")
+                profile.annotate(single_flight="follower")
+                return subscription_stream_response(subscription)
+        
+        # Voice turns are interactive: they are admitted ahead of queued batch work
         try:
-            # Pass the potentially modified messages list to the LLM service
-            llm_response = llm_service.chat_completion(
-                messages=messages,
-                model=model,
-                temperature=temperature,
-                max_tokens=max_tokens,
-                stream=stream 
-            )
+            ticket = admission.acquire(llm_provider, INTERACTIVE)
+        except AdmissionRejected as e:
+            if subscription:
+                subscription.flight.fail(e)
+                subscription.close()
+            raise
+        profile.lap("admission_wait")
+        stream_owns_ticket = False
+        usage = usage_ledger.tracker(llm_provider, model, session_id=session_id, endpoint="chat_completions",
+                                     stream=stream, images=injected_images)
+        try:
+            def call_provider():
+                # Pass the potentially modified messages list to the LLM service
+                with turn_deadline.activate():
+                    response = llm_service.chat_completion(
+                        messages=messages,
+                        model=model,
+                        temperature=temperature,
+                        max_tokens=max_tokens,
+                        stream=stream,
+                        session_id=session_id
+                    )
+                profile.lap("provider_call")
+                return response
+            
+            # Images make the model much slower to start; optionally speak a short
+            # acknowledgement at once and let the stream make the provider call after it
+            acknowledge = stream and bool(injected_images) and config.vision_ack and bool(config.vision_ack_text)
+            llm_response = None if acknowledge else call_provider()
             
             # Handle streaming response if stream=True
             if stream:
                 # Define a generator function to yield chunks from real LLM response
                 def generate_chunks():
+                    nonlocal llm_response
+                    streamed_tokens = 0
+                    completed = False
+                    first_content_at = None
+                    first_token_at = None
                     try:
                         app.logger.info(">>> Starting generate_chunks with LLM response")
+                        if acknowledge:
+                            first_content_at = time.perf_counter()
+                            yield f"data: {json.dumps(ack_chunk(config.vision_ack_text, model))}\n\n"
+                            profile.lap("vision_ack")
+                            llm_response = call_provider()
                         for chunk in llm_response:
+                            profile.mark("first_chunk")
+                            usage.observe(chunk)
+                            if not chunk.choices and chunk.usage:
+                                # The usage-only final chunk we asked for; the client didn't
+                                continue
+                            # Stop generating once the turn is out of time
+                            turn_deadline.check("stream")
+                            
                             # Process the chunk (convert to string, format as SSE, etc.)
                             # Assuming the chunk object has a structure we can serialize
                             content_delta = ""
                             if chunk.choices and chunk.choices[0].delta:
                                 content_delta = chunk.choices[0].delta.content or ""
+                            if content_delta:
+                                streamed_tokens += 1
+                                if first_token_at is None:
+                                    first_token_at = time.perf_counter()
+                                    first_content_at = first_content_at or first_token_at
+                                    profile.lap("first_token")
                             
                             # More complete approach: yield OpenAI-like chunk structure
-                            chunk_dict = chunk.model_dump() 
-                            sse_data = f"data: {json.dumps(chunk_dict)}\n\n"
+                            with profile.accumulate("sse_serialization"):
+                                chunk_dict = chunk.model_dump() 
+                                sse_data = f"data: {json.dumps(chunk_dict)}\n\n"
                             yield sse_data
                             app.logger.info(f"DEBUG: Sent LLM chunk: {sse_data[:100]}...")
                             
+                        completed = True
+                        profile.lap("stream")
+                        usage.finish()
                         # Send final DONE signal
                         done_signal = "data: [DONE]\n\n"
                         yield done_signal
                         app.logger.info(f"DEBUG: Sent [DONE] signal")
+                    except GeneratorExit:
+                        # Every client of the stream went away (e.g. the user barged in)
+                        if not completed:
+                            app.logger.info(f"Client disconnected after {streamed_tokens} chunks, aborting the upstream stream")
+                            turn_stats.record_cancelled(streamed_tokens)
+                        raise
                     except Exception as e:
-                        app.logger.error(f"Error during streaming: {str(e)}")
+                        if isinstance(e, DeadlineExceeded) or turn_deadline.expired:
+                            app.logger.warning(f"Stream cut off: {str(e)}")
+                            # After an acknowledgement, the provider call itself runs in here
+                            turn_stats.record_deadline("stream" if llm_response is not None else "provider_call")
+                        else:
+                            app.logger.error(f"Error during streaming: {str(e)}")
                         # Optionally yield an error event
                         yield f"data: {json.dumps({'error': str(e)})}\n\n"
                         yield "data: [DONE]\n\n" # Still send DONE even after error
                     finally:
+                        if not completed:
+                            # Drop the provider connection so it stops generating (and billing)
+                            close_upstream(llm_response)
+                            # Tokens generated so far are still paid for
+                            usage.finish()
+                        route_stats.record(
+                            route,
+                            first_token_at - turn_started if first_token_at is not None else None,
+                            time.perf_counter() - turn_started if completed else None
+                        )
+                        if first_content_at is not None:
+                            ttft_stats.record(
+                                acknowledge,
+                                first_content_at - turn_started,
+                                first_token_at - turn_started if first_token_at is not None else None
+                            )
+                        ticket.release()
                         app.logger.info("<<< Exiting generate_chunks")
                 
                 # Return a streaming response using the real LLM service now that we've verified connectivity
                 app.logger.info(">>> Using REAL LLM STREAMING response <<<")
-                response = Response(stream_with_context(generate_chunks()), mimetype='text/event-stream')
-                # Add headers that might help with cross-origin streaming
-                response.headers['Cache-Control'] = 'no-cache'
-                response.headers['X-Accel-Buffering'] = 'no'  
-                return response
+                # The chunks are fanned out to this client and any duplicates that join;
+                # the provider slot is released when the shared stream ends or is abandoned
+                subscription.flight.start(generate_chunks(), on_finish=ticket.release)
+                stream_owns_ticket = True
+                return subscription_stream_response(subscription)
             else:
                 # Non-streaming: Use the real LLM response
                 app.logger.info(">>> Returning NON-STREAMING real LLM response <<<")
+                usage.observe(llm_response)
+                usage.finish()
+                route_stats.record(route, None, time.perf_counter() - turn_started)
                 # Convert the ChatCompletion object to a dictionary before jsonify
-                return jsonify(llm_response.model_dump())
+                with profile.stage("serialization"):
+                    return jsonify(llm_response.model_dump())
         
         except Exception as e:
+            route_stats.record(route, None, None)
+            if isinstance(e, DeadlineExceeded) or turn_deadline.expired:
+                # Provider timeouts are sized to the deadline, so this is the turn running out of time
+                app.logger.warning(f"Turn deadline of {config.turn_deadline_seconds:g}s exceeded: {str(e)}")
+                turn_stats.record_deadline("provider_call")
+                return jsonify({
+                    "error": {
+                        "message": f"The turn did not complete within {config.turn_deadline_seconds:g} seconds",
+                        "type": "timeout_error",
+                        "code": 504
+                    }
+                }), 504
             app.logger.error(f"Error during LLM processing or response generation in /v1/chat/completions: {e}")
             import traceback
             app.logger.error(traceback.format_exc())
+            return jsonify({
+                "error": {
+                    "message": f"Internal server error: {str(e)}",
+                    "type": "server_error",
+                    "code": 500
+                }
+            }), 500
+        finally:
+            if not stream_owns_ticket:
+                ticket.release()
+                if subscription:
+                    subscription.flight.fail(RuntimeError("The upstream request failed"))
+                    subscription.close()
     
+    except AdmissionRejected as e:
+        return admission_rejected(e, openai_format=True)
     except json.JSONDecodeError:
         print("Error: Invalid JSON in request body")
         return jsonify({
@@ -586,7 +1342,7 @@ def upload_image_get_url():
     This endpoint:
     1. Receives the image file and session_id
     2. Validates the file
-    3. Saves it with a unique filename
+    3. Streams it to disk under its content-addressed filename
     4. Stores the mapping in image_context using session_id
     5. Returns the public URL
     """
@@ -610,16 +1366,13 @@ def upload_image_get_url():
             app.logger.error("Upload error: No session_id provided")
             return jsonify({"error": "No session_id provided"}), 400
         
-        # Generate a unique filename (to prevent overwrites/collisions)
-        file_extension = os.path.splitext(image_file.filename)[1].lower()
-        unique_filename = f"{uuid.uuid4()}{file_extension}"
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], unique_filename)
-        
-        # Save the image file
-        image_file.save(file_path)
+        # Save the image under its content hash (identical uploads share one file)
+        stored_image = store_uploaded_image(image_file)
+        unique_filename = stored_image.filename
         
         # Store mapping in image_context using session_id
         image_context[session_id] = unique_filename
+        touch_session(session_id)
         app.logger.info(f"Saved image for session {session_id}: {unique_filename}")
         
         # Construct public URL for the image 
@@ -633,6 +1386,11 @@ def upload_image_get_url():
             "public_image_url": public_image_url,
             "session_id": session_id 
         })
+    except RequestEntityTooLarge as e:
+        return request_entity_too_large(e)
+    except UploadTooLarge as e:
+        app.logger.warning(f"Upload rejected: {str(e)}")
+        return jsonify({"error": str(e)}), 413
     except Exception as e:
         app.logger.error(f"Error in upload_image_get_url: {str(e)}")
         return jsonify({"error": f"Server error: {str(e)}"}), 500
@@ -640,16 +1398,59 @@ def upload_image_get_url():
 @app.route('/serve_image/<filename>')
 def serve_image(filename):
     """Securely serve an image file from the UPLOAD_FOLDER.
-    This uses Flask's send_from_directory which handles security concerns
-    like path traversal attacks.
+    An optional ?rendition=thumb|standard|full query parameter selects a
+    rendition of the upload; the original is served until the rendition has
+    been generated.
+    Responses carry a strong ETag derived from the content hash and support
+    conditional requests (304) and byte ranges. Content-addressed names are
+    marked immutable. Recently uploaded images are served from memory; other
+    files go through the WSGI file wrapper (zero-copy sendfile where the server
+    supports it) or X-Sendfile when USE_X_SENDFILE is enabled.
     """
     try:
         app.logger.debug(f"Serving image: {filename}")
-        # Sanitize filename (extra security on top of send_from_directory)
+        # Sanitize filename (safe_join additionally rejects path traversal)
         safe_filename = os.path.basename(filename)
+        rendition = request.args.get('rendition')
+        if rendition:
+            if rendition not in RENDITIONS:
+                return jsonify({"error": f"Unknown rendition '{rendition}'. Use one of: {', '.join(RENDITIONS)}"}), 400
+            rendition_name = rendition_filename(safe_filename, rendition)
+            original_path = safe_join(app.config['UPLOAD_FOLDER'], safe_filename)
+            if rendition_name != safe_filename and original_path and os.path.isfile(original_path) and \
+                    not os.path.isfile(os.path.join(app.config['UPLOAD_FOLDER'], rendition_name)):
+                # Not generated yet (or a legacy upload): serve the original, make the rendition for next time
+                rendition_worker.schedule(original_path, on_ready=cache_renditions)
+            else:
+                safe_filename = rendition_name
+        file_path = safe_join(app.config['UPLOAD_FOLDER'], safe_filename)
+        if not file_path or not os.path.isfile(file_path):
+            raise FileNotFoundError(safe_filename)
+        
+        content_hash = content_hash_from_name(safe_filename)
+        etag = content_hash or file_sha256(file_path)
+        max_age = IMMUTABLE_IMAGE_MAX_AGE if content_hash else 0
         
-        # Use Flask's secure file serving function
-        return send_from_directory(app.config['UPLOAD_FOLDER'], safe_filename)
+        cached_bytes = hot_image_cache.get(safe_filename)
+        if cached_bytes is not None:
+            response = send_file(
+                io.BytesIO(cached_bytes),
+                download_name=safe_filename,
+                etag=etag,
+                last_modified=os.path.getmtime(file_path),
+                conditional=True,
+                max_age=max_age
+            )
+        else:
+            response = send_file(file_path, etag=etag, conditional=True, max_age=max_age)
+        storage_janitor.record_access(file_path)
+        
+        if content_hash:
+            response.cache_control.immutable = True
+        else:
+            # Legacy names may be overwritten; clients must revalidate with the ETag
+            response.cache_control.no_cache = True
+        return response
     except FileNotFoundError:
         app.logger.warning(f"Image not found: {filename}")
         return jsonify({"error": "Image not found"}), 404
@@ -657,56 +1458,178 @@ def serve_image(filename):
         app.logger.error(f"Error serving image {filename}: {str(e)}")
         return jsonify({"error": f"Server error: {str(e)}"}), 500
 
+def mint_elevenlabs_signed_url():
+    """
+    Request a new signed conversation URL from ElevenLabs.
+    
+    Returns:
+        The signed URL
+        
+    Raises:
+        requests.exceptions.RequestException: If the ElevenLabs request fails
+        ValueError: If credentials are missing or the response has no URL
+    """
+    config = config_store.current
+    api_key = config.elevenlabs_api_key
+    agent_id = config.elevenlabs_agent_id
+    if not api_key or not agent_id:
+        raise ValueError("Server configuration error: Missing ElevenLabs credentials.")
+
+    elevenlabs_api_endpoint = f"{config.elevenlabs_api_base}/v1/convai/conversation/get_signed_url?agent_id={agent_id}"
+    headers = {
+        "xi-api-key": api_key
+    }
+
+    # Use GET method as per the ElevenLabs documentation
+    with stage("elevenlabs.signed_url"):
+        response = get_session().get(elevenlabs_api_endpoint, headers=headers)
+    response.raise_for_status()  # Raise HTTPError for bad responses (4xx or 5xx)
+    
+    signed_url_data = response.json()
+    
+    # Check for common field names in the response
+    for field in ['url', 'signed_url', 'signedUrl']:
+        if signed_url_data.get(field):
+            app.logger.info(f"[ElevenLabs URL Gen] Minted signed URL (found in field: {field})")
+            return signed_url_data[field]
+
+    app.logger.error(f"[ElevenLabs URL Gen] Error: 'url' not found in ElevenLabs response: {signed_url_data}")
+    raise ValueError("Failed to get signed URL from ElevenLabs.")
+
+# --- Signed URL Pool ---
+# Signed URLs are minted in the background so page loads don't wait on ElevenLabs.
+signed_url_pool = SignedUrlPool(
+    mint=mint_elevenlabs_signed_url,
+    depth=_startup_config.signed_url_pool_depth,
+    refill_interval=_startup_config.signed_url_pool_refill_seconds,
+    ttl=_startup_config.signed_url_ttl_seconds
+)
+# --- End Signed URL Pool ---
+
+# --- Dependency Warmup ---
+def warmup_targets():
+    """Return the dependencies of the current configuration as {name: warm-up callable}."""
+    config = config_store.current
+    provider = config.llm_provider
+    api_key = config.llm_api_key
+    
+    def warm_llm():
+        if not api_key and provider != "replay":
+            raise ValueError(f"API key for '{provider}' not configured")
+        # Creating the pooled service here also moves the SDK import off the request path
+        get_llm_service(provider=provider, api_key=api_key).warmup()
+    
+    targets = {f"llm:{provider}": warm_llm}
+    if config.elevenlabs_api_key:
+        targets["elevenlabs"] = lambda: probe(config.elevenlabs_api_base)
+    return targets
+
+# Pre-opens pooled connections at startup, keeps them alive while idle and backs /ready
+dependency_warmer = DependencyWarmer(
+    targets=warmup_targets,
+    interval=_startup_config.warmup_interval_seconds,
+    failure_threshold=_startup_config.warmup_failure_threshold
+)
+# --- End Dependency Warmup ---
+
+def on_config_reload(old_config, new_config):
+    """Invalidate pooled clients and pre-minted URLs that depend on reloaded settings."""
+    clear_llm_service_cache()
+    app.logger.info("[Config] Cleared pooled LLM provider clients")
+    
+    app.config['MAX_CONTENT_LENGTH'] = new_config.max_upload_bytes + MULTIPART_OVERHEAD_BYTES
+    app.config['USE_X_SENDFILE'] = new_config.use_x_sendfile
+    hot_image_cache.max_bytes = new_config.image_hot_cache_bytes
+    analysis_cache.ttl_seconds = new_config.analysis_cache_ttl_seconds
+    analysis_cache.max_entries = new_config.analysis_cache_max_entries
+    storage_janitor.quota_bytes = new_config.storage_quota_bytes
+    storage_janitor.interval = new_config.janitor_interval_seconds
+    storage_janitor.grace_seconds = new_config.janitor_grace_seconds
+    
+    global rendition_policy, routing_policy
+    rendition_policy = RenditionPolicy(zoom_pattern=new_config.image_zoom_pattern)
+    routing_policy = build_routing_policy(new_config)
+    
+    admission.update_limits(
+        max_concurrent=new_config.admission_max_concurrent,
+        max_queue=new_config.admission_max_queue,
+        max_wait=new_config.admission_max_wait_seconds
+    )
+    
+    profiler.directory = new_config.profile_dir
+    profiler.header = new_config.profile_header
+    profiler.sample_rate = new_config.profile_sample_rate
+    profiler.sample_mode = new_config.profile_sample_mode
+    tracer.path = new_config.trace_file
+    tracer.sample_rate = new_config.trace_sample_rate
+    tracer.service_name = new_config.trace_service_name
+    tracer.max_bytes = new_config.trace_max_bytes
+    configure_fetching(new_config)
+    
+    dependency_warmer.interval = new_config.warmup_interval_seconds
+    dependency_warmer.failure_threshold = new_config.warmup_failure_threshold
+    # The provider or credentials may have changed: warm the new clients now
+    dependency_warmer.trigger()
+    
+    signed_url_pool.depth = new_config.signed_url_pool_depth
+    signed_url_pool.refill_interval = new_config.signed_url_pool_refill_seconds
+    signed_url_pool.ttl = new_config.signed_url_ttl_seconds
+    if (old_config.elevenlabs_api_key, old_config.elevenlabs_agent_id) != \
+            (new_config.elevenlabs_api_key, new_config.elevenlabs_agent_id):
+        signed_url_pool.clear()
+        app.logger.info("[Config] ElevenLabs credentials changed, discarded pooled signed URLs")
+    if new_config.elevenlabs_api_key:
+        signed_url_pool.start()
+
+# Settings only read when their component is created at startup
+RESTART_REQUIRED_FIELDS = ("usage_db_path", "usage_flush_seconds", "analysis_cache_path", "config_watch_interval")
+
+def warn_restart_required(old_config, new_config):
+    """Warn about changed settings that the reload cannot apply to the running process."""
+    changed = [name for name in RESTART_REQUIRED_FIELDS if getattr(old_config, name) != getattr(new_config, name)]
+    if changed:
+        app.logger.warning(f"[Config] Restart required to apply: {', '.join(changed)}")
+
+config_store.add_listener(on_config_reload)
+config_store.add_listener(warn_restart_required)
+
+def start_background_workers():
+    """
+    Start the server's background threads: the usage ledger writer, the storage
+    janitor, the signed URL pool, the dependency warmer and the config watcher.
+    
+    Called by the server entry point (WSGI deployments call it once the app is
+    loaded), never on import: importing this module from a benchmark or a test
+    must not delete files or contact providers. Calling it again does nothing.
+    """
+    usage_ledger.start()
+    storage_janitor.start()
+    if config_store.current.elevenlabs_api_key:
+        signed_url_pool.start()
+    dependency_warmer.start()
+    config_store.start_watching(interval=_startup_config.config_watch_interval)
+
 @app.route('/api/elevenlabs/get-signed-url', methods=['GET'])
 def get_elevenlabs_signed_url():
-    """Generate a temporary signed URL and a unique session ID.
+    """Hand out a signed URL and a unique session ID.
 
-    1. Calls ElevenLabs API to get a signed URL.
+    1. Takes a pre-minted signed URL from the pool (or mints one on demand).
     2. Generates a unique session ID (UUID).
     3. Stores the session ID temporarily as pending.
     4. Returns both the signed URL and the session ID to the frontend.
     """
     global pending_session_id 
-    load_dotenv() 
-    api_key = os.getenv('ELEVENLABS_API_KEY')
-    app.logger.info(f"[ElevenLabs URL Gen] Retrieved API Key: {'********' + api_key[-4:] if api_key else 'Not Found'}")
-    # Force using the correct agent ID from .env - this overrides any cached value
-    agent_id = "al0xrBMlL3qchebAFV9N"  # Directly use the correct agent ID
+    agent_id = config_store.current.elevenlabs_agent_id
     app.logger.info(f"[ElevenLabs URL Gen] Using Agent ID: {agent_id}")
 
-    if not api_key or not agent_id:
-        app.logger.error("[ElevenLabs URL Gen] Error: API Key or Agent ID missing.")
-        return jsonify({"error": "Server configuration error: Missing ElevenLabs credentials."}), 500
-
-    elevenlabs_api_endpoint = f"https://api.elevenlabs.io/v1/convai/conversation/get_signed_url?agent_id={agent_id}"
-    headers = {
-        "xi-api-key": api_key
-    }
-
     try:
-        # Use GET method as per the ElevenLabs documentation
-        response = requests.get(elevenlabs_api_endpoint, headers=headers)
-        response.raise_for_status()  # Raise HTTPError for bad responses (4xx or 5xx)
-        
-        signed_url_data = response.json()
-        # Log the full response to see its structure
-        app.logger.info(f"[ElevenLabs URL Gen] Response received: {signed_url_data}")
-        
-        # Check for common field names in the response
-        signed_url = None
-        for field in ['url', 'signed_url', 'signedUrl']:
-            if field in signed_url_data:
-                signed_url = signed_url_data.get(field)
-                app.logger.info(f"[ElevenLabs URL Gen] Found URL in field: {field}")
-                break
-
-        if not signed_url:
-            app.logger.error("[ElevenLabs URL Gen] Error: 'url' not found in ElevenLabs response.")
-            return jsonify({"error": "Failed to get signed URL from ElevenLabs."}), 500
+        signed_url, from_pool = signed_url_pool.acquire()
+        app.logger.info(f"[ElevenLabs URL Gen] Signed URL served {'from pool' if from_pool else 'on demand'}")
             
         # Generate a unique session ID
         session_id = str(uuid.uuid4())
         pending_session_id = session_id 
+        touch_session(session_id)
         app.logger.info(f"[ElevenLabs URL Gen] Generated Session ID: {session_id}")
 
         return jsonify({
@@ -718,6 +1641,9 @@ def get_elevenlabs_signed_url():
     except requests.exceptions.RequestException as e:
         app.logger.error(f"[ElevenLabs URL Gen] HTTP Request failed: {str(e)}")
         return jsonify({"error": f"Failed to communicate with ElevenLabs API: {str(e)}"}), 502
+    except ValueError as e:
+        app.logger.error(f"[ElevenLabs URL Gen] Error: {str(e)}")
+        return jsonify({"error": str(e)}), 500
     except Exception as e:
         app.logger.error(f"[ElevenLabs URL Gen] Unexpected error: {str(e)}")
         return jsonify({"error": f"An unexpected error occurred: {str(e)}"}), 500
@@ -734,14 +1660,16 @@ def send_to_elevenlabs_tts(text):
         Dictionary with response information or None if failed
     """
     try:
-        # Get ElevenLabs API key from environment variables
-        api_key = os.getenv('ELEVENLABS_API_KEY')
+        config = config_store.current
+        
+        # Get ElevenLabs API key from the config snapshot
+        api_key = config.elevenlabs_api_key
         if not api_key:
-            app.logger.error("Error: ELEVENLABS_API_KEY not found in environment variables")
+            app.logger.error("Error: ELEVENLABS_API_KEY not configured")
             return None
             
         # Check if we have an agent ID
-        agent_id = os.getenv('ELEVENLABS_AGENT_ID', 'r7QeXEUadxgIchsAQYax')  
+        agent_id = config.elevenlabs_agent_id
         
         if agent_id:
             # Send to ElevenLabs agent
@@ -773,7 +1701,7 @@ def send_to_elevenlabs_agent(text, agent_id, api_key):
     """
     try:
         # ElevenLabs API endpoint for agent messages
-        url = f"https://api.elevenlabs.io/v1/agents/{agent_id}/chat"
+        url = f"{config_store.current.elevenlabs_api_base}/v1/agents/{agent_id}/chat"
         
         # Headers with API key
         headers = {
@@ -792,7 +1720,8 @@ def send_to_elevenlabs_agent(text, agent_id, api_key):
         }
         
         # Make the request
-        response = requests.post(url, json=data, headers=headers)
+        with stage("elevenlabs.agent"):
+            response = get_session().post(url, json=data, headers=headers)
         
         if response.status_code == 200 or response.status_code == 201:
             response_data = response.json()
@@ -834,8 +1763,8 @@ def generate_elevenlabs_audio(text, api_key):
         Dictionary with response information
     """
     try:
-        # Get voice ID from environment variables or use default
-        voice_id = os.getenv('ELEVENLABS_VOICE_ID', 'pNInz6obpgDQGcFmaJgB')  
+        # Get voice ID from the config snapshot (has a default)
+        voice_id = config_store.current.elevenlabs_voice_id
         
         if voice_id:
             # Send to ElevenLabs agent
@@ -870,7 +1799,7 @@ def generate_elevenlabs_audio_with_voice(text, voice_id, api_key):
     """
     try:
         # ElevenLabs API endpoint for text-to-speech
-        url = f"https://api.elevenlabs.io/v1/text-to-speech/{voice_id}"
+        url = f"{config_store.current.elevenlabs_api_base}/v1/text-to-speech/{voice_id}"
         
         # Headers with API key
         headers = {
@@ -890,12 +1819,13 @@ def generate_elevenlabs_audio_with_voice(text, voice_id, api_key):
         }
         
         # Make the request
-        response = requests.post(url, json=data, headers=headers)
+        with stage("elevenlabs.tts"):
+            response = get_session().post(url, json=data, headers=headers)
         
         if response.status_code == 200:
             # Save the audio file
             filename = f"speech_{uuid.uuid4()}.mp3"
-            filepath = os.path.join(os.path.dirname(__file__), 'static', filename)
+            filepath = os.path.join(AUDIO_FOLDER, filename)
             
             # Create static directory if it doesn't exist
             os.makedirs(os.path.dirname(filepath), exist_ok=True)
@@ -927,8 +1857,10 @@ def generate_elevenlabs_audio_with_voice(text, voice_id, api_key):
 
 @app.route('/static/<path:filename>')
 def serve_static(filename):
-    static_folder = os.path.join(os.path.dirname(__file__), 'static')
+    static_folder = AUDIO_FOLDER
     os.makedirs(static_folder, exist_ok=True) 
+    if filename.startswith('speech_'):
+        storage_janitor.record_access(os.path.join(static_folder, filename))
     return send_from_directory(static_folder, filename)
 
 @app.route('/react/')
@@ -948,6 +1880,74 @@ def serve_react_assets(filename):
     assets_folder = os.path.join(os.path.dirname(__file__), 'frontend', 'dist', 'assets')
     return send_from_directory(assets_folder, filename)
 
+def process_memory_stats():
+    """Return the current and peak resident set size of this process in bytes."""
+    stats = {"rss_bytes": None, "max_rss_bytes": None}
+    try:
+        import resource
+        # ru_maxrss is in kilobytes on Linux
+        stats["max_rss_bytes"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    except ImportError:
+        pass
+    try:
+        with open('/proc/self/statm') as f:
+            stats["rss_bytes"] = int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        pass
+    return stats
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Report internal counters of the background components as JSON."""
+    return jsonify({
+        "process": process_memory_stats(),
+        "signed_url_pool": signed_url_pool.stats(),
+        "hot_image_cache": hot_image_cache.stats(),
+        "renditions": rendition_worker.stats(),
+        "janitor": storage_janitor.stats(),
+        "admission": admission.stats(),
+        "single_flight": single_flight.stats(),
+        "turns": turn_stats.stats(),
+        "ttft": ttft_stats.stats(),
+        "routing": route_stats.stats(),
+        "llm_services": pooled_service_stats(),
+        "usage_ledger": usage_ledger.stats(),
+        "profiler": profiler.stats(),
+        "tracing": tracer.stats(),
+        "warmup": dependency_warmer.stats(),
+        "analysis_cache": analysis_cache.stats(),
+        "image_fetcher": default_fetcher().stats(),
+        "startup": {
+            "import_ms": STARTUP_IMPORT_MS,
+            "providers": provider_import_stats()
+        },
+        "sessions": {
+            "active": len(session_last_seen),
+            "with_image": len(image_context)
+        }
+    })
+
+@app.route('/ready', methods=['GET'])
+def ready():
+    """Readiness probe: 200 once the LLM provider and ElevenLabs connections are warm, else 503."""
+    is_ready, report = dependency_warmer.readiness()
+    return jsonify(report), (200 if is_ready else 503)
+
+@app.route('/usage/sessions', methods=['GET'])
+def usage_top_sessions():
+    """List the sessions that used the most tokens (optionally since a Unix timestamp)."""
+    try:
+        limit = min(int(request.args.get('limit', 20)), 500)
+        since = float(request.args['since']) if 'since' in request.args else None
+    except ValueError:
+        return jsonify({"error": "limit must be an integer and since a Unix timestamp"}), 400
+    return jsonify({"sessions": usage_ledger.top_sessions(limit=limit, since=since)})
+
+@app.route('/usage/sessions/<session_id>', methods=['GET'])
+def usage_session_totals(session_id):
+    """Report the token usage and estimated cost of a session, per provider and model."""
+    return jsonify(usage_ledger.session_totals(session_id))
+
 @app.route('/v1/test', methods=['GET', 'POST', 'OPTIONS'])
 def test_endpoint():
     """Simple endpoint to test if connections from ElevenLabs are working."""
@@ -987,19 +1987,17 @@ def upload_image():
         else:
             app.logger.info(f"Using provided session ID: {session_id}")
             
-        # Generate safe filename with timestamp to avoid collisions
-        filename = f"{uuid.uuid4()}_{secure_filename(image_file.filename)}"
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        
         # Create directory if it doesn't exist
         os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
         
-        # Save the image
-        image_file.save(file_path)
-        app.logger.info(f"Image saved at: {file_path}")
+        # Stream the image to disk under its content-addressed filename
+        stored_image = store_uploaded_image(image_file)
+        filename = stored_image.filename
+        app.logger.info(f"Image saved at: {stored_image.path} ({stored_image.size} bytes)")
         
         # Store the image filename in our session context dict
         image_context[session_id] = filename
+        touch_session(session_id)
         app.logger.info(f"Image {filename} linked to session {session_id}")
         
         # Return success with the public image URL
@@ -1014,6 +2012,11 @@ def upload_image():
             "public_image_url": public_image_url
         })
         
+    except RequestEntityTooLarge as e:
+        return request_entity_too_large(e)
+    except UploadTooLarge as e:
+        app.logger.warning(f"Upload rejected: {str(e)}")
+        return jsonify({"error": str(e)}), 413
     except Exception as e:
         app.logger.error(f"Error uploading image: {str(e)}")
         import traceback
@@ -1075,8 +2078,7 @@ def test_chat_completions():
     })
 
 if __name__ == '__main__':
-    # Ensure environment variables are loaded once at startup
-    load_dotenv()
+    start_background_workers()
     # Run the app
     # Use host='0.0.0.0' to make it accessible on the network if needed
     app.run(debug=True, port=5003) 
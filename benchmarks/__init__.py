@@ -0,0 +1 @@
+"""Benchmark scripts. Run from the repository root, e.g. `python -m benchmarks.upload_memory`."""
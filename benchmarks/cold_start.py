@@ -0,0 +1,83 @@
+import os
+import re
+import sys
+import argparse
+import subprocess
+import tempfile
+
+# Provider SDKs that must only be imported when their provider is used
+PROVIDER_SDKS = {
+    "openai": "openai",
+    "gemini": "google.generativeai",
+}
+
+IMPORT_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)")
+
+def import_times(provider: str):
+    """
+    Import app in a fresh interpreter with -X importtime.
+
+    Returns:
+        Dict of module name to (self_us, cumulative_us) for top-level and nested imports
+    """
+    repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, LLM_PROVIDER=provider, PYTHONPATH=repo_root,
+               JANITOR_GRACE_SECONDS="99999999")
+    # Run in a scratch directory so the app's data directories don't touch the checkout
+    with tempfile.TemporaryDirectory() as workdir:
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", "import app"],
+            cwd=workdir, env=env, capture_output=True, text=True
+        )
+    if result.returncode != 0:
+        print(result.stderr[-2000:])
+        sys.exit(result.returncode)
+    modules = {}
+    for line in result.stderr.splitlines():
+        match = IMPORT_LINE.match(line)
+        if match:
+            modules[match.group(4)] = (int(match.group(1)), int(match.group(2)))
+    return modules
+
+def main():
+    """
+    Cold-start benchmark: measures how long `import app` takes and checks that
+    provider SDKs are not loaded at startup (they are imported on first use).
+    """
+    parser = argparse.ArgumentParser(description="Benchmark the import time of the app")
+    parser.add_argument("--provider", default="openai", help="LLM_PROVIDER to start with")
+    parser.add_argument("--runs", type=int, default=3, help="Number of fresh interpreters to time")
+    parser.add_argument("--top", type=int, default=10, help="Number of slowest imports to list")
+    parser.add_argument("--max-ms", type=float, default=None,
+                        help="Fail if the median import time of app exceeds this")
+    args = parser.parse_args()
+
+    totals = []
+    modules = {}
+    for _ in range(args.runs):
+        modules = import_times(args.provider)
+        totals.append(modules["app"][1] / 1000)
+    totals.sort()
+    median = totals[len(totals) // 2]
+    print(f"import app ({args.provider}): median {median:.1f} ms over {args.runs} runs "
+          f"(min {totals[0]:.1f}, max {totals[-1]:.1f})\n")
+
+    print("Slowest top-level imports of the last run:")
+    top_level = [(name, cumulative) for name, (_, cumulative) in modules.items() if "." not in name]
+    for name, cumulative in sorted(top_level, key=lambda item: -item[1])[:args.top]:
+        print(f"  {name:<32} {cumulative / 1000:>8.1f} ms")
+
+    failed = False
+    loaded = [sdk for sdk in PROVIDER_SDKS.values() if sdk in modules]
+    if loaded:
+        print(f"\nFAIL: provider SDKs imported at startup: {', '.join(loaded)}")
+        failed = True
+    if args.max_ms is not None and median > args.max_ms:
+        print(f"\nFAIL: median import time exceeds {args.max_ms} ms")
+        failed = True
+    if failed:
+        sys.exit(1)
+    print("\nOK: no provider SDK is imported at startup")
+
+if __name__ == "__main__":
+    main()
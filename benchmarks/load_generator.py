@@ -0,0 +1,221 @@
+"""
+Load generator for the custom LLM server.
+
+Drives /v1/chat/completions, /upload_image and /serve_image at a fixed
+concurrency and reports throughput, latency and time-to-first-token
+percentiles, and the server's memory use (sampled from /metrics).
+
+Example, against the local provider stand-ins:
+  python -m benchmarks.mock_providers --port 8900 &
+  OPENAI_BASE_URL=http://127.0.0.1:8900/v1 OPENAI_API_KEY=bench \\
+  ELEVENLABS_API_BASE=http://127.0.0.1:8900 python app.py &
+  python -m benchmarks.load_generator --base-url http://127.0.0.1:5003 \\
+      --scenario chat --concurrency 16 --requests 400
+"""
+import io
+import os
+import sys
+import json
+import time
+import uuid
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+import requests
+
+def percentile(values: List[float], pct: float) -> Optional[float]:
+    """Return the pct-th percentile (nearest rank) of values, or None if empty."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, int(round(pct / 100.0 * len(ordered) + 0.5)) - 1))
+    return ordered[rank]
+
+def make_test_image(size_kb: int) -> bytes:
+    """Create a JPEG of roughly size_kb kilobytes."""
+    from PIL import Image
+    side = max(64, int((size_kb * 1024 / 3) ** 0.5))
+    image = Image.frombytes("RGB", (side, side), os.urandom(side * side * 3))
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=90)
+    return buffer.getvalue()
+
+class MemorySampler:
+    """Polls the server's /metrics endpoint in the background and keeps the peak RSS."""
+
+    def __init__(self, base_url: str, interval: float = 0.5):
+        self.url = f"{base_url}/metrics"
+        self.interval = interval
+        self.samples: List[int] = []
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join(timeout=5)
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                rss = requests.get(self.url, timeout=5).json().get("process", {}).get("rss_bytes")
+                if rss:
+                    self.samples.append(rss)
+            except (requests.RequestException, ValueError):
+                pass
+            self._stopped.wait(self.interval)
+
+class LoadGenerator:
+    """Runs one scenario and collects per-request measurements."""
+
+    def __init__(self, base_url: str, stream: bool, image_kb: int, conditional: bool):
+        self.base_url = base_url.rstrip("/")
+        self.stream = stream
+        self.image = make_test_image(image_kb)
+        self.conditional = conditional
+        self.local = threading.local()
+        self.served_filename: Optional[str] = None
+        self.served_etag: Optional[str] = None
+
+    def session(self) -> requests.Session:
+        """One keep-alive HTTP session per worker thread."""
+        if not hasattr(self.local, "session"):
+            self.local.session = requests.Session()
+        return self.local.session
+
+    def prepare(self, scenario: str):
+        """Upload one image up front for the serve scenario."""
+        if scenario in ("serve", "mixed"):
+            result = self.upload()
+            if not result["ok"]:
+                raise RuntimeError("Could not upload the image used by the serve scenario")
+            response = requests.get(f"{self.base_url}/serve_image/{self.served_filename}", timeout=30)
+            self.served_etag = response.headers.get("ETag")
+
+    def chat(self) -> Dict[str, Any]:
+        body = {
+            "model": "gpt-4o",
+            "stream": self.stream,
+            "user_id": f"bench-{uuid.uuid4()}",
+            "messages": [
+                {"role": "system", "content": "You are a helpful assistant."},
+                {"role": "user", "content": "Tell me about this painting."},
+            ],
+        }
+        start = time.perf_counter()
+        ttft = None
+        response = self.session().post(f"{self.base_url}/v1/chat/completions", json=body,
+                                       stream=self.stream, timeout=120)
+        if self.stream:
+            for line in response.iter_lines():
+                if ttft is None and line.startswith(b"data: ") and line != b"data: [DONE]":
+                    try:
+                        chunk = json.loads(line[6:])
+                        if chunk.get("choices") and chunk["choices"][0].get("delta", {}).get("content"):
+                            ttft = time.perf_counter() - start
+                    except ValueError:
+                        pass
+        else:
+            response.content
+        latency = time.perf_counter() - start
+        return {"ok": response.status_code == 200, "status": response.status_code,
+                "latency": latency, "ttft": ttft if self.stream else latency}
+
+    def upload(self) -> Dict[str, Any]:
+        start = time.perf_counter()
+        response = self.session().post(
+            f"{self.base_url}/upload_image",
+            files={"image": (f"bench-{uuid.uuid4().hex[:8]}.jpg", self.image, "image/jpeg")},
+            data={"session_id": f"bench-{uuid.uuid4()}"},
+            timeout=120,
+        )
+        latency = time.perf_counter() - start
+        if response.status_code == 200:
+            self.served_filename = response.json().get("filename")
+        return {"ok": response.status_code == 200, "status": response.status_code,
+                "latency": latency, "ttft": None}
+
+    def serve(self) -> Dict[str, Any]:
+        headers = {"If-None-Match": self.served_etag} if self.conditional and self.served_etag else {}
+        start = time.perf_counter()
+        response = self.session().get(f"{self.base_url}/serve_image/{self.served_filename}",
+                                      headers=headers, timeout=60)
+        response.content
+        latency = time.perf_counter() - start
+        return {"ok": response.status_code in (200, 304), "status": response.status_code,
+                "latency": latency, "ttft": None}
+
+    def operation(self, scenario: str, index: int) -> Callable[[], Dict[str, Any]]:
+        if scenario == "mixed":
+            # Roughly one upload and a few image fetches per chat turn
+            scenario = ("chat", "serve", "serve", "upload")[index % 4]
+        return {"chat": self.chat, "upload": self.upload, "serve": self.serve}[scenario]
+
+def summarize(name: str, results: List[Dict[str, Any]], elapsed: float):
+    """Print throughput and percentile tables for a run."""
+    ok = [r for r in results if r["ok"]]
+    latencies = [r["latency"] * 1000 for r in ok]
+    ttfts = [r["ttft"] * 1000 for r in ok if r["ttft"] is not None]
+    statuses: Dict[int, int] = {}
+    for r in results:
+        statuses[r["status"]] = statuses.get(r["status"], 0) + 1
+
+    print(f"\nScenario: {name}")
+    print(f"  Requests:    {len(results)} ({len(ok)} ok)  statuses: {statuses}")
+    print(f"  Elapsed:     {elapsed:.2f} s")
+    print(f"  Throughput:  {len(ok) / elapsed:.1f} req/s")
+    for label, values in (("Latency", latencies), ("TTFT", ttfts)):
+        if values:
+            print(f"  {label + ' ms:':<12} p50 {percentile(values, 50):8.1f}  p90 {percentile(values, 90):8.1f}  "
+                  f"p99 {percentile(values, 99):8.1f}  max {max(values):8.1f}")
+
+def main():
+    """Run a load test against a running server."""
+    parser = argparse.ArgumentParser(description="Load generator for the custom LLM server")
+    parser.add_argument("--base-url", type=str, default="http://127.0.0.1:5003", help="Server base URL")
+    parser.add_argument("--scenario", type=str, default="chat", choices=["chat", "upload", "serve", "mixed"],
+                        help="Which endpoint(s) to drive")
+    parser.add_argument("--concurrency", type=int, default=8, help="Number of concurrent clients")
+    parser.add_argument("--requests", type=int, default=200, help="Total number of requests")
+    parser.add_argument("--no-stream", action="store_true", help="Use non-streaming chat completions")
+    parser.add_argument("--image-kb", type=int, default=300, help="Approximate size of the uploaded image")
+    parser.add_argument("--conditional", action="store_true",
+                        help="Send If-None-Match on /serve_image requests (measures 304 handling)")
+    args = parser.parse_args()
+
+    generator = LoadGenerator(args.base_url, stream=not args.no_stream,
+                              image_kb=args.image_kb, conditional=args.conditional)
+    try:
+        generator.prepare(args.scenario)
+    except (requests.RequestException, RuntimeError) as e:
+        print(f"Error preparing the benchmark: {str(e)}")
+        sys.exit(1)
+
+    sampler = MemorySampler(generator.base_url)
+    sampler.start()
+
+    def run(index):
+        try:
+            return generator.operation(args.scenario, index)()
+        except requests.RequestException as e:
+            return {"ok": False, "status": type(e).__name__, "latency": 0.0, "ttft": None}
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        results = list(executor.map(run, range(args.requests)))
+    elapsed = time.perf_counter() - start
+    sampler.stop()
+
+    summarize(f"{args.scenario} (concurrency {args.concurrency})", results, elapsed)
+    if sampler.samples:
+        print(f"  Server RSS:  start {sampler.samples[0] / 2**20:.1f} MiB  "
+              f"peak {max(sampler.samples) / 2**20:.1f} MiB  end {sampler.samples[-1] / 2**20:.1f} MiB")
+    else:
+        print("  Server RSS:  not available (/metrics unreachable)")
+
+if __name__ == "__main__":
+    main()
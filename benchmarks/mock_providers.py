@@ -0,0 +1,321 @@
+"""
+Local stand-ins for the upstream APIs this server calls, for load testing
+without network access or API spend.
+
+Emulated endpoints:
+  OpenAI      POST /v1/chat/completions (JSON or SSE stream), GET /v1/models
+  Gemini      POST /v1beta/models/<model>:generateContent
+              POST /v1beta/models/<model>:streamGenerateContent?alt=sse
+  Anthropic   POST /v1/messages (JSON or SSE stream)
+  ElevenLabs  GET  /v1/convai/conversation/get_signed_url
+              POST /v1/text-to-speech/<voice_id>
+              POST /v1/agents/<agent_id>/chat
+
+Point the server at it with:
+  OPENAI_BASE_URL=http://127.0.0.1:8900/v1
+  GEMINI_API_ENDPOINT=http://127.0.0.1:8900
+  ANTHROPIC_BASE_URL=http://127.0.0.1:8900
+  ELEVENLABS_API_BASE=http://127.0.0.1:8900
+"""
+import re
+import sys
+import json
+import time
+import uuid
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+import requests
+
+class MockSettings:
+    """Latency model shared by all handlers."""
+
+    def __init__(self, ttft_ms: float, tokens_per_second: float, response_tokens: int,
+                 tts_ms: float, fetch_images: bool):
+        self.ttft = ttft_ms / 1000.0
+        self.token_interval = 1.0 / tokens_per_second if tokens_per_second > 0 else 0.0
+        self.response_tokens = response_tokens
+        self.tts = tts_ms / 1000.0
+        self.fetch_images = fetch_images
+        self.lock = threading.Lock()
+        self.counters = {}
+
+    def count(self, name):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + 1
+
+    def tokens(self):
+        """The canned response, split into word tokens."""
+        words = ("This is a simulated response from the local provider stand-in used "
+                 "for load testing the custom LLM server. ").split()
+        return [words[i % len(words)] + " " for i in range(self.response_tokens)]
+
+class MockProviderHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    settings: MockSettings = None
+
+    def log_message(self, format, *args):
+        # Keep the console quiet under load
+        pass
+
+    # --- helpers ---
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        try:
+            return json.loads(body or b"{}")
+        except ValueError:
+            return {}
+
+    def _send_json(self, payload, status=200):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _start_sse(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+    def _send_event(self, data, event=None):
+        message = ""
+        if event:
+            message += f"event: {event}\n"
+        message += f"data: {data if isinstance(data, str) else json.dumps(data)}\n\n"
+        self.wfile.write(message.encode("utf-8"))
+        self.wfile.flush()
+
+    def _stream_tokens(self):
+        """Yield tokens after the configured time to first token, at the configured rate."""
+        time.sleep(self.settings.ttft)
+        for i, token in enumerate(self.settings.tokens()):
+            if i:
+                time.sleep(self.settings.token_interval)
+            yield token
+
+    def _fetch_images(self, messages):
+        """Optionally download image URLs like a real provider would."""
+        if not self.settings.fetch_images:
+            return
+        for msg in messages:
+            content = msg.get("content")
+            if not isinstance(content, list):
+                continue
+            for item in content:
+                image_url = item.get("image_url") if isinstance(item, dict) else None
+                url = image_url.get("url") if isinstance(image_url, dict) else image_url
+                if isinstance(url, str) and url.startswith("http"):
+                    try:
+                        requests.get(url, timeout=10).content
+                        self.settings.count("image_fetches")
+                    except requests.RequestException:
+                        self.settings.count("image_fetch_errors")
+
+    # --- routing ---
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if path == "/v1/models":
+            self.settings.count("openai_models")
+            return self._send_json({"object": "list", "data": [{"id": "gpt-4o", "object": "model"}]})
+        if path == "/v1beta/models":
+            self.settings.count("gemini_models")
+            return self._send_json({"models": [{"name": "models/gemini-1.5-pro", "displayName": "Gemini 1.5 Pro"}]})
+        if path == "/v1/convai/conversation/get_signed_url":
+            self.settings.count("elevenlabs_signed_url")
+            return self._send_json({"signed_url": f"wss://mock.invalid/convai?token={uuid.uuid4()}"})
+        if path == "/stats":
+            with self.settings.lock:
+                return self._send_json(dict(self.settings.counters))
+        self._send_json({"error": f"Unknown path {path}"}, status=404)
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_POST(self):
+        parsed = urlparse(self.path)
+        path = parsed.path
+        if path == "/v1/chat/completions":
+            return self._openai_chat(self._read_json())
+        if path == "/v1/messages":
+            return self._anthropic_messages(self._read_json())
+        match = re.match(r"^/v1beta/models/([^:]+):(generateContent|streamGenerateContent)$", path)
+        if match:
+            return self._gemini(self._read_json(), match.group(1), match.group(2) == "streamGenerateContent")
+        if re.match(r"^/v1/text-to-speech/[^/]+$", path):
+            return self._elevenlabs_tts(self._read_json())
+        if re.match(r"^/v1/agents/[^/]+/chat$", path):
+            self._read_json()
+            self.settings.count("elevenlabs_agent_chat")
+            return self._send_json({"conversation_id": str(uuid.uuid4()), "status": "ok"})
+        self._read_json()
+        self._send_json({"error": f"Unknown path {path}"}, status=404)
+
+    # --- OpenAI ---
+
+    def _openai_chat(self, body):
+        self.settings.count("openai_chat")
+        self._fetch_images(body.get("messages", []))
+        model = body.get("model", "gpt-4o")
+        completion_id = f"chatcmpl-mock-{uuid.uuid4().hex[:12]}"
+        created = int(time.time())
+        tokens = self.settings.tokens()
+        usage = {"prompt_tokens": 100, "completion_tokens": len(tokens), "total_tokens": 100 + len(tokens)}
+
+        if not body.get("stream"):
+            text = "".join(self._stream_tokens())
+            return self._send_json({
+                "id": completion_id, "object": "chat.completion", "created": created, "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": text},
+                             "finish_reason": "stop"}],
+                "usage": usage,
+            })
+
+        def chunk(delta, finish_reason=None):
+            return {"id": completion_id, "object": "chat.completion.chunk", "created": created,
+                    "model": model, "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]}
+
+        self._start_sse()
+        try:
+            first = True
+            for token in self._stream_tokens():
+                delta = {"role": "assistant", "content": token} if first else {"content": token}
+                self._send_event(chunk(delta))
+                first = False
+            self._send_event(chunk({}, "stop"))
+            if (body.get("stream_options") or {}).get("include_usage"):
+                self._send_event({"id": completion_id, "object": "chat.completion.chunk", "created": created,
+                                  "model": model, "choices": [], "usage": usage})
+            self._send_event("[DONE]")
+        except (BrokenPipeError, ConnectionResetError):
+            self.settings.count("openai_stream_cancelled")
+
+    # --- Gemini ---
+
+    def _gemini(self, body, model, stream):
+        self.settings.count("gemini_stream" if stream else "gemini_generate")
+        tokens = self.settings.tokens()
+        usage = {"promptTokenCount": 100, "candidatesTokenCount": len(tokens), "totalTokenCount": 100 + len(tokens)}
+
+        def response(text, finish=False):
+            candidate = {"content": {"role": "model", "parts": [{"text": text}]}, "index": 0}
+            if finish:
+                candidate["finishReason"] = "STOP"
+            return {"candidates": [candidate], "usageMetadata": usage, "modelVersion": model}
+
+        if not stream:
+            return self._send_json(response("".join(self._stream_tokens()), finish=True))
+
+        self._start_sse()
+        try:
+            for i, token in enumerate(self._stream_tokens()):
+                self._send_event(response(token, finish=i == len(tokens) - 1))
+        except (BrokenPipeError, ConnectionResetError):
+            self.settings.count("gemini_stream_cancelled")
+
+    # --- Anthropic ---
+
+    def _anthropic_messages(self, body):
+        self.settings.count("anthropic_messages")
+        model = body.get("model", "claude-3-opus-20240229")
+        message_id = f"msg_mock_{uuid.uuid4().hex[:12]}"
+        tokens = self.settings.tokens()
+        usage = {"input_tokens": 100, "output_tokens": len(tokens)}
+
+        if not body.get("stream"):
+            text = "".join(self._stream_tokens())
+            return self._send_json({
+                "id": message_id, "type": "message", "role": "assistant", "model": model,
+                "content": [{"type": "text", "text": text}],
+                "stop_reason": "end_turn", "usage": usage,
+            })
+
+        self._start_sse()
+        try:
+            self._send_event({"type": "message_start", "message": {
+                "id": message_id, "type": "message", "role": "assistant", "model": model,
+                "content": [], "usage": {"input_tokens": 100, "output_tokens": 0}}}, event="message_start")
+            self._send_event({"type": "content_block_start", "index": 0,
+                              "content_block": {"type": "text", "text": ""}}, event="content_block_start")
+            for token in self._stream_tokens():
+                self._send_event({"type": "content_block_delta", "index": 0,
+                                  "delta": {"type": "text_delta", "text": token}}, event="content_block_delta")
+            self._send_event({"type": "content_block_stop", "index": 0}, event="content_block_stop")
+            self._send_event({"type": "message_delta", "delta": {"stop_reason": "end_turn"},
+                              "usage": {"output_tokens": len(tokens)}}, event="message_delta")
+            self._send_event({"type": "message_stop"}, event="message_stop")
+        except (BrokenPipeError, ConnectionResetError):
+            self.settings.count("anthropic_stream_cancelled")
+
+    # --- ElevenLabs ---
+
+    def _elevenlabs_tts(self, body):
+        self.settings.count("elevenlabs_tts")
+        time.sleep(self.settings.tts)
+        # Roughly 1 KiB of "audio" per 10 characters of text
+        audio = b"\xff\xfb\x90\x00" * max(1, len(body.get("text", "")) * 25)
+        self.send_response(200)
+        self.send_header("Content-Type", "audio/mpeg")
+        self.send_header("Content-Length", str(len(audio)))
+        self.end_headers()
+        self.wfile.write(audio)
+
+def create_server(host="127.0.0.1", port=8900, ttft_ms=300.0, tokens_per_second=50.0,
+                  response_tokens=60, tts_ms=200.0, fetch_images=False) -> ThreadingHTTPServer:
+    """
+    Create (but don't start) a mock provider server.
+
+    Args:
+        host: Interface to bind
+        port: Port to bind (0 picks a free port)
+        ttft_ms: Delay before the first token
+        tokens_per_second: Rate at which tokens are produced after the first
+        response_tokens: Number of tokens in each response
+        tts_ms: Latency of a text-to-speech request
+        fetch_images: Download image URLs found in chat messages, like real providers
+
+    Returns:
+        The server; call serve_forever() (e.g. on a thread) to run it
+    """
+    settings = MockSettings(ttft_ms, tokens_per_second, response_tokens, tts_ms, fetch_images)
+    handler = type("ConfiguredMockProviderHandler", (MockProviderHandler,), {"settings": settings})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+def main():
+    """Run the mock provider server from the command line."""
+    parser = argparse.ArgumentParser(description="Local stand-ins for OpenAI, Gemini, Anthropic and ElevenLabs")
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="Interface to bind")
+    parser.add_argument("--port", type=int, default=8900, help="Port to bind")
+    parser.add_argument("--ttft-ms", type=float, default=300.0, help="Time to first token in milliseconds")
+    parser.add_argument("--tokens-per-second", type=float, default=50.0, help="Token rate after the first token")
+    parser.add_argument("--response-tokens", type=int, default=60, help="Tokens per response")
+    parser.add_argument("--tts-ms", type=float, default=200.0, help="Text-to-speech latency in milliseconds")
+    parser.add_argument("--fetch-images", action="store_true",
+                        help="Download image URLs from chat messages like a real provider")
+    args = parser.parse_args()
+
+    server = create_server(args.host, args.port, args.ttft_ms, args.tokens_per_second,
+                           args.response_tokens, args.tts_ms, args.fetch_images)
+    print(f"Mock providers listening on http://{args.host}:{server.server_address[1]} "
+          f"(TTFT {args.ttft_ms} ms, {args.tokens_per_second} tokens/s, {args.response_tokens} tokens)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.shutdown()
+        sys.exit(0)
+
+if __name__ == "__main__":
+    main()
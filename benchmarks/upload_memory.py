@@ -0,0 +1,84 @@
+import io
+import os
+import sys
+import base64
+import argparse
+import tempfile
+import tracemalloc
+
+from image_store import ingest_upload
+
+class SyntheticUpload(io.RawIOBase):
+    """
+    Readable stream that produces `size` bytes on demand without holding them,
+    so the benchmark itself doesn't distort the memory measurement.
+    """
+
+    def __init__(self, size: int):
+        self.remaining = size
+        self.block = os.urandom(4096)
+
+    def readable(self):
+        return True
+
+    def read(self, n=-1):
+        if self.remaining <= 0:
+            return b""
+        if n is None or n < 0:
+            n = self.remaining
+        n = min(n, self.remaining)
+        self.remaining -= n
+        repeats, extra = divmod(n, len(self.block))
+        return self.block * repeats + self.block[:extra]
+
+def measure(label, func):
+    """Run func under tracemalloc and return its peak traced allocation in bytes."""
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{label:<40} peak {peak / 1024:>10.1f} KiB")
+    return peak
+
+def main():
+    """
+    Memory benchmark for upload ingestion.
+    Compares the old read()+base64 approach with streaming ingestion and checks
+    that the streaming peak stays within a small multiple of the chunk size.
+    """
+    parser = argparse.ArgumentParser(description="Benchmark peak memory of upload ingestion")
+    parser.add_argument("--size-mb", type=int, default=32,
+                        help="Size of the synthetic upload in MiB")
+    parser.add_argument("--chunk-kb", type=int, default=64,
+                        help="Ingestion chunk size in KiB")
+    parser.add_argument("--max-chunk-multiple", type=float, default=4.0,
+                        help="Fail if the streaming peak exceeds this many chunk sizes")
+    args = parser.parse_args()
+
+    size = args.size_mb * 1024 * 1024
+    chunk_size = args.chunk_kb * 1024
+    print(f"Synthetic upload: {args.size_mb} MiB, chunk size: {args.chunk_kb} KiB\n")
+
+    def read_and_encode():
+        data = SyntheticUpload(size).read()
+        encoded = base64.b64encode(data).decode("utf-8")
+        return f"data:image/jpeg;base64,{encoded}"
+
+    with tempfile.TemporaryDirectory() as store_dir:
+        def stream_to_store():
+            ingest_upload(SyntheticUpload(size), store_dir, max_bytes=size, chunk_size=chunk_size)
+
+        legacy_peak = measure("read() + base64 (previous /analyze)", read_and_encode)
+        streaming_peak = measure("ingest_upload (streaming)", stream_to_store)
+
+    limit = args.max_chunk_multiple * chunk_size
+    print(f"\nStreaming peak is {streaming_peak / chunk_size:.2f}x the chunk size "
+          f"({legacy_peak / max(streaming_peak, 1):.0f}x lower than read() + base64)")
+    if streaming_peak > limit:
+        print(f"FAIL: streaming peak exceeds {args.max_chunk_multiple}x the chunk size")
+        sys.exit(1)
+    print("OK: streaming peak memory is O(chunk size)")
+
+if __name__ == "__main__":
+    main()
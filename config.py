@@ -0,0 +1,400 @@
+import os
+import re
+import json
+import signal
+import threading
+import logging
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Mapping, Optional, Tuple
+
+from dotenv import dotenv_values
+
+from llm_factory import provider_names, provider_serves_model
+
+logger = logging.getLogger(__name__)
+
+class ConfigError(ValueError):
+    """Raised when the configuration fails validation."""
+
+@dataclass(frozen=True)
+class AppConfig:
+    """
+    Immutable snapshot of the application configuration.
+    Handlers read a snapshot once per request; a reload swaps in a new one.
+    """
+    llm_provider: str = "openai"
+    default_model: str = "gpt-4o"
+    api_keys: Dict[str, Optional[str]] = field(default_factory=dict)
+
+    replay_upstream: str = "openai"
+
+    admission_max_concurrent: int = 8
+    admission_max_queue: int = 32
+    admission_max_wait_seconds: float = 10.0
+
+    # End-to-end budget of a voice turn (0 disables the deadline)
+    turn_deadline_seconds: float = 30.0
+
+    # Spoken acknowledgement streamed ahead of the model's answer on image turns
+    vision_ack: bool = False
+    vision_ack_text: str = "Let me take a look."
+
+    # Per-turn model routing (unset models keep the requested model)
+    routing_fast_model: Optional[str] = None
+    routing_vision_model: Optional[str] = None
+    routing_fast_pattern: Optional[str] = None
+    routing_fast_max_chars: int = 0
+    routing_image_pattern: Optional[str] = None
+    routing_rules: Tuple[Dict[str, Any], ...] = ()
+
+    usage_db_path: str = "data/usage.db"
+    usage_flush_seconds: float = 1.0
+
+    profile_dir: str = "profiles"
+    profile_header: str = "X-Profile"
+    profile_sample_rate: float = 0.0
+    profile_sample_mode: str = "stages"
+
+    trace_file: str = "traces/spans.jsonl"
+    trace_sample_rate: float = 0.0
+    trace_max_bytes: int = 64 * 1024 * 1024
+    trace_service_name: str = "image-reader"
+
+    warmup_interval_seconds: float = 45.0
+    warmup_failure_threshold: int = 3
+
+    analysis_cache_path: str = "data/analysis_cache.db"
+    analysis_cache_ttl_seconds: float = 7 * 24 * 3600.0
+    analysis_cache_max_entries: int = 10000
+
+    elevenlabs_api_key: Optional[str] = None
+    elevenlabs_agent_id: str = "al0xrBMlL3qchebAFV9N"
+    elevenlabs_voice_id: str = "pNInz6obpgDQGcFmaJgB"
+    elevenlabs_api_base: str = "https://api.elevenlabs.io"
+
+    signed_url_pool_depth: int = 2
+    signed_url_pool_refill_seconds: float = 1.0
+    signed_url_ttl_seconds: float = 900.0
+
+    max_upload_bytes: int = 20 * 1024 * 1024
+    upload_chunk_bytes: int = 64 * 1024
+    image_hot_cache_bytes: int = 16 * 1024 * 1024
+    use_x_sendfile: bool = False
+    image_zoom_pattern: Optional[str] = None
+
+    # Remote images fetched by the provider services (None cache dir: memory only)
+    image_fetch_cache_dir: Optional[str] = "data/image_cache"
+    image_fetch_memory_bytes: int = 64 * 1024 * 1024
+    image_fetch_disk_bytes: int = 512 * 1024 * 1024
+    image_fetch_max_bytes: int = 20 * 1024 * 1024
+    image_fetch_timeout_seconds: float = 10.0
+    http_pool_maxsize: int = 32
+
+    session_ttl_seconds: float = 3600.0
+    storage_quota_bytes: int = 1024 * 1024 * 1024
+    janitor_interval_seconds: float = 300.0
+    janitor_grace_seconds: float = 300.0
+
+    config_watch_interval: float = 2.0
+
+    @property
+    def llm_api_key(self) -> Optional[str]:
+        """API key for the configured LLM provider."""
+        if self.llm_provider == "replay":
+            # Recording forwards to the upstream provider, which uses its own key
+            return self.api_keys.get(self.replay_upstream)
+        return self.api_keys.get(self.llm_provider)
+
+def _get_int(env: Mapping[str, str], name: str, default: int, minimum: int = 0) -> int:
+    raw = env.get(name)
+    if raw in (None, ""):
+        return default
+    try:
+        value = int(raw)
+    except ValueError:
+        raise ConfigError(f"{name} must be an integer, got {raw!r}")
+    if value < minimum:
+        raise ConfigError(f"{name} must be >= {minimum}, got {value}")
+    return value
+
+def _get_float(env: Mapping[str, str], name: str, default: float, minimum: float = 0.0) -> float:
+    raw = env.get(name)
+    if raw in (None, ""):
+        return default
+    try:
+        value = float(raw)
+    except ValueError:
+        raise ConfigError(f"{name} must be a number, got {raw!r}")
+    if value < minimum:
+        raise ConfigError(f"{name} must be >= {minimum}, got {value}")
+    return value
+
+def _get_bool(env: Mapping[str, str], name: str, default: bool) -> bool:
+    raw = env.get(name)
+    if raw in (None, ""):
+        return default
+    value = raw.strip().lower()
+    if value in ("1", "true", "yes", "on"):
+        return True
+    if value in ("0", "false", "no", "off"):
+        return False
+    raise ConfigError(f"{name} must be a boolean, got {raw!r}")
+
+def _get_routing_rules(env: Mapping[str, str]) -> Tuple[Dict[str, Any], ...]:
+    """Parse ROUTING_RULES: a JSON list of {"model", "name"?, "pattern"?, "images"?, "max_chars"?}."""
+    raw = env.get("ROUTING_RULES")
+    if raw in (None, ""):
+        return ()
+    try:
+        rules = json.loads(raw)
+    except ValueError as e:
+        raise ConfigError(f"ROUTING_RULES must be a JSON list: {str(e)}")
+    if not isinstance(rules, list):
+        raise ConfigError("ROUTING_RULES must be a JSON list of rules")
+    for index, rule in enumerate(rules):
+        if not isinstance(rule, dict) or not isinstance(rule.get("model"), str) or not rule["model"]:
+            raise ConfigError(f"ROUTING_RULES[{index}] must be an object with a 'model'")
+        unknown = set(rule) - {"model", "name", "pattern", "images", "max_chars"}
+        if unknown:
+            raise ConfigError(f"ROUTING_RULES[{index}] has unknown keys: {', '.join(sorted(unknown))}")
+        if rule.get("pattern") is not None:
+            try:
+                re.compile(rule["pattern"])
+            except (re.error, TypeError) as e:
+                raise ConfigError(f"ROUTING_RULES[{index}] pattern is not a valid regular expression: {str(e)}")
+        if rule.get("images") is not None and not isinstance(rule["images"], bool):
+            raise ConfigError(f"ROUTING_RULES[{index}] 'images' must be true or false")
+        if rule.get("max_chars") is not None and (not isinstance(rule["max_chars"], int) or rule["max_chars"] < 0):
+            raise ConfigError(f"ROUTING_RULES[{index}] 'max_chars' must be a non-negative integer")
+    return tuple(rules)
+
+def build_config(env: Mapping[str, str]) -> AppConfig:
+    """
+    Build and validate a configuration snapshot from a mapping of variables.
+
+    Args:
+        env: Mapping of environment variable names to values
+
+    Returns:
+        A validated AppConfig
+
+    Raises:
+        ConfigError: If a value is missing or invalid
+    """
+    # Registered providers, including entry-point extensions; none of them is imported here
+    providers = provider_names()
+    provider = (env.get("LLM_PROVIDER") or "openai").lower()
+    if provider not in providers:
+        raise ConfigError(f"Unsupported LLM_PROVIDER: {provider}. Supported providers are: {', '.join(providers)}")
+
+    zoom_pattern = env.get("IMAGE_ZOOM_PATTERN") or None
+    if zoom_pattern:
+        try:
+            re.compile(zoom_pattern)
+        except re.error as e:
+            raise ConfigError(f"IMAGE_ZOOM_PATTERN is not a valid regular expression: {str(e)}")
+
+    fast_pattern = env.get("ROUTING_FAST_PATTERN") or None
+    if fast_pattern:
+        try:
+            re.compile(fast_pattern)
+        except re.error as e:
+            raise ConfigError(f"ROUTING_FAST_PATTERN is not a valid regular expression: {str(e)}")
+
+    image_pattern = env.get("ROUTING_IMAGE_PATTERN") or None
+    if image_pattern:
+        try:
+            re.compile(image_pattern)
+        except re.error as e:
+            raise ConfigError(f"ROUTING_IMAGE_PATTERN is not a valid regular expression: {str(e)}")
+
+    # A routed model is sent to the configured provider (for replay, to the upstream
+    # it records from), so it has to be one of that provider's models
+    replay_upstream = (env.get("REPLAY_UPSTREAM") or "openai").lower()
+    model_provider = replay_upstream if provider == "replay" else provider
+    routing_rules = _get_routing_rules(env)
+    routed_models = [("ROUTING_FAST_MODEL", env.get("ROUTING_FAST_MODEL")),
+                     ("ROUTING_VISION_MODEL", env.get("ROUTING_VISION_MODEL"))]
+    routed_models += [(f"ROUTING_RULES[{index}] model", rule["model"]) for index, rule in enumerate(routing_rules)]
+    for name, model in routed_models:
+        if model and not provider_serves_model(model_provider, model):
+            raise ConfigError(f"{name} {model!r} is not a model of provider {model_provider}")
+
+    profile_sample_mode = (env.get("PROFILE_SAMPLE_MODE") or "stages").lower()
+    if profile_sample_mode not in ("stages", "cprofile"):
+        raise ConfigError(f"Unsupported PROFILE_SAMPLE_MODE: {profile_sample_mode}. Use 'stages' or 'cprofile'")
+
+    return AppConfig(
+        llm_provider=provider,
+        default_model=env.get("DEFAULT_MODEL") or "gpt-4o",
+        api_keys={name: env.get(f"{name.upper()}_API_KEY") or None
+                  for name in providers if name != "replay"},
+        replay_upstream=replay_upstream,
+        admission_max_concurrent=_get_int(env, "PROVIDER_MAX_CONCURRENT", 8, minimum=1),
+        admission_max_queue=_get_int(env, "PROVIDER_MAX_QUEUE", 32),
+        admission_max_wait_seconds=_get_float(env, "PROVIDER_MAX_WAIT_SECONDS", 10.0),
+        turn_deadline_seconds=_get_float(env, "TURN_DEADLINE_SECONDS", 30.0),
+        vision_ack=_get_bool(env, "VISION_ACK", False),
+        vision_ack_text=(env.get("VISION_ACK_TEXT") or AppConfig.vision_ack_text).strip(),
+        routing_fast_model=env.get("ROUTING_FAST_MODEL") or None,
+        routing_vision_model=env.get("ROUTING_VISION_MODEL") or None,
+        routing_fast_pattern=fast_pattern,
+        routing_fast_max_chars=_get_int(env, "ROUTING_FAST_MAX_CHARS", 0),
+        routing_image_pattern=image_pattern,
+        routing_rules=routing_rules,
+        usage_db_path=env.get("USAGE_DB_PATH") or AppConfig.usage_db_path,
+        usage_flush_seconds=_get_float(env, "USAGE_FLUSH_SECONDS", 1.0, minimum=0.05),
+        profile_dir=env.get("PROFILE_DIR") or AppConfig.profile_dir,
+        # An empty PROFILE_HEADER turns the header trigger off
+        profile_header=env.get("PROFILE_HEADER", AppConfig.profile_header).strip(),
+        profile_sample_rate=min(1.0, _get_float(env, "PROFILE_SAMPLE_RATE", 0.0)),
+        profile_sample_mode=profile_sample_mode,
+        trace_file=env.get("TRACE_FILE") or AppConfig.trace_file,
+        trace_sample_rate=min(1.0, _get_float(env, "TRACE_SAMPLE_RATE", 0.0)),
+        trace_max_bytes=_get_int(env, "TRACE_MAX_BYTES", AppConfig.trace_max_bytes),
+        trace_service_name=env.get("TRACE_SERVICE_NAME") or AppConfig.trace_service_name,
+        warmup_interval_seconds=_get_float(env, "WARMUP_INTERVAL_SECONDS", 45.0),
+        warmup_failure_threshold=_get_int(env, "WARMUP_FAILURE_THRESHOLD", 3, minimum=1),
+        analysis_cache_path=env.get("ANALYSIS_CACHE_PATH") or AppConfig.analysis_cache_path,
+        analysis_cache_ttl_seconds=_get_float(env, "ANALYSIS_CACHE_TTL_SECONDS", 7 * 24 * 3600.0, minimum=1.0),
+        analysis_cache_max_entries=_get_int(env, "ANALYSIS_CACHE_MAX_ENTRIES", 10000),
+        elevenlabs_api_key=env.get("ELEVENLABS_API_KEY") or None,
+        elevenlabs_agent_id=env.get("ELEVENLABS_AGENT_ID") or AppConfig.elevenlabs_agent_id,
+        elevenlabs_voice_id=env.get("ELEVENLABS_VOICE_ID") or AppConfig.elevenlabs_voice_id,
+        elevenlabs_api_base=(env.get("ELEVENLABS_API_BASE") or AppConfig.elevenlabs_api_base).rstrip("/"),
+        signed_url_pool_depth=_get_int(env, "ELEVENLABS_URL_POOL_DEPTH", 2),
+        signed_url_pool_refill_seconds=_get_float(env, "ELEVENLABS_URL_POOL_REFILL_SECONDS", 1.0),
+        signed_url_ttl_seconds=_get_float(env, "ELEVENLABS_URL_TTL_SECONDS", 900.0, minimum=1.0),
+        max_upload_bytes=_get_int(env, "MAX_UPLOAD_BYTES", 20 * 1024 * 1024, minimum=1),
+        upload_chunk_bytes=_get_int(env, "UPLOAD_CHUNK_BYTES", 64 * 1024, minimum=1024),
+        image_hot_cache_bytes=_get_int(env, "IMAGE_HOT_CACHE_BYTES", 16 * 1024 * 1024),
+        use_x_sendfile=_get_bool(env, "USE_X_SENDFILE", False),
+        image_zoom_pattern=zoom_pattern,
+        # An empty IMAGE_FETCH_CACHE_DIR keeps fetched images in memory only
+        image_fetch_cache_dir=env.get("IMAGE_FETCH_CACHE_DIR", AppConfig.image_fetch_cache_dir).strip() or None,
+        image_fetch_memory_bytes=_get_int(env, "IMAGE_FETCH_MEMORY_BYTES", AppConfig.image_fetch_memory_bytes),
+        image_fetch_disk_bytes=_get_int(env, "IMAGE_FETCH_DISK_BYTES", AppConfig.image_fetch_disk_bytes),
+        image_fetch_max_bytes=_get_int(env, "IMAGE_FETCH_MAX_BYTES", AppConfig.image_fetch_max_bytes, minimum=1),
+        image_fetch_timeout_seconds=_get_float(env, "IMAGE_FETCH_TIMEOUT_SECONDS", 10.0, minimum=0.1),
+        http_pool_maxsize=_get_int(env, "HTTP_POOL_MAXSIZE", 32, minimum=1),
+        session_ttl_seconds=_get_float(env, "SESSION_TTL_SECONDS", 3600.0, minimum=1.0),
+        storage_quota_bytes=_get_int(env, "STORAGE_QUOTA_BYTES", 1024 * 1024 * 1024, minimum=1),
+        janitor_interval_seconds=_get_float(env, "JANITOR_INTERVAL_SECONDS", 300.0, minimum=1.0),
+        janitor_grace_seconds=_get_float(env, "JANITOR_GRACE_SECONDS", 300.0),
+        config_watch_interval=_get_float(env, "CONFIG_WATCH_INTERVAL", 2.0, minimum=0.1),
+    )
+
+def load_config(env_path: str = ".env", base_env: Optional[Mapping[str, str]] = None) -> AppConfig:
+    """
+    Load configuration from the process environment and the .env file.
+    Values in the .env file take precedence, so editing it takes effect on reload.
+
+    Args:
+        env_path: Path to the .env file (it may not exist)
+        base_env: Process environment without the .env values (defaults to
+            os.environ); a key removed from .env then falls back to it instead
+            of to the value load_dotenv() copied into os.environ
+
+    Returns:
+        A validated AppConfig
+    """
+    env = dict(os.environ if base_env is None else base_env)
+    if os.path.exists(env_path):
+        env.update({k: v for k, v in dotenv_values(env_path).items() if v is not None})
+    return build_config(env)
+
+class ConfigStore:
+    """
+    Holds the current configuration snapshot and reloads it atomically.
+
+    Reads are a single attribute access. A reload builds a complete new snapshot
+    first and only swaps it in if validation passes, then notifies listeners
+    (e.g. to drop pooled provider clients). Reloads are triggered by SIGHUP or by
+    a change to the .env file's modification time.
+    """
+
+    def __init__(self, env_path: str = ".env", base_env: Optional[Mapping[str, str]] = None):
+        """
+        Load the initial snapshot.
+
+        Args:
+            env_path: Path to the .env file
+            base_env: Process environment as it was before the .env file was
+                loaded into it (see load_config)
+        """
+        self.env_path = env_path
+        self.base_env = dict(base_env) if base_env is not None else None
+        self.current: AppConfig = load_config(env_path, self.base_env)
+        self._listeners: List[Callable[[AppConfig, AppConfig], Any]] = []
+        self._reload_lock = threading.Lock()
+        self._reload_requested = threading.Event()
+        self._env_mtime = self._get_env_mtime()
+        self._watcher: Optional[threading.Thread] = None
+
+    def add_listener(self, listener: Callable[[AppConfig, AppConfig], Any]) -> None:
+        """Register a function called with (old, new) after each successful reload."""
+        self._listeners.append(listener)
+
+    def reload(self) -> bool:
+        """
+        Reload the configuration. The previous snapshot is kept if the new one is invalid.
+
+        Returns:
+            True if a new snapshot was swapped in
+        """
+        with self._reload_lock:
+            self._env_mtime = self._get_env_mtime()
+            try:
+                new_config = load_config(self.env_path, self.base_env)
+            except ConfigError as e:
+                logger.error(f"[Config] Reload rejected, keeping previous config: {str(e)}")
+                return False
+
+            old_config = self.current
+            if new_config == old_config:
+                return False
+            self.current = new_config
+            logger.info("[Config] Configuration reloaded")
+
+        for listener in self._listeners:
+            try:
+                listener(old_config, new_config)
+            except Exception as e:
+                logger.error(f"[Config] Reload listener failed: {str(e)}")
+        return True
+
+    def start_watching(self, interval: float = 2.0) -> None:
+        """
+        Start a daemon thread that reloads on SIGHUP or when the .env file changes.
+        The signal handler only flags the request; the reload itself runs on the
+        watcher thread, never inside the signal handler.
+
+        Args:
+            interval: Seconds between .env modification checks
+        """
+        if self._watcher and self._watcher.is_alive():
+            return
+
+        if hasattr(signal, "SIGHUP"):
+            try:
+                signal.signal(signal.SIGHUP, lambda signum, frame: self._reload_requested.set())
+            except ValueError:
+                # signal.signal only works in the main thread
+                logger.warning("[Config] Could not install SIGHUP handler outside the main thread")
+
+        self._watcher = threading.Thread(target=self._watch, args=(interval,),
+                                         name="config-watcher", daemon=True)
+        self._watcher.start()
+
+    def _get_env_mtime(self) -> Optional[float]:
+        try:
+            return os.stat(self.env_path).st_mtime
+        except OSError:
+            return None
+
+    def _watch(self, interval: float) -> None:
+        while True:
+            signalled = self._reload_requested.wait(interval)
+            self._reload_requested.clear()
+            if signalled or self._get_env_mtime() != self._env_mtime:
+                self.reload()
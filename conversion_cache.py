@@ -0,0 +1,165 @@
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional
+
+from image_payload import ImagePayload
+
+def message_fingerprint(msg: Dict[str, Any]) -> str:
+    """Hash an OpenAI-format message; images are hashed by content."""
+    content = msg.get("content")
+    if msg.get("role") == "assistant" and isinstance(content, str):
+        # Our own replies come back from the client, possibly with trimmed whitespace
+        content = content.strip()
+
+    def encode(value):
+        if isinstance(value, ImagePayload):
+            return {"image_sha256": value.sha256()}
+        if isinstance(value, bytes):
+            return {"image_sha256": hashlib.sha256(value).hexdigest()}
+        return str(value)
+
+    encoded = json.dumps([msg.get("role"), content], sort_keys=True, default=encode)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+class Incomplete:
+    """
+    A converted message that lost part of its content, e.g. an image that
+    could not be fetched in time. It is still sent, but never memoized, so
+    the next turn tries the conversion again.
+    """
+
+    __slots__ = ("value",)
+
+    def __init__(self, value: Any):
+        self.value = value
+
+def unwrap(converted: Any) -> Any:
+    """Return a converted message, whether or not it was marked Incomplete."""
+    return converted.value if isinstance(converted, Incomplete) else converted
+
+class Conversion(list):
+    """Converted messages, plus whether all of them were converted completely."""
+
+    def __init__(self, messages: List[Any], complete: bool = True):
+        super().__init__(messages)
+        self.complete = complete
+
+class ConversionCache:
+    """
+    Per-session memo of converted messages, keyed by message fingerprint.
+
+    A voice session's history only grows, so on each turn every message but
+    the new ones has been converted before. convert() looks each message up
+    and hands only the misses to the provider's converter, in one batch so
+    their images are still resolved in parallel. Converted image parts are
+    reused as they are; callers must not modify converted messages.
+    Conversions the converter marks Incomplete are used for this turn only.
+
+    Each session keeps at most max_messages conversions and at most
+    max_sessions sessions are kept, both least recently used first out.
+    """
+
+    def __init__(self, max_sessions: Optional[int] = None, max_messages: Optional[int] = None):
+        """
+        Initialize the cache. Unset limits come from CONVERSION_CACHE_SESSIONS
+        (default 256; 0 disables the cache) and CONVERSION_CACHE_MESSAGES (default 64).
+
+        Args:
+            max_sessions: Maximum number of sessions with memoized conversions
+            max_messages: Maximum number of memoized messages per session
+        """
+        if max_sessions is None:
+            max_sessions = int(os.environ.get("CONVERSION_CACHE_SESSIONS") or 256)
+        if max_messages is None:
+            max_messages = int(os.environ.get("CONVERSION_CACHE_MESSAGES") or 64)
+        self.max_sessions = max_sessions
+        self.max_messages = max_messages
+        self._sessions: "OrderedDict[str, OrderedDict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "evicted_messages": 0, "evicted_sessions": 0, "incomplete": 0}
+
+    def convert(self,
+                session_id: Optional[str],
+                messages: List[Dict[str, Any]],
+                convert: Callable[[List[Dict[str, Any]]], List[Any]],
+                fingerprints: Optional[List[str]] = None) -> Conversion:
+        """
+        Convert a conversation, reusing the session's earlier conversions.
+
+        Args:
+            session_id: Conversation identifier (None converts without memoizing)
+            messages: Messages in OpenAI format
+            convert: Converts a list of messages, returning one entry per input
+                message (None for messages the provider drops, Incomplete for
+                messages that lost content)
+            fingerprints: message_fingerprint() of each message, if already computed
+
+        Returns:
+            The converted messages, in order, without the dropped ones; complete
+            is False if any of them is Incomplete
+        """
+        if session_id is None or self.max_sessions <= 0 or self.max_messages <= 0:
+            converted = convert(messages)
+            return Conversion([unwrap(value) for value in converted if value is not None],
+                              complete=not any(isinstance(value, Incomplete) for value in converted))
+
+        if fingerprints is None:
+            fingerprints = [message_fingerprint(msg) for msg in messages]
+        results: List[Any] = [None] * len(messages)
+        missing: List[int] = []
+        with self._lock:
+            memo = self._sessions.get(session_id)
+            if memo is not None:
+                self._sessions.move_to_end(session_id)
+            for index, fingerprint in enumerate(fingerprints):
+                if memo is not None and fingerprint in memo:
+                    memo.move_to_end(fingerprint)
+                    results[index] = memo[fingerprint]
+                else:
+                    missing.append(index)
+            self._stats["hits"] += len(messages) - len(missing)
+            self._stats["misses"] += len(missing)
+
+        complete = True
+        if missing:
+            converted = convert([messages[index] for index in missing])
+            with self._lock:
+                memo = self._session_memo(session_id)
+                for index, value in zip(missing, converted):
+                    if isinstance(value, Incomplete):
+                        results[index] = value.value
+                        complete = False
+                        self._stats["incomplete"] += 1
+                        continue
+                    results[index] = value
+                    memo[fingerprints[index]] = value
+                    memo.move_to_end(fingerprints[index])
+                while len(memo) > self.max_messages:
+                    memo.popitem(last=False)
+                    self._stats["evicted_messages"] += 1
+
+        return Conversion([converted for converted in results if converted is not None], complete=complete)
+
+    def forget(self, session_id: str) -> None:
+        """Drop the memoized conversions of a session."""
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def stats(self) -> Dict[str, Any]:
+        """Return the number of sessions and hit, miss, eviction and incomplete conversion counts."""
+        with self._lock:
+            return {"sessions": len(self._sessions), "max_sessions": self.max_sessions,
+                    "max_messages": self.max_messages, **self._stats}
+
+    def _session_memo(self, session_id: str) -> "OrderedDict[str, Any]":
+        memo = self._sessions.get(session_id)
+        if memo is None:
+            memo = self._sessions[session_id] = OrderedDict()
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+                self._stats["evicted_sessions"] += 1
+        self._sessions.move_to_end(session_id)
+        return memo
@@ -0,0 +1,142 @@
+import time
+import threading
+import contextvars
+import logging
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+class DeadlineExceeded(TimeoutError):
+    """Raised when a turn runs out of time before a step could start or finish."""
+
+class Deadline:
+    """
+    End-to-end time budget of one voice turn.
+
+    The deadline is made current (activate()) around the provider call, so
+    provider clients and the image fetcher size their timeouts to what is
+    left of the turn instead of their own, longer defaults; the streaming
+    loop checks it between chunks.
+    """
+
+    def __init__(self, seconds: Optional[float]):
+        """
+        Initialize the deadline.
+
+        Args:
+            seconds: Time budget from now (None or <= 0 means no deadline)
+        """
+        self.seconds = seconds if seconds and seconds > 0 else None
+        self.expires_at = time.monotonic() + self.seconds if self.seconds else None
+
+    def remaining(self) -> Optional[float]:
+        """Return the seconds left (never negative), or None without a deadline."""
+        if self.expires_at is None:
+            return None
+        return max(0.0, self.expires_at - time.monotonic())
+
+    @property
+    def expired(self) -> bool:
+        return self.expires_at is not None and time.monotonic() >= self.expires_at
+
+    def check(self, step: str = "turn") -> None:
+        """Raise DeadlineExceeded if the deadline has passed."""
+        if self.expired:
+            raise DeadlineExceeded(f"Turn deadline of {self.seconds:g}s exceeded ({step})")
+
+    def timeout(self, default: Union[None, float, Tuple[float, float]] = None,
+                step: str = "call") -> Union[None, float, Tuple[float, float]]:
+        """
+        Compute the timeout of a blocking call made on behalf of the turn.
+
+        Args:
+            default: The call's own timeout, as seconds or a (connect, read) tuple
+            step: Name of the call, for the error message
+
+        Returns:
+            The default capped to the remaining time (same shape as default),
+            or the remaining time if there is no default
+
+        Raises:
+            DeadlineExceeded: If no time is left
+        """
+        remaining = self.remaining()
+        if remaining is None:
+            return default
+        self.check(step)
+        if default is None:
+            return remaining
+        if isinstance(default, tuple):
+            return tuple(min(part, remaining) for part in default)
+        return min(default, remaining)
+
+    @contextmanager
+    def activate(self) -> Iterator["Deadline"]:
+        """Make this the current deadline for the duration of the block."""
+        token = _current.set(self)
+        try:
+            yield self
+        finally:
+            _current.reset(token)
+
+NO_DEADLINE = Deadline(None)
+
+_current: contextvars.ContextVar = contextvars.ContextVar("turn_deadline", default=NO_DEADLINE)
+
+def current_deadline() -> Deadline:
+    """Return the deadline of the turn running in this context (NO_DEADLINE if none)."""
+    return _current.get()
+
+def call_timeout(default: Union[None, float, Tuple[float, float]] = None,
+                 step: str = "call") -> Union[None, float, Tuple[float, float]]:
+    """Cap a call's timeout to the current deadline (see Deadline.timeout)."""
+    return _current.get().timeout(default, step)
+
+def close_upstream(response: Any) -> None:
+    """
+    Abort a provider response that is still streaming.
+
+    Closes the stream (an OpenAI Stream or a provider's generator that owns
+    its HTTP response), so the connection is dropped and the provider stops
+    generating instead of us reading tokens nobody will hear.
+    """
+    close = getattr(response, "close", None)
+    if close is None:
+        return
+    try:
+        close()
+    except ValueError:
+        # A generator that is executing on another thread; it ends on its own
+        pass
+    except Exception as e:
+        logger.warning(f"[Deadline] Closing upstream response failed: {str(e)}")
+
+class TurnStats:
+    """Counters of turns that were cancelled by the client or ran past their deadline."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {"cancelled": 0, "cancelled_tokens": 0, "deadline_exceeded": 0}
+        self._deadline_steps: Dict[str, int] = {}
+
+    def record_cancelled(self, tokens: int) -> None:
+        """
+        Count a turn whose client went away mid-stream.
+
+        Args:
+            tokens: Completion tokens (streamed chunks) received before the upstream was closed
+        """
+        with self._lock:
+            self._stats["cancelled"] += 1
+            self._stats["cancelled_tokens"] += tokens
+
+    def record_deadline(self, step: str) -> None:
+        """Count a turn that ran out of time, by the step it was in."""
+        with self._lock:
+            self._stats["deadline_exceeded"] += 1
+            self._deadline_steps[step] = self._deadline_steps.get(step, 0) + 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {**self._stats, "deadline_steps": dict(self._deadline_steps)}
@@ -1,34 +1,95 @@
 import os
 import base64
-from typing import Dict, List, Optional, Union, Any
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple, Union, Any
 import google.generativeai as genai
-from io import BytesIO
-from PIL import Image
+from google.api_core import exceptions as google_exceptions
 
 from llm_service import LLMService
+from image_payload import ImagePayload
+from usage_ledger import gemini_image_tokens
+from profiling import stage
+from image_fetcher import default_fetcher
+from image_resolver import resolve_image_parts
+from conversion_cache import ConversionCache, Incomplete, message_fingerprint, unwrap
+from deadline import call_timeout
+
+class _CachedChat:
+    """A Gemini chat session, the model it was started with and the fingerprints of the messages in its history."""
+    
+    def __init__(self, chat: Any, model_name: str, fingerprints: List[str]):
+        self.chat = chat
+        self.model_name = model_name
+        self.fingerprints = fingerprints
+        self.lock = threading.Lock()
+    
+    def continues(self, messages: List[Dict[str, Any]], fingerprints: List[str]) -> bool:
+        """
+        Return whether a request only adds messages to this session's history.
+        
+        The cached history must be a prefix of the request's history, and the
+        request must end with a user message (send_message always posts a
+        user turn).
+        """
+        prior = len(self.fingerprints)
+        return (bool(messages) and messages[-1].get("role") == "user" and prior < len(fingerprints)
+                and fingerprints[:prior] == self.fingerprints)
 
 class GeminiService(LLMService):
     """
     Google Gemini implementation of the LLMService interface.
     Handles communication with Google's Generative AI API for chat completions and image processing.
+    
+    Chat sessions are cached per session_id. When the incoming history is the
+    cached history plus new messages ending with a user message, only the new
+    messages are converted and sent; any other change to the history rebuilds
+    the session. A turn routed to a different model continues the cached
+    history on that model. A chat whose history lost an image (e.g. a fetch
+    that failed) is not cached, so the next turn rebuilds it with the image.
+    
+    Converted messages are also memoized per session_id, so rebuilding a
+    session only converts (and fetches the images of) messages it hasn't
+    seen before.
     """
     
-    def __init__(self, api_key: Optional[str] = None):
+    keeps_chat_sessions = True
+    
+    def __init__(self, api_key: Optional[str] = None, api_endpoint: Optional[str] = None,
+                 chat_cache_size: Optional[int] = None):
         """
         Initialize the Gemini service with an API key.
         
         Args:
             api_key: Google API key (will use environment variable if not provided)
+            api_endpoint: API endpoint override (will use GEMINI_API_ENDPOINT if set,
+                e.g. for a local stand-in; the REST transport is used in that case)
+            chat_cache_size: Maximum number of cached chat sessions (will use
+                GEMINI_CHAT_CACHE_SIZE if set, default 128; 0 disables the cache)
         """
         self.api_key = api_key or os.environ.get("GEMINI_API_KEY")
-        genai.configure(api_key=self.api_key)
+        self.api_endpoint = api_endpoint or os.environ.get("GEMINI_API_ENDPOINT") or None
+        if self.api_endpoint:
+            genai.configure(api_key=self.api_key, transport="rest",
+                            client_options={"api_endpoint": self.api_endpoint})
+        else:
+            genai.configure(api_key=self.api_key)
+        
+        if chat_cache_size is None:
+            chat_cache_size = int(os.environ.get("GEMINI_CHAT_CACHE_SIZE") or 128)
+        self.chat_cache_size = chat_cache_size
+        self._chat_cache: "OrderedDict[str, _CachedChat]" = OrderedDict()
+        self._chat_cache_lock = threading.Lock()
+        self._chat_cache_stats = {"hits": 0, "rebuilds": 0, "misses": 0, "evictions": 0}
+        self._conversion_cache = ConversionCache()
     
     def chat_completion(self, 
                        messages: List[Dict[str, Any]], 
                        model: Optional[str] = None,
                        temperature: Optional[float] = 0.7,
                        max_tokens: Optional[int] = None,
-                       stream: bool = False) -> Union[Dict[str, Any], Any]:
+                       stream: bool = False,
+                       session_id: Optional[str] = None) -> Union[Dict[str, Any], Any]:
         """
         Generate a chat completion using Google's Gemini API.
         
@@ -38,19 +99,14 @@ class GeminiService(LLMService):
             temperature: Temperature parameter (default: 0.7)
             max_tokens: Maximum number of tokens to generate
             stream: Whether to stream the response
+            session_id: Conversation identifier; when given, the chat session is
+                cached and later calls send only the new turn
             
         Returns:
             Either a completion response object or a stream
         """
-        # Convert OpenAI format messages to Gemini format
-        gemini_messages = self._convert_to_gemini_format(messages)
-        
         # Initialize the model with a default if not specified
         model_name = model if model is not None else "gemini-1.5-pro"
-        model_obj = genai.GenerativeModel(model_name=model_name)
-        
-        # Create a chat session
-        chat = model_obj.start_chat(history=gemini_messages)
         
         # Prepare generation config
         generation_config = {"temperature": temperature}
@@ -59,11 +115,53 @@ class GeminiService(LLMService):
         if max_tokens is not None:
             generation_config["max_output_tokens"] = max_tokens
         
-        # Generate response
-        response = chat.send_message(
-            gemini_messages[-1]["parts"] if gemini_messages else "",
-            generation_config=generation_config
-        )
+        fingerprints = [message_fingerprint(msg) for msg in messages]
+        cached = self._checkout_chat(session_id, messages, fingerprints)
+        try:
+            with stage("gemini.convert"):
+                if cached is not None and cached.continues(messages, fingerprints):
+                    # The session already holds everything before the new messages
+                    prior = len(cached.fingerprints)
+                    new_turn = self._conversion_cache.convert(session_id, messages[prior:], self._convert_messages,
+                                                              fingerprints[prior:])
+                    complete = new_turn.complete
+                    chat = cached.chat
+                    if cached.model_name != model_name:
+                        # Routed to another model: same (already converted) history, new model
+                        chat = genai.GenerativeModel(model_name=model_name).start_chat(history=chat.history)
+                    if len(new_turn) > 1:
+                        chat.history = list(chat.history) + new_turn[:-1]
+                else:
+                    # Convert OpenAI format messages to Gemini format (reusing earlier
+                    # conversions of this session); the last message is sent below,
+                    # so it is not part of the history
+                    gemini_messages = self._conversion_cache.convert(session_id, messages, self._convert_messages,
+                                                                     fingerprints)
+                    complete = gemini_messages.complete
+                    new_turn = gemini_messages[-1:]
+                    chat = genai.GenerativeModel(model_name=model_name).start_chat(history=gemini_messages[:-1])
+            
+            # Generate response, within what is left of the turn's deadline (if any)
+            request_options = {}
+            timeout = call_timeout(step="gemini.send_message")
+            if timeout is not None:
+                request_options["timeout"] = timeout
+            with stage("gemini.send_message"):
+                response = chat.send_message(
+                    new_turn[-1]["parts"] if new_turn else "",
+                    generation_config=generation_config,
+                    request_options=request_options
+                )
+        except Exception:
+            self._forget_chat(session_id, cached)
+            raise
+        
+        if session_id is not None and not complete:
+            # An image was left out of this history: the next turn starts over and retries it
+            self._forget_chat(session_id, cached)
+        elif session_id is not None:
+            reply = {"role": "assistant", "content": self._response_text(response)}
+            self._store_chat(session_id, model_name, cached, chat, fingerprints + [message_fingerprint(reply)])
         
         # Format the response to match OpenAI's format for consistency
         if stream:
@@ -73,12 +171,83 @@ class GeminiService(LLMService):
         else:
             return self._format_gemini_response(response)
     
-    def process_image(self, image_data: Union[str, bytes, Dict[str, Any]]) -> Dict[str, Any]:
+    def warmup(self) -> None:
+        """Open the channel to the API by listing a single model."""
+        try:
+            next(iter(genai.list_models(page_size=1, request_options={"timeout": 10.0})), None)
+        except google_exceptions.ClientError:
+            # Any HTTP answer means the connection is up
+            pass
+    
+    def stats(self) -> Dict[str, Any]:
+        """Return hit, rebuild, miss and eviction counts of the chat session and conversion caches."""
+        with self._chat_cache_lock:
+            chat_cache = {"size": len(self._chat_cache), "max_size": self.chat_cache_size,
+                          **self._chat_cache_stats}
+        return {"chat_cache": chat_cache, "conversion_cache": self._conversion_cache.stats()}
+    
+    def _checkout_chat(self, session_id: Optional[str], messages: List[Dict[str, Any]],
+                       fingerprints: List[str]) -> Optional[_CachedChat]:
+        """
+        Take the cached chat of a session for exclusive use.
+        
+        Returns:
+            The cached chat (locked; released by _store_chat or _forget_chat), or
+            None if there is none or another request of the session is using it
+        """
+        if session_id is None or self.chat_cache_size <= 0:
+            return None
+        with self._chat_cache_lock:
+            cached = self._chat_cache.get(session_id)
+            if cached is None or not cached.lock.acquire(blocking=False):
+                self._chat_cache_stats["misses"] += 1
+                return None
+            self._chat_cache.move_to_end(session_id)
+            if cached.continues(messages, fingerprints):
+                self._chat_cache_stats["hits"] += 1
+            else:
+                self._chat_cache_stats["rebuilds"] += 1
+            return cached
+    
+    def _store_chat(self, session_id: str, model_name: str, cached: Optional[_CachedChat],
+                    chat: Any, fingerprints: List[str]) -> None:
+        """Save a session's chat after a successful call, evicting the least recently used."""
+        if self.chat_cache_size <= 0:
+            return
+        key = session_id
+        with self._chat_cache_lock:
+            if cached is not None:
+                cached.chat = chat
+                cached.model_name = model_name
+                cached.fingerprints = fingerprints
+                cached.lock.release()
+                self._chat_cache[key] = cached
+            else:
+                current = self._chat_cache.get(key)
+                # If another request of this session holds the entry, keep theirs
+                if current is None or not current.lock.locked():
+                    self._chat_cache[key] = _CachedChat(chat, model_name, fingerprints)
+            if key in self._chat_cache:
+                self._chat_cache.move_to_end(key)
+            while len(self._chat_cache) > self.chat_cache_size:
+                self._chat_cache.popitem(last=False)
+                self._chat_cache_stats["evictions"] += 1
+    
+    def _forget_chat(self, session_id: Optional[str], cached: Optional[_CachedChat]) -> None:
+        """Drop a session's chat after a failed call or an incomplete conversion; its history may be inconsistent."""
+        if cached is None:
+            return
+        with self._chat_cache_lock:
+            if self._chat_cache.get(session_id) is cached:
+                del self._chat_cache[session_id]
+            cached.lock.release()
+    
+    def process_image(self, image_data: Union[str, bytes, Dict[str, Any], ImagePayload]) -> Dict[str, Any]:
         """
         Process an image for inclusion in a Gemini message.
         
         Args:
-            image_data: Either a URL string, raw image bytes, or a dictionary with image data
+            image_data: A URL string, raw image bytes, an ImagePayload, or a dictionary with image data
             
         Returns:
             Processed image data in the format expected by Gemini (always a dict with mime_type and data)
@@ -86,14 +255,20 @@ class GeminiService(LLMService):
         print(f"Gemini process_image received data of type: {type(image_data)}")
         
         try:
+            # ImagePayload already carries the bytes; decoding (if any) is memoized
+            if isinstance(image_data, ImagePayload):
+                return {"mime_type": image_data.mime_type, "data": image_data.to_bytes()}
+            
             # Handle dictionary input (likely from OpenAI format)
-            if isinstance(image_data, dict):
+            elif isinstance(image_data, dict):
                 print(f"Processing dictionary image data with keys: {list(image_data.keys())}")
                 # If it already has the format Gemini expects, return it directly
                 if "mime_type" in image_data and "data" in image_data:
                     print("Image data already in Gemini format (mime_type + data)")
                     return image_data
                 # If it has a URL field, extract and process the URL
+                elif isinstance(image_data.get("url"), ImagePayload):
+                    return self.process_image(image_data["url"])
                 elif "url" in image_data:
                     url = image_data["url"]
                     print(f"Extracted URL from dictionary: {url[:30] if isinstance(url, str) else type(url)}...")
@@ -135,11 +310,9 @@ class GeminiService(LLMService):
         # Handle HTTP/HTTPS URLs
         if data.startswith('http://') or data.startswith('https://'):
             try:
-                import requests
-                print(f"Downloading image from URL: {data[:30]}...")
-                response = requests.get(data)
-                response.raise_for_status()
-                return {"mime_type": "image/jpeg", "data": response.content}
+                # Cached, size-capped and shared between concurrent turns
+                payload = default_fetcher().fetch(data)
+                return {"mime_type": payload.mime_type, "data": payload.to_bytes()}
             except Exception as e:
                 print(f"Error downloading image from URL: {str(e)}")
                 raise
@@ -147,11 +320,9 @@ class GeminiService(LLMService):
         # Handle base64 data URLs
         elif data.startswith('data:'):
             try:
-                # Extract MIME type and base64 data
-                mime_type = data.split(';')[0].split(':')[1]
-                base64_str = data.split(',')[1]
-                image_bytes = base64.b64decode(base64_str)
-                return {"mime_type": mime_type, "data": image_bytes}
+                # Extract MIME type and decode the base64 data once
+                payload = ImagePayload.from_data_url(data)
+                return {"mime_type": payload.mime_type, "data": payload.to_bytes()}
             except Exception as e:
                 print(f"Error processing base64 data URL: {str(e)}")
                 raise
@@ -176,8 +347,25 @@ class GeminiService(LLMService):
         Returns:
             Messages in Gemini format
         """
+        return [unwrap(msg) for msg in self._convert_messages(openai_messages) if msg is not None]
+    
+    def _convert_messages(self, openai_messages: List[Dict[str, Any]]) -> List[Any]:
+        """
+        Convert messages from OpenAI format to Gemini format, one by one.
+        
+        Args:
+            openai_messages: Messages in OpenAI format
+            
+        Returns:
+            The Gemini message for each input message (None for roles Gemini
+            has no equivalent for, wrapped in Incomplete if an image of the
+            message could not be processed)
+        """
         print(f"Converting {len(openai_messages)} messages to Gemini format")
-        gemini_messages = []
+        gemini_messages: List[Any] = []
+        
+        # Fetch/decode all images of the conversation up front, in parallel
+        resolved_images = resolve_image_parts(openai_messages, lambda item: self.process_image(item[item["type"]]))
         
         for i, msg in enumerate(openai_messages):
             print(f"Processing message {i+1}/{len(openai_messages)} with role: {msg['role']}")
@@ -193,6 +381,7 @@ class GeminiService(LLMService):
             elif role == "user" or role == "assistant":
                 # Convert content to Gemini's format
                 parts = []
+                complete = True
                 
                 # Handle string content
                 if isinstance(msg["content"], str):
@@ -204,36 +393,66 @@ class GeminiService(LLMService):
                         print(f"  Item {j+1} type: {item.get('type', 'unknown')}")
                         if item.get("type") == "text":
                             parts.append(item["text"])
-                        elif item.get("type") == "image_url":
-                            # Process image URL using our helper method
-                            try:
-                                print(f"Processing image_url using process_image method")
-                                processed_image = self.process_image(item["image_url"])
-                                parts.append(processed_image)
-                            except Exception as e:
-                                print(f"Error processing image_url: {str(e)}")
-                                # Skip this image
-                                continue
-                        elif item.get("type") == "image_data":
-                            # Process image data using our helper method
-                            try:
-                                print(f"Processing image_data using process_image method")
-                                processed_image = self.process_image(item["image_data"])
-                                parts.append(processed_image)
-                            except Exception as e:
-                                print(f"Error processing image_data: {str(e)}")
-                                # Skip this image
+                        elif item.get("type") in ("image_url", "image_data"):
+                            processed_image = resolved_images[(i, j)]
+                            if isinstance(processed_image, Exception):
+                                print(f"Error processing {item['type']}: {str(processed_image)}")
+                                # Skip this image (this time only; the message is not memoized)
+                                complete = False
                                 continue
+                            parts.append(processed_image)
                 
                 # Map the role and add the content
                 gemini_role = "user" if role == "user" else "model"
-                gemini_messages.append({
+                gemini_message = {
                     "role": gemini_role,
                     "parts": parts
-                })
+                }
+                gemini_messages.append(gemini_message if complete else Incomplete(gemini_message))
+            else:
+                gemini_messages.append(None)
         
         return gemini_messages
     
+    def _response_text(self, gemini_response: Any) -> str:
+        """Extract the text content from a Gemini response."""
+        try:
+            return gemini_response.text
+        except (AttributeError, ValueError):
+            # Try different ways to access the content based on response structure
+            try:
+                return gemini_response.candidates[0].content.parts[0].text
+            except (AttributeError, IndexError):
+                try:
+                    return str(gemini_response)
+                except:
+                    return "Unable to extract response text"
+    
+    def _format_usage(self, usage_metadata: Any) -> Dict[str, Any]:
+        """
+        Convert Gemini usage_metadata to OpenAI's usage structure.
+        
+        Args:
+            usage_metadata: usage_metadata of a Gemini response (may be missing)
+            
+        Returns:
+            Usage dict with prompt, completion and total tokens (-1 if unknown)
+            and the cached and image prompt tokens
+        """
+        if usage_metadata is None:
+            return {"prompt_tokens": -1, "completion_tokens": -1, "total_tokens": -1}
+        prompt_tokens = getattr(usage_metadata, "prompt_token_count", 0) or 0
+        completion_tokens = getattr(usage_metadata, "candidates_token_count", 0) or 0
+        return {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": getattr(usage_metadata, "total_token_count", 0) or prompt_tokens + completion_tokens,
+            "prompt_tokens_details": {
+                "cached_tokens": getattr(usage_metadata, "cached_content_token_count", 0) or 0,
+                "image_tokens": gemini_image_tokens(usage_metadata)
+            }
+        }
+    
     def _format_gemini_response(self, gemini_response: Any, stream: bool = False) -> Dict[str, Any]:
         """
         Format Gemini response to match OpenAI's format for consistency.
@@ -246,18 +465,8 @@ class GeminiService(LLMService):
             Response formatted to match OpenAI's structure
         """
         # Extract the text content from the Gemini response
-        response_text = ""
-        try:
-            response_text = gemini_response.text
-        except AttributeError:
-            # Try different ways to access the content based on response structure
-            try:
-                response_text = gemini_response.candidates[0].content.parts[0].text
-            except (AttributeError, IndexError):
-                try:
-                    response_text = str(gemini_response)
-                except:
-                    response_text = "Unable to extract response text"
+        response_text = self._response_text(gemini_response)
+        usage = self._format_usage(getattr(gemini_response, "usage_metadata", None))
         
         if stream:
             # This is a simplified version that doesn't actually stream
@@ -276,7 +485,8 @@ class GeminiService(LLMService):
                         },
                         "finish_reason": "stop"
                     }
-                ]
+                ],
+                "usage": usage
             }
         else:
             return {
@@ -294,11 +504,7 @@ class GeminiService(LLMService):
                         "finish_reason": "stop"
                     }
                 ],
-                "usage": {
-                    "prompt_tokens": -1,  # Not available from Gemini
-                    "completion_tokens": -1,  # Not available from Gemini
-                    "total_tokens": -1  # Not available from Gemini
-                }
+                "usage": usage
             }
 
 def import_time():
@@ -0,0 +1,73 @@
+import time
+import threading
+from typing import Dict, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# One Session for every plain-HTTP dependency (ElevenLabs, Anthropic, image
+# fetches), so connections are kept alive and reused between requests instead
+# of paying DNS, TCP and TLS setup on each call
+_session: Optional[requests.Session] = None
+_session_lock = threading.Lock()
+_pool_maxsize = 32
+
+def get_session() -> requests.Session:
+    """
+    Return the shared HTTP session, creating it on first use.
+
+    The connection pool size per host is set by configure() (default 32).
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            _mount(session, _pool_maxsize)
+            _session = session
+        return _session
+
+def configure(pool_maxsize: int) -> None:
+    """
+    Set the connection pool size per host (at startup and on configuration reload).
+
+    A changed size takes effect on an existing session by mounting a new
+    pool; connections of the old one are dropped once their requests finish.
+
+    Args:
+        pool_maxsize: Maximum number of pooled connections per host
+    """
+    global _pool_maxsize
+    with _session_lock:
+        if pool_maxsize == _pool_maxsize:
+            return
+        _pool_maxsize = pool_maxsize
+        if _session is not None:
+            _mount(_session, pool_maxsize)
+
+def _mount(session: requests.Session, pool_maxsize: int) -> None:
+    adapter = HTTPAdapter(pool_connections=16, pool_maxsize=pool_maxsize)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+
+def probe(url: str, timeout: float = 5.0, headers: Optional[Dict[str, str]] = None) -> float:
+    """
+    Open (or reuse) a pooled connection to a host with a HEAD request.
+
+    Any HTTP status counts as reachable: the point is the warm connection,
+    which stays in the pool for the next real request.
+
+    Args:
+        url: URL on the host to warm
+        timeout: Connect and read timeout in seconds
+        headers: Optional request headers
+
+    Returns:
+        Round-trip time in milliseconds
+
+    Raises:
+        requests.exceptions.RequestException: If the host can't be reached
+    """
+    start = time.perf_counter()
+    response = get_session().head(url, headers=headers, timeout=timeout, allow_redirects=False)
+    response.close()
+    return round((time.perf_counter() - start) * 1000, 1)
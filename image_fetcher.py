@@ -0,0 +1,384 @@
+import os
+import json
+import time
+import hashlib
+import tempfile
+import mimetypes
+import threading
+import logging
+from collections import OrderedDict
+from email.utils import parsedate_to_datetime
+from typing import Any, Dict, Optional, Tuple
+
+import requests
+
+from http_pool import get_session
+from image_payload import ImagePayload
+from deadline import DeadlineExceeded, call_timeout, current_deadline
+from profiling import stage
+
+logger = logging.getLogger(__name__)
+
+class ImageTooLarge(ValueError):
+    """Raised when a remote image exceeds the maximum download size."""
+
+class _Entry:
+    """A cached image with the validators needed to revalidate it."""
+
+    __slots__ = ("data", "mime_type", "etag", "last_modified", "fresh_until")
+
+    def __init__(self, data: bytes, mime_type: str, etag: Optional[str],
+                 last_modified: Optional[str], fresh_until: float):
+        self.data = data
+        self.mime_type = mime_type
+        self.etag = etag
+        self.last_modified = last_modified
+        self.fresh_until = fresh_until
+
+    def metadata(self) -> Dict[str, Any]:
+        return {"mime_type": self.mime_type, "etag": self.etag,
+                "last_modified": self.last_modified, "fresh_until": self.fresh_until}
+
+class _Pending:
+    """A fetch in progress that other requests for the same URL wait on."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.entry: Optional[_Entry] = None
+        self.error: Optional[BaseException] = None
+
+class RemoteImageFetcher:
+    """
+    Downloads images referenced by URL, with caching.
+
+    Images are kept in a memory LRU and a disk LRU, each bounded in bytes.
+    A cached image is served without any request while it is fresh (per its
+    Cache-Control max-age, or default_max_age); after that it is revalidated
+    with If-None-Match / If-Modified-Since, so an unchanged image costs a 304
+    instead of a download. Downloads are capped at max_bytes and use connect
+    and read timeouts. Concurrent fetches of the same URL share one download.
+    """
+
+    def __init__(self,
+                 cache_dir: Optional[str] = None,
+                 memory_bytes: int = 64 * 1024 * 1024,
+                 disk_bytes: int = 512 * 1024 * 1024,
+                 max_bytes: int = 20 * 1024 * 1024,
+                 connect_timeout: float = 3.05,
+                 read_timeout: float = 10.0,
+                 default_max_age: float = 60.0,
+                 session: Optional[requests.Session] = None):
+        """
+        Initialize the fetcher.
+
+        Args:
+            cache_dir: Directory of the disk cache (None keeps images in memory only)
+            memory_bytes: Maximum total size of images kept in memory
+            disk_bytes: Maximum total size of images kept on disk
+            max_bytes: Maximum size of a single image
+            connect_timeout: Seconds to wait for the connection
+            read_timeout: Seconds to wait between bytes of the response
+            default_max_age: Seconds an image is used without revalidation when
+                the server doesn't say
+            session: HTTP session (the shared pooled session by default)
+        """
+        self.cache_dir = cache_dir
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        self.max_bytes = max_bytes
+        self.timeout = (connect_timeout, read_timeout)
+        self.default_max_age = default_max_age
+        self.session = session
+
+        self._memory: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._memory_size = 0
+        self._pending: Dict[str, _Pending] = {}
+        self._lock = threading.Lock()
+        self._disk_lock = threading.Lock()
+        self._stats = {"memory_hits": 0, "disk_hits": 0, "revalidated": 0, "downloads": 0,
+                       "coalesced": 0, "too_large": 0, "errors": 0, "bytes_downloaded": 0}
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def fetch(self, url: str) -> ImagePayload:
+        """
+        Return the image at a URL, from the cache when possible.
+
+        Args:
+            url: HTTP(S) URL of the image
+
+        Returns:
+            ImagePayload with the image bytes and MIME type
+
+        Raises:
+            ImageTooLarge: If the image exceeds max_bytes
+            requests.exceptions.RequestException: If the download fails
+            DeadlineExceeded: If the current turn's deadline passes first
+        """
+        with self._lock:
+            entry = self._memory.get(url)
+            if entry is not None and entry.fresh_until > time.time():
+                self._memory.move_to_end(url)
+                self._stats["memory_hits"] += 1
+                return ImagePayload(entry.data, mime_type=entry.mime_type)
+            pending = self._pending.get(url)
+            leader = pending is None
+            if leader:
+                pending = self._pending[url] = _Pending()
+            else:
+                self._stats["coalesced"] += 1
+
+        if not leader:
+            # The shared download runs on the leader's deadline; don't wait past ours
+            if not pending.done.wait(current_deadline().remaining()):
+                raise DeadlineExceeded(f"Turn deadline exceeded waiting for {url[:80]}")
+            if pending.error is not None:
+                raise pending.error
+            return ImagePayload(pending.entry.data, mime_type=pending.entry.mime_type)
+
+        try:
+            pending.entry = self._load(url, entry)
+            return ImagePayload(pending.entry.data, mime_type=pending.entry.mime_type)
+        except BaseException as e:
+            pending.error = e
+            with self._lock:
+                self._stats["too_large" if isinstance(e, ImageTooLarge) else "errors"] += 1
+            raise
+        finally:
+            with self._lock:
+                del self._pending[url]
+            pending.done.set()
+
+    def update_limits(self, memory_bytes: int, disk_bytes: int, max_bytes: int, read_timeout: float) -> None:
+        """Apply new size limits and read timeout (e.g. after a configuration reload), trimming the caches."""
+        with self._lock:
+            self.memory_bytes = memory_bytes
+            self.max_bytes = max_bytes
+            self.timeout = (self.timeout[0], read_timeout)
+            while self._memory and self._memory_size > self.memory_bytes:
+                _, evicted = self._memory.popitem(last=False)
+                self._memory_size -= len(evicted.data)
+        if self.cache_dir and disk_bytes != self.disk_bytes:
+            with self._disk_lock:
+                self.disk_bytes = disk_bytes
+                self._evict_disk()
+        self.disk_bytes = disk_bytes
+
+    def stats(self) -> Dict[str, Any]:
+        """Return cache sizes and hit, revalidation and download counts."""
+        with self._lock:
+            return {"memory_entries": len(self._memory), "memory_bytes": self._memory_size,
+                    "max_memory_bytes": self.memory_bytes, **self._stats}
+
+    def _load(self, url: str, stale: Optional[_Entry]) -> _Entry:
+        """Get an image that isn't fresh in memory: from disk, by revalidation or by download."""
+        if stale is None:
+            stale = self._read_disk(url)
+            if stale is not None and stale.fresh_until > time.time():
+                with self._lock:
+                    self._stats["disk_hits"] += 1
+                self._remember(url, stale)
+                return stale
+
+        headers = {}
+        if stale is not None:
+            if stale.etag:
+                headers["If-None-Match"] = stale.etag
+            if stale.last_modified:
+                headers["If-Modified-Since"] = stale.last_modified
+
+        session = self.session or get_session()
+        try:
+            timeout = call_timeout(self.timeout, step="image fetch")
+            with stage("image_fetch"), session.get(url, headers=headers, timeout=timeout, stream=True) as response:
+                if response.status_code == 304 and stale is not None:
+                    entry = _Entry(stale.data, stale.mime_type,
+                                   response.headers.get("ETag") or stale.etag,
+                                   response.headers.get("Last-Modified") or stale.last_modified,
+                                   self._fresh_until(response))
+                    with self._lock:
+                        self._stats["revalidated"] += 1
+                else:
+                    response.raise_for_status()
+                    data = self._read_capped(url, response)
+                    entry = _Entry(data, self._mime_type(url, response),
+                                   response.headers.get("ETag"), response.headers.get("Last-Modified"),
+                                   self._fresh_until(response))
+                    with self._lock:
+                        self._stats["downloads"] += 1
+                        self._stats["bytes_downloaded"] += len(data)
+        except (requests.exceptions.RequestException, DeadlineExceeded) as e:
+            if stale is None:
+                raise
+            # Better a slightly stale image than a failed turn
+            logger.warning(f"[Image fetcher] Revalidating {url[:80]} failed, serving cached copy: {str(e)}")
+            return stale
+
+        self._remember(url, entry)
+        self._write_disk(url, entry)
+        return entry
+
+    def _read_capped(self, url: str, response: requests.Response) -> bytes:
+        length = response.headers.get("Content-Length")
+        if length and length.isdigit() and int(length) > self.max_bytes:
+            raise ImageTooLarge(f"Image at {url[:80]} is {length} bytes (limit {self.max_bytes})")
+        chunks = []
+        size = 0
+        deadline = current_deadline()
+        for chunk in response.iter_content(chunk_size=64 * 1024):
+            # The read timeout only bounds the gaps between chunks
+            deadline.check("image fetch")
+            size += len(chunk)
+            if size > self.max_bytes:
+                raise ImageTooLarge(f"Image at {url[:80]} exceeds {self.max_bytes} bytes")
+            chunks.append(chunk)
+        return b"".join(chunks)
+
+    @staticmethod
+    def _mime_type(url: str, response: requests.Response) -> str:
+        content_type = (response.headers.get("Content-Type") or "").split(";")[0].strip().lower()
+        if content_type.startswith("image/"):
+            return content_type
+        return mimetypes.guess_type(url.split("?")[0])[0] or "image/jpeg"
+
+    def _fresh_until(self, response: requests.Response) -> float:
+        """Compute until when an image may be used without revalidation."""
+        now = time.time()
+        cache_control = (response.headers.get("Cache-Control") or "").lower()
+        directives = {}
+        for part in cache_control.split(","):
+            name, _, value = part.strip().partition("=")
+            directives[name] = value
+        if "no-cache" in directives or "no-store" in directives:
+            return now
+        if directives.get("max-age", "").isdigit():
+            return now + int(directives["max-age"])
+        expires = response.headers.get("Expires")
+        if expires:
+            try:
+                return parsedate_to_datetime(expires).timestamp()
+            except (TypeError, ValueError):
+                return now
+        return now + self.default_max_age
+
+    def _remember(self, url: str, entry: _Entry) -> None:
+        """Put an image in the memory LRU, evicting the least recently used."""
+        if len(entry.data) > self.memory_bytes:
+            return
+        with self._lock:
+            previous = self._memory.pop(url, None)
+            if previous is not None:
+                self._memory_size -= len(previous.data)
+            self._memory[url] = entry
+            self._memory_size += len(entry.data)
+            while self._memory_size > self.memory_bytes:
+                _, evicted = self._memory.popitem(last=False)
+                self._memory_size -= len(evicted.data)
+
+    def _disk_paths(self, url: str) -> Tuple[str, str]:
+        name = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, f"{name}.img"), os.path.join(self.cache_dir, f"{name}.json")
+
+    def _read_disk(self, url: str) -> Optional[_Entry]:
+        if not self.cache_dir:
+            return None
+        data_path, meta_path = self._disk_paths(url)
+        try:
+            with open(meta_path) as f:
+                metadata = json.load(f)
+            with open(data_path, "rb") as f:
+                data = f.read()
+            # The file's mtime is its last use, for LRU eviction
+            os.utime(data_path)
+        except (OSError, ValueError):
+            return None
+        return _Entry(data, metadata.get("mime_type") or "image/jpeg", metadata.get("etag"),
+                      metadata.get("last_modified"), metadata.get("fresh_until") or 0.0)
+
+    def _write_disk(self, url: str, entry: _Entry) -> None:
+        if not self.cache_dir or len(entry.data) > self.disk_bytes:
+            return
+        data_path, meta_path = self._disk_paths(url)
+        try:
+            with self._disk_lock:
+                for path, content in ((data_path, entry.data),
+                                      (meta_path, json.dumps(entry.metadata()).encode("utf-8"))):
+                    # Write to a temporary file first so readers never see a partial image
+                    fd, temp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".part")
+                    with os.fdopen(fd, "wb") as f:
+                        f.write(content)
+                    os.replace(temp_path, path)
+                self._evict_disk()
+        except OSError as e:
+            logger.warning(f"[Image fetcher] Could not write disk cache entry: {str(e)}")
+
+    def _evict_disk(self) -> None:
+        """Delete the least recently used images until the disk cache fits its budget."""
+        images = []
+        total = 0
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(".img"):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            images.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+        for _, size, path in sorted(images):
+            if total <= self.disk_bytes:
+                break
+            for victim in (path, path[:-len(".img")] + ".json"):
+                try:
+                    os.remove(victim)
+                except OSError:
+                    pass
+            total -= size
+
+_default_fetcher: Optional[RemoteImageFetcher] = None
+_default_fetcher_lock = threading.Lock()
+
+DEFAULT_CACHE_DIR = "data/image_cache"
+
+def default_fetcher() -> RemoteImageFetcher:
+    """
+    Return the shared fetcher used by the provider services, creating it with
+    default settings on first use unless configure_default_fetcher() ran first.
+    """
+    global _default_fetcher
+    with _default_fetcher_lock:
+        if _default_fetcher is None:
+            _default_fetcher = RemoteImageFetcher(cache_dir=DEFAULT_CACHE_DIR)
+        return _default_fetcher
+
+def configure_default_fetcher(cache_dir: Optional[str],
+                              memory_bytes: int,
+                              disk_bytes: int,
+                              max_bytes: int,
+                              read_timeout: float) -> RemoteImageFetcher:
+    """
+    Apply settings to the shared fetcher (at startup and on configuration reload).
+
+    Limits are changed in place; a different cache directory replaces the
+    fetcher (its memory cache starts empty).
+
+    Args:
+        cache_dir: Directory of the disk cache (None keeps images in memory only)
+        memory_bytes: Maximum total size of images kept in memory
+        disk_bytes: Maximum total size of images kept on disk
+        max_bytes: Maximum size of a single image
+        read_timeout: Seconds to wait between bytes of a response
+
+    Returns:
+        The shared fetcher
+    """
+    global _default_fetcher
+    with _default_fetcher_lock:
+        if _default_fetcher is None or _default_fetcher.cache_dir != cache_dir:
+            _default_fetcher = RemoteImageFetcher(cache_dir=cache_dir, memory_bytes=memory_bytes,
+                                                  disk_bytes=disk_bytes, max_bytes=max_bytes,
+                                                  read_timeout=read_timeout)
+        else:
+            _default_fetcher.update_limits(memory_bytes, disk_bytes, max_bytes, read_timeout)
+        return _default_fetcher
@@ -0,0 +1,114 @@
+import mmap
+import base64
+import hashlib
+import mimetypes
+from typing import Optional, Union
+
+class ImagePayload:
+    """
+    An image passed through the LLM services without repeated copying.
+
+    The payload holds either the raw bytes (bytes, memoryview or an mmap of the
+    stored file) or the base64 text it arrived as, plus its MIME type. The other
+    representations are computed on first use and memoized, so each provider
+    encodes or decodes an image at most once however many times it is asked.
+    """
+
+    def __init__(self,
+                 data: Optional[Union[bytes, bytearray, memoryview, mmap.mmap]] = None,
+                 mime_type: str = "image/jpeg",
+                 base64_data: Optional[str] = None):
+        """
+        Initialize the payload. At least one of data or base64_data is required.
+
+        Args:
+            data: Raw image bytes, or a buffer exposing them
+            mime_type: MIME type of the image
+            base64_data: The image as base64 text (without a data URI prefix)
+        """
+        if data is None and base64_data is None:
+            raise ValueError("ImagePayload needs raw data or base64 data")
+        self.mime_type = mime_type
+        self._data = data
+        self._bytes: Optional[bytes] = data if isinstance(data, bytes) else None
+        self._base64 = base64_data
+        self._data_url: Optional[str] = None
+        self._sha256: Optional[str] = None
+
+    @classmethod
+    def from_file(cls, path: str, mime_type: Optional[str] = None) -> "ImagePayload":
+        """
+        Create a payload backed by a read-only memory map of a stored file.
+
+        Args:
+            path: Path of the image file
+            mime_type: MIME type (guessed from the extension if omitted)
+
+        Returns:
+            ImagePayload whose bytes are paged in from the file on demand
+        """
+        mime_type = mime_type or mimetypes.guess_type(path)[0] or "image/jpeg"
+        with open(path, "rb") as f:
+            try:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # Empty files can't be mapped
+                data = f.read()
+        return cls(data=data, mime_type=mime_type)
+
+    @classmethod
+    def from_data_url(cls, data_url: str) -> "ImagePayload":
+        """
+        Create a payload from a data URL without decoding it yet.
+
+        Args:
+            data_url: String of the form data:<mime>;base64,<data>
+
+        Returns:
+            ImagePayload that decodes the base64 text only if raw bytes are requested
+        """
+        header, _, encoded = data_url.partition(",")
+        mime_type = header[len("data:"):].split(";")[0] or "image/jpeg"
+        payload = cls(mime_type=mime_type, base64_data=encoded)
+        payload._data_url = data_url
+        return payload
+
+    @property
+    def raw(self) -> memoryview:
+        """Zero-copy view of the raw image bytes."""
+        if self._data is None:
+            self._data = self.to_bytes()
+        return memoryview(self._data)
+
+    def to_bytes(self) -> bytes:
+        """Return the raw image as bytes (decoded or copied at most once)."""
+        if self._bytes is None:
+            if self._data is not None:
+                self._bytes = bytes(self._data)
+            else:
+                self._bytes = base64.b64decode(self._base64)
+        return self._bytes
+
+    def base64(self) -> str:
+        """Return the image as base64 text (encoded at most once)."""
+        if self._base64 is None:
+            self._base64 = base64.b64encode(self._data).decode("ascii")
+        return self._base64
+
+    def data_url(self) -> str:
+        """Return the image as a data URL (built at most once)."""
+        if self._data_url is None:
+            self._data_url = f"data:{self.mime_type};base64,{self.base64()}"
+        return self._data_url
+
+    def sha256(self) -> str:
+        """Return the SHA-256 hex digest of the raw image (computed at most once)."""
+        if self._sha256 is None:
+            self._sha256 = hashlib.sha256(self.raw).hexdigest()
+        return self._sha256
+
+    def __len__(self) -> int:
+        return len(self.raw)
+
+    def __repr__(self) -> str:
+        return f"ImagePayload(mime_type={self.mime_type!r}, size={len(self)})"
@@ -0,0 +1,231 @@
+import os
+import re
+import threading
+import logging
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Longest edge in pixels for each derived rendition. "full" is the original upload.
+RENDITION_SIZES = {
+    "thumb": 256,
+    "standard": 1024,
+}
+RENDITIONS = ("thumb", "standard", "full")
+
+# Follow-up questions that need the full-resolution image
+DEFAULT_ZOOM_PATTERN = (r"\b(zoom|closer|close-up|close up|detail|details|detailed|"
+                        r"fine print|small text|read (the|that|this)|enlarge|magnify)\b")
+
+def latest_user_text(messages: List[Dict[str, Any]]) -> str:
+    """Return the text of the most recent user message (text parts joined)."""
+    for msg in reversed(messages):
+        if msg.get("role") != "user":
+            continue
+        content = msg.get("content")
+        if isinstance(content, str):
+            return content
+        if isinstance(content, list):
+            return " ".join(item.get("text", "") for item in content
+                            if isinstance(item, dict) and item.get("type") == "text")
+    return ""
+
+def rendition_filename(filename: str, rendition: str) -> str:
+    """
+    Return the stored filename of a rendition of an uploaded image.
+
+    Args:
+        filename: Filename of the original upload (e.g. <sha256>.png)
+        rendition: One of 'thumb', 'standard' or 'full'
+
+    Returns:
+        Filename of the rendition (derived renditions are always JPEG)
+    """
+    if rendition == "full":
+        return filename
+    stem = os.path.splitext(filename)[0]
+    return f"{stem}.{rendition}.jpg"
+
+def rendition_filenames(filename: str) -> List[str]:
+    """Return the filenames of all renditions of an upload, including the original."""
+    return [rendition_filename(filename, rendition) for rendition in RENDITIONS]
+
+def generate_renditions(path: str, quality: int = 85) -> Dict[str, str]:
+    """
+    Create the downscaled renditions of an uploaded image next to the original.
+    Renditions that already exist are kept, so re-uploading the same content
+    does no work.
+
+    The original is decoded once, at reduced scale where the format allows it
+    (JPEG draft mode), and shrunk in place from the largest rendition to the
+    smallest, so a large photo never has more than one bitmap in memory.
+
+    Args:
+        path: Path of the original upload
+        quality: JPEG quality of the derived renditions
+
+    Returns:
+        Mapping of rendition name to path for every rendition that exists
+    """
+    directory, filename = os.path.split(path)
+    targets = {name: os.path.join(directory, rendition_filename(filename, name))
+               for name in RENDITION_SIZES}
+    renditions = {"full": path}
+    renditions.update({name: target for name, target in targets.items() if os.path.exists(target)})
+    missing = {name: target for name, target in targets.items() if name not in renditions}
+    if not missing:
+        return renditions
+
+    # Imported lazily: Pillow is only needed when an upload arrives
+    from PIL import Image, ImageOps
+
+    try:
+        with Image.open(path) as original:
+            largest = max(RENDITION_SIZES[name] for name in missing)
+            # JPEGs decode straight at 1/2, 1/4 or 1/8 scale, still at least this large
+            original.draft("RGB", (largest, largest))
+            image = ImageOps.exif_transpose(original)
+            if image.mode not in ("RGB", "L"):
+                image = image.convert("RGB")
+            for name in sorted(missing, key=lambda name: RENDITION_SIZES[name], reverse=True):
+                size = RENDITION_SIZES[name]
+                image.thumbnail((size, size), reducing_gap=2.0)
+                target = missing[name]
+                temp_target = f"{target}.part"
+                image.save(temp_target, format="JPEG", quality=quality, optimize=True)
+                os.replace(temp_target, target)
+                renditions[name] = target
+    except Exception as e:
+        logger.warning(f"[Renditions] Could not create renditions for {filename}: {str(e)}")
+    return renditions
+
+class RenditionWorker:
+    """
+    Generates renditions on a small background pool, off the upload request.
+
+    Until an image's renditions exist, callers fall back to the original.
+    Each upload is processed once even if it is scheduled again while its
+    renditions are still being generated.
+    """
+
+    def __init__(self, max_workers: int = 2):
+        """
+        Initialize the worker.
+
+        Args:
+            max_workers: Number of images processed at the same time
+        """
+        self._executor = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="renditions")
+        self._lock = threading.Lock()
+        self._in_flight: Dict[str, Future] = {}
+        self._stats = {"scheduled": 0, "generated": 0, "failed": 0}
+
+    def schedule(self, path: str, on_ready: Optional[Callable[[Dict[str, str]], Any]] = None) -> Future:
+        """
+        Generate the renditions of an upload in the background.
+
+        Args:
+            path: Path of the original upload
+            on_ready: Called on the worker thread with the rendition paths
+                (see generate_renditions) once they exist
+
+        Returns:
+            Future of the rendition paths
+        """
+        with self._lock:
+            future = self._in_flight.get(path)
+            if future is not None:
+                return future
+            self._stats["scheduled"] += 1
+            future = self._executor.submit(self._generate, path, on_ready)
+            self._in_flight[path] = future
+            return future
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"in_flight": len(self._in_flight), **self._stats}
+
+    def _generate(self, path: str, on_ready: Optional[Callable[[Dict[str, str]], Any]]) -> Dict[str, str]:
+        try:
+            renditions = generate_renditions(path)
+            with self._lock:
+                self._stats["generated" if len(renditions) > 1 else "failed"] += 1
+            if on_ready is not None:
+                on_ready(renditions)
+            return renditions
+        except Exception as e:
+            with self._lock:
+                self._stats["failed"] += 1
+            logger.warning(f"[Renditions] Background generation for {os.path.basename(path)} failed: {str(e)}")
+            return {"full": path}
+        finally:
+            with self._lock:
+                self._in_flight.pop(path, None)
+
+class RenditionPolicy:
+    """
+    Chooses which rendition of a session's image to inject and at what
+    provider detail level.
+
+    For stateless providers the choice is made per turn (select()): the
+    first look at an image, and follow-ups that explicitly ask for detail,
+    get the full image at high detail. Later turns get the standard rendition
+    at low detail, which costs a fraction of the vision tokens, and trivial
+    ones ("ok", "thanks") only the thumbnail at low detail.
+
+    Providers that keep the chat on their side only send new turns, so there
+    the choice is made once per image and kept (select_pinned()): a history
+    that changes from turn to turn would throw their chat away. The standard
+    rendition at high detail is about what providers downscale a large photo
+    to anyway; a first question that explicitly asks for detail gets the full
+    image instead. Later requests for detail are answered by sending the full
+    image as an extra turn (see wants_detail()).
+    """
+
+    def __init__(self, zoom_pattern: Optional[str] = None):
+        """
+        Initialize the policy.
+
+        Args:
+            zoom_pattern: Regex matched against the latest user message to detect
+                requests for more detail
+        """
+        self.zoom_regex = re.compile(zoom_pattern or DEFAULT_ZOOM_PATTERN, re.IGNORECASE)
+
+    def select(self, messages: List[Dict[str, Any]], first_look: bool, trivial: bool = False) -> Tuple[str, str]:
+        """
+        Pick a rendition and detail level for the current turn.
+
+        Args:
+            messages: Conversation in OpenAI format, before the image is injected
+            first_look: Whether the image is injected for the first time
+            trivial: Whether the latest user message is a trivial reply
+
+        Returns:
+            Tuple of (rendition name, provider detail level)
+        """
+        if first_look or self.wants_detail(messages):
+            return "full", "high"
+        if trivial:
+            return "thumb", "low"
+        return "standard", "low"
+
+    def select_pinned(self, messages: List[Dict[str, Any]]) -> Tuple[str, str]:
+        """
+        Pick the rendition and detail level kept for the rest of the session,
+        for an image being injected for the first time.
+
+        Args:
+            messages: Conversation in OpenAI format, before the image is injected
+
+        Returns:
+            Tuple of (rendition name, provider detail level)
+        """
+        if self.wants_detail(messages):
+            return "full", "high"
+        return "standard", "high"
+
+    def wants_detail(self, messages: List[Dict[str, Any]]) -> bool:
+        """Return whether the latest user message asks for a closer look at the image."""
+        return bool(self.zoom_regex.search(latest_user_text(messages)))
@@ -0,0 +1,65 @@
+import os
+import threading
+import contextvars
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Message content parts that carry an image
+IMAGE_PART_TYPES = ("image_url", "image_data")
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+def _pool() -> ThreadPoolExecutor:
+    """Return the shared resolution pool (IMAGE_RESOLVE_WORKERS threads, default 8)."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            workers = int(os.environ.get("IMAGE_RESOLVE_WORKERS") or 8)
+            _executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="image-resolve")
+        return _executor
+
+def resolve_image_parts(messages: List[Dict[str, Any]],
+                        resolve: Callable[[Dict[str, Any]], Any]) -> Dict[Tuple[int, int], Any]:
+    """
+    Resolve every image part of a conversation concurrently.
+
+    All image parts of all messages are submitted to a bounded shared pool at
+    once, so a turn with several URL images waits for the slowest download
+    rather than the sum of them. A lone image is resolved on the calling
+    thread.
+
+    Args:
+        messages: Messages in OpenAI format
+        resolve: Converts one image content part (e.g. {"type": "image_url", ...})
+            into the provider's format
+
+    Returns:
+        Dict of (message index, part index) to the resolved image, or to the
+        exception raised while resolving it, so the caller can skip that
+        image and keep the others
+    """
+    jobs = [
+        ((i, j), item)
+        for i, msg in enumerate(messages) if isinstance(msg.get("content"), list)
+        for j, item in enumerate(msg["content"])
+        if isinstance(item, dict) and item.get("type") in IMAGE_PART_TYPES
+    ]
+    if len(jobs) == 1:
+        position, item = jobs[0]
+        return {position: _resolve_one(resolve, item)}
+
+    # Workers run in the caller's context, so they see its turn deadline
+    futures = [(position, _pool().submit(contextvars.copy_context().run, _resolve_one, resolve, item))
+               for position, item in jobs]
+    return {position: future.result() for position, future in futures}
+
+def _resolve_one(resolve: Callable[[Dict[str, Any]], Any], item: Dict[str, Any]) -> Any:
+    try:
+        return resolve(item)
+    except Exception as e:
+        logger.error(f"[Image resolver] Could not resolve {item.get('type')} part: {str(e)}")
+        return e
@@ -0,0 +1,207 @@
+import os
+import re
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import BinaryIO, Optional, Tuple
+
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
+# Extensions are kept short and alphanumeric; anything else is stored as .jpg
+_EXTENSION_PATTERN = re.compile(r'^\.[a-z0-9]{1,8}$')
+
+# Stored names are <sha256><ext> (or <sha256>.<rendition>.jpg for derived
+# renditions), so the name itself identifies the content
+_CONTENT_ADDRESSED_PATTERN = re.compile(r'^([0-9a-f]{64})(?:\.(?:thumb|standard))?\.[a-z0-9]{1,8}$')
+
+class UploadTooLarge(ValueError):
+    """Raised when an upload exceeds the configured size limit."""
+
+@dataclass(frozen=True)
+class StoredImage:
+    """An image that has been written to the upload store."""
+    filename: str
+    path: str
+    sha256: str
+    size: int
+
+def normalize_extension(filename: str, default: str = ".jpg") -> str:
+    """
+    Return a safe, lowercase file extension for an uploaded filename.
+
+    Args:
+        filename: Original client-side filename
+        default: Extension to use when the original one is missing or unsafe
+
+    Returns:
+        Extension including the leading dot
+    """
+    extension = os.path.splitext(filename or "")[1].lower()
+    return extension if _EXTENSION_PATTERN.match(extension) else default
+
+def ingest_upload(stream: BinaryIO,
+                  dest_dir: str,
+                  extension: str = ".jpg",
+                  max_bytes: int = 20 * 1024 * 1024,
+                  chunk_size: int = DEFAULT_CHUNK_SIZE) -> StoredImage:
+    """
+    Stream an upload into the store with memory bounded by the chunk size.
+
+    The data is copied to a temporary file in dest_dir in fixed-size chunks while
+    the SHA-256 and size limit are checked incrementally. The finished file is
+    then atomically renamed to its content-addressed name (<sha256><extension>),
+    so readers never see a partially written image and identical uploads share
+    one file.
+
+    Args:
+        stream: Readable binary stream (e.g. a Werkzeug FileStorage stream)
+        dest_dir: Directory of the upload store
+        extension: Extension for the stored file, including the leading dot
+        max_bytes: Maximum accepted size in bytes
+        chunk_size: Number of bytes read per chunk
+
+    Returns:
+        StoredImage describing the stored file
+
+    Raises:
+        UploadTooLarge: If the upload exceeds max_bytes
+    """
+    hasher = hashlib.sha256()
+    size = 0
+    fd, temp_path = tempfile.mkstemp(dir=dest_dir, prefix=".upload-", suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as temp_file:
+            while True:
+                chunk = stream.read(chunk_size)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadTooLarge(f"Upload exceeds the maximum size of {max_bytes} bytes")
+                hasher.update(chunk)
+                temp_file.write(chunk)
+
+        # mkstemp creates the file owner-only; stored images are served to others
+        os.chmod(temp_path, 0o644)
+        digest = hasher.hexdigest()
+        filename = f"{digest}{extension}"
+        path = os.path.join(dest_dir, filename)
+        # os.replace is atomic on POSIX; an existing file has identical content
+        os.replace(temp_path, path)
+        return StoredImage(filename=filename, path=path, sha256=digest, size=size)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+def content_hash_from_name(filename: str) -> Optional[str]:
+    """
+    Return the SHA-256 embedded in a content-addressed filename.
+
+    Args:
+        filename: Name of a file in the upload store
+
+    Returns:
+        The hex digest, or None for legacy (non content-addressed) names
+    """
+    match = _CONTENT_ADDRESSED_PATTERN.match(filename)
+    return match.group(1) if match else None
+
+# Digests of legacy files, keyed by path and invalidated by (mtime, size)
+_digest_cache: "OrderedDict[str, Tuple[int, int, str]]" = OrderedDict()
+_digest_cache_lock = threading.Lock()
+_DIGEST_CACHE_SIZE = 1024
+
+def file_sha256(path: str, chunk_size: int = DEFAULT_CHUNK_SIZE) -> str:
+    """
+    Return the SHA-256 of a file, memoized until the file changes.
+
+    Args:
+        path: Path of the file
+        chunk_size: Number of bytes read per chunk when hashing
+
+    Returns:
+        Hex digest of the file content
+    """
+    stat = os.stat(path)
+    with _digest_cache_lock:
+        cached = _digest_cache.get(path)
+        if cached and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+            _digest_cache.move_to_end(path)
+            return cached[2]
+
+    hasher = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            hasher.update(chunk)
+    digest = hasher.hexdigest()
+
+    with _digest_cache_lock:
+        _digest_cache[path] = (stat.st_mtime_ns, stat.st_size, digest)
+        _digest_cache.move_to_end(path)
+        while len(_digest_cache) > _DIGEST_CACHE_SIZE:
+            _digest_cache.popitem(last=False)
+    return digest
+
+class HotImageCache:
+    """
+    Small in-memory LRU of recently uploaded images.
+    Provider fetchers request the same image on every turn of a conversation,
+    so the most recent uploads are served from memory instead of disk.
+    """
+
+    def __init__(self, max_bytes: int = 16 * 1024 * 1024, max_item_bytes: int = 2 * 1024 * 1024):
+        """
+        Initialize the cache.
+
+        Args:
+            max_bytes: Total size budget of the cache
+            max_item_bytes: Images larger than this are never cached
+        """
+        self.max_bytes = max_bytes
+        self.max_item_bytes = max_item_bytes
+        self._items: "OrderedDict[str, bytes]" = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, filename: str) -> Optional[bytes]:
+        """Return the cached bytes for a filename, or None."""
+        with self._lock:
+            data = self._items.get(filename)
+            if data is not None:
+                self._items.move_to_end(filename)
+            return data
+
+    def put(self, filename: str, data: bytes) -> None:
+        """Cache an image, evicting the least recently used ones to stay in budget."""
+        if len(data) > self.max_item_bytes or len(data) > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._items.pop(filename, None)
+            if previous is not None:
+                self._size -= len(previous)
+            self._items[filename] = data
+            self._size += len(data)
+            while self._size > self.max_bytes:
+                _, evicted = self._items.popitem(last=False)
+                self._size -= len(evicted)
+
+    def put_file(self, filename: str, path: str) -> None:
+        """Cache a stored file if it is small enough."""
+        if os.path.getsize(path) <= self.max_item_bytes:
+            with open(path, "rb") as f:
+                self.put(filename, f.read())
+
+    def stats(self) -> dict:
+        """Return the number of cached images and their total size."""
+        with self._lock:
+            return {"items": len(self._items), "bytes": self._size, "max_bytes": self.max_bytes}
+
+    def discard(self, filename: str) -> None:
+        """Remove an image from the cache (e.g. when the file is deleted)."""
+        with self._lock:
+            data = self._items.pop(filename, None)
+            if data is not None:
+                self._size -= len(data)
@@ -0,0 +1,194 @@
+import os
+import time
+import fnmatch
+import threading
+import logging
+from typing import Callable, Dict, Any, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+class StorageJanitor:
+    """
+    Background cleaner for uploaded images and generated audio.
+
+    Each pass runs on its own daemon thread, never on a request thread:
+    1. Expires idle sessions (via the expire_sessions callback).
+    2. Deletes uploaded images that no live session references.
+    3. Enforces a total disk quota across all managed files by evicting the
+       least recently used unreferenced files first.
+    Files younger than the grace period are never deleted, so an upload that
+    hasn't been linked to its session yet is safe.
+    """
+
+    def __init__(self,
+                 upload_dir: str,
+                 audio_dir: str,
+                 live_files: Callable[[], Set[str]],
+                 expire_sessions: Callable[[], int],
+                 quota_bytes: int = 1024 * 1024 * 1024,
+                 interval: float = 300.0,
+                 grace_seconds: float = 300.0,
+                 audio_pattern: str = "speech_*.mp3",
+                 on_delete: Optional[Callable[[str], Any]] = None):
+        """
+        Initialize the janitor.
+
+        Args:
+            upload_dir: Directory holding uploaded images
+            audio_dir: Directory holding generated audio files
+            live_files: Returns the upload filenames referenced by live sessions
+            expire_sessions: Drops idle sessions and returns how many were expired
+            quota_bytes: Maximum total size of uploads and audio
+            interval: Seconds between cleanup passes
+            grace_seconds: Minimum age before a file may be deleted
+            audio_pattern: Glob pattern selecting generated audio files
+            on_delete: Called with the path of each deleted file
+        """
+        self.upload_dir = upload_dir
+        self.audio_dir = audio_dir
+        self.live_files = live_files
+        self.expire_sessions = expire_sessions
+        self.quota_bytes = quota_bytes
+        self.interval = interval
+        self.grace_seconds = grace_seconds
+        self.audio_pattern = audio_pattern
+        self.on_delete = on_delete
+
+        self._last_access: Dict[str, float] = {}
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._stats_lock = threading.Lock()
+        self._stats: Dict[str, Any] = {
+            "passes": 0,
+            "sessions_expired": 0,
+            "files_deleted": 0,
+            "bytes_reclaimed": 0,
+            "last_pass": None,
+        }
+
+    def start(self) -> None:
+        """Start the background cleanup thread."""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name="storage-janitor", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop the background cleanup thread."""
+        self._stopped.set()
+
+    def record_access(self, path: str) -> None:
+        """
+        Note that a managed file was just served, for LRU eviction.
+        This is a single dict assignment, cheap enough for the request path.
+        """
+        self._last_access[path] = time.time()
+
+    def stats(self) -> Dict[str, Any]:
+        """Return cumulative counters and the report of the last pass."""
+        with self._stats_lock:
+            return dict(self._stats)
+
+    def run_once(self) -> Dict[str, Any]:
+        """
+        Run a single cleanup pass.
+
+        Returns:
+            Report with the number of expired sessions, deleted files and reclaimed bytes
+        """
+        started = time.time()
+        sessions_expired = self.expire_sessions()
+        live = self.live_files()
+
+        files = self._scan()
+        now = time.time()
+        deleted: List[Tuple[str, int]] = []
+        kept: List[Tuple[str, int, float, bool]] = []  # (path, size, last access, evictable)
+
+        for path, size, mtime, is_upload in files:
+            name = os.path.basename(path)
+            old_enough = now - mtime >= self.grace_seconds
+            referenced = is_upload and name in live
+            if is_upload and not referenced and old_enough:
+                # Unreferenced uploads (including abandoned .part files) go right away
+                if self._delete(path):
+                    deleted.append((path, size))
+                continue
+            last_access = max(mtime, self._last_access.get(path, 0.0))
+            kept.append((path, size, last_access, old_enough and not referenced))
+
+        # Enforce the quota, least recently used evictable files first
+        total_bytes = sum(size for _, size, _, _ in kept)
+        if total_bytes > self.quota_bytes:
+            for path, size, _, evictable in sorted(kept, key=lambda item: item[2]):
+                if total_bytes <= self.quota_bytes:
+                    break
+                if evictable and self._delete(path):
+                    deleted.append((path, size))
+                    total_bytes -= size
+            if total_bytes > self.quota_bytes:
+                logger.warning(f"[Janitor] Still over quota ({total_bytes} > {self.quota_bytes} bytes); "
+                               f"remaining files are referenced or within the grace period")
+
+        reclaimed = sum(size for _, size in deleted)
+        report = {
+            "sessions_expired": sessions_expired,
+            "files_deleted": len(deleted),
+            "bytes_reclaimed": reclaimed,
+            "bytes_in_use": total_bytes,
+            "quota_bytes": self.quota_bytes,
+            "duration_ms": int((time.time() - started) * 1000),
+        }
+        with self._stats_lock:
+            self._stats["passes"] += 1
+            self._stats["sessions_expired"] += sessions_expired
+            self._stats["files_deleted"] += len(deleted)
+            self._stats["bytes_reclaimed"] += reclaimed
+            self._stats["last_pass"] = report
+
+        if deleted or sessions_expired:
+            logger.info(f"[Janitor] Expired {sessions_expired} sessions, deleted {len(deleted)} files, "
+                        f"reclaimed {reclaimed} bytes ({total_bytes} bytes in use)")
+        return report
+
+    def _scan(self) -> List[Tuple[str, int, float, bool]]:
+        """List managed files as (path, size, mtime, is_upload) tuples."""
+        files = []
+        for directory, is_upload in ((self.upload_dir, True), (self.audio_dir, False)):
+            try:
+                entries = list(os.scandir(directory))
+            except FileNotFoundError:
+                continue
+            for entry in entries:
+                if not entry.is_file(follow_symlinks=False):
+                    continue
+                if not is_upload and not fnmatch.fnmatch(entry.name, self.audio_pattern):
+                    continue
+                try:
+                    stat = entry.stat(follow_symlinks=False)
+                except FileNotFoundError:
+                    continue
+                files.append((entry.path, stat.st_size, stat.st_mtime, is_upload))
+        return files
+
+    def _delete(self, path: str) -> bool:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            return False
+        except OSError as e:
+            logger.error(f"[Janitor] Could not delete {path}: {str(e)}")
+            return False
+        self._last_access.pop(path, None)
+        if self.on_delete:
+            self.on_delete(path)
+        return True
+
+    def _run(self) -> None:
+        while not self._stopped.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.error(f"[Janitor] Cleanup pass failed: {str(e)}")
+            self._stopped.wait(self.interval)
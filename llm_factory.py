@@ -1,25 +1,159 @@
-from typing import Optional
+import time
+import importlib
+import threading
+from importlib.metadata import entry_points
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
 from llm_service import LLMService
-from openai_service import OpenAIService
-from gemini_service import GeminiService
+
+# Entry-point group through which installed packages can add providers, e.g.
+#   [project.entry-points.llm_providers]
+#   mistral = "mistral_service:MistralService"
+ENTRY_POINT_GROUP = "llm_providers"
+
+# Built-in providers as "module:ClassName". A provider's module (and with it
+# its SDK) is only imported the first time that provider is used, so a server
+# configured for one provider never loads the others.
+_providers: Dict[str, Union[str, Callable[..., LLMService]]] = {
+    "openai": "openai_service:OpenAIService",
+    "gemini": "gemini_service:GeminiService",
+    "anthropic": "anthropic_service:AnthropicService",
+    "replay": "replay_service:ReplayService",
+}
+# Model name prefixes each built-in provider serves; providers without an
+# entry (replay, extensions registered without prefixes) accept any model
+_model_prefixes: Dict[str, Tuple[str, ...]] = {
+    "openai": ("gpt-", "chatgpt-", "o1", "o3", "o4"),
+    "gemini": ("gemini-",),
+    "anthropic": ("claude-",),
+}
+_loaded: Dict[str, Callable[..., LLMService]] = {}
+_import_ms: Dict[str, float] = {}
+_entry_points_loaded = False
+_registry_lock = threading.RLock()
+
+def register_provider(name: str, target: Union[str, Callable[..., LLMService]],
+                      model_prefixes: Optional[Tuple[str, ...]] = None) -> None:
+    """
+    Register (or replace) an LLM provider.
+
+    Args:
+        name: Provider name, as used in LLM_PROVIDER
+        target: Either a "module:ClassName" string, imported on first use, or
+            a callable taking api_key and returning an LLMService
+        model_prefixes: Prefixes of the model names the provider serves
+            (None accepts any model)
+    """
+    with _registry_lock:
+        _providers[name.lower()] = target
+        _loaded.pop(name.lower(), None)
+        if model_prefixes:
+            _model_prefixes[name.lower()] = tuple(model_prefixes)
+        else:
+            _model_prefixes.pop(name.lower(), None)
+
+def provider_serves_model(provider: str, model: str) -> bool:
+    """Return whether a model name belongs to a provider (always true for providers without known prefixes)."""
+    with _registry_lock:
+        prefixes = _model_prefixes.get(provider.lower())
+    return prefixes is None or model.lower().startswith(prefixes)
+
+def provider_names() -> List[str]:
+    """Return the names of all registered providers, including entry-point ones."""
+    with _registry_lock:
+        _load_entry_points()
+        return sorted(_providers)
+
+def _load_entry_points() -> None:
+    """Register the providers advertised by installed packages (once, without importing them)."""
+    global _entry_points_loaded
+    if _entry_points_loaded:
+        return
+    _entry_points_loaded = True
+    for entry_point in entry_points(group=ENTRY_POINT_GROUP):
+        # Built-in providers are not overridden by accident
+        _providers.setdefault(entry_point.name.lower(), entry_point.value)
+
+def _provider_class(provider: str) -> Callable[..., LLMService]:
+    """Import a provider's implementation on first use and time the import."""
+    name = provider.lower()
+    with _registry_lock:
+        factory = _loaded.get(name)
+        if factory is not None:
+            return factory
+        _load_entry_points()
+        target = _providers.get(name)
+        if target is None:
+            raise ValueError(f"Unsupported LLM provider: {provider}. Supported providers are: {', '.join(sorted(_providers))}")
+        if isinstance(target, str):
+            module_name, _, attribute = target.partition(":")
+            start = time.perf_counter()
+            factory = getattr(importlib.import_module(module_name), attribute)
+            _import_ms[name] = round((time.perf_counter() - start) * 1000, 1)
+        else:
+            factory = target
+        _loaded[name] = factory
+        return factory
 
 def create_llm_service(provider: str = "openai", api_key: Optional[str] = None) -> LLMService:
     """
     Factory function to create an LLM service based on the specified provider.
     
     Args:
-        provider: The LLM provider to use ('openai' or 'gemini')
+        provider: The LLM provider to use ('openai', 'gemini', 'anthropic', 'replay'
+            or a registered extension)
         api_key: Optional API key for the provider
-        
+    
     Returns:
         An instance of the appropriate LLMService implementation
-        
+    
+    Raises:
+        ValueError: If the provider is not supported
+    """
+    return _provider_class(provider)(api_key=api_key)
+
+def provider_import_stats() -> Dict[str, Any]:
+    """Return which providers are registered and how long each loaded one took to import."""
+    with _registry_lock:
+        return {
+            "registered": sorted(_providers),
+            "loaded": sorted(_loaded),
+            "import_ms": dict(_import_ms),
+        }
+
+# Pooled service instances, keyed by (provider, api_key). Provider clients hold
+# HTTP connection pools, so reusing them avoids a new handshake on every request.
+_service_cache: Dict[Tuple[str, Optional[str]], LLMService] = {}
+_service_cache_lock = threading.Lock()
+
+def get_llm_service(provider: str = "openai", api_key: Optional[str] = None) -> LLMService:
+    """
+    Return a pooled LLM service for the provider, creating it on first use.
+    
+    Args:
+        provider: The LLM provider to use
+        api_key: Optional API key for the provider
+    
+    Returns:
+        A shared instance of the appropriate LLMService implementation
+    
     Raises:
         ValueError: If the provider is not supported
     """
-    if provider.lower() == "openai":
-        return OpenAIService(api_key=api_key)
-    elif provider.lower() == "gemini":
-        return GeminiService(api_key=api_key)
-    else:
-        raise ValueError(f"Unsupported LLM provider: {provider}. Supported providers are: openai, gemini")
+    key = (provider.lower(), api_key)
+    with _service_cache_lock:
+        service = _service_cache.get(key)
+        if service is None:
+            service = create_llm_service(provider=provider, api_key=api_key)
+            _service_cache[key] = service
+        return service
+
+def pooled_service_stats() -> Dict[str, Any]:
+    """Return the stats of every pooled service that reports any, keyed by provider."""
+    with _service_cache_lock:
+        services = list(_service_cache.items())
+    return {provider: service.stats() for (provider, _), service in services if hasattr(service, "stats")}
+
+def clear_llm_service_cache() -> None:
+    """Drop all pooled LLM services (e.g. after a configuration reload)."""
+    with _service_cache_lock:
+        _service_cache.clear()
@@ -1,19 +1,26 @@
 from abc import ABC, abstractmethod
 from typing import Dict, List, Optional, Union, Any
 
+from image_payload import ImagePayload
+
 class LLMService(ABC):
     """
     Abstract base class for LLM service providers.
     Implementations should handle different LLM APIs with a consistent interface.
     """
     
+    # Whether the provider keeps each session's chat on its side (see session_id
+    # below), so that a history which stays the same from turn to turn is cheap
+    keeps_chat_sessions = False
+    
     @abstractmethod
     def chat_completion(self, 
                         messages: List[Dict[str, Any]], 
                         model: Optional[str] = None,
                         temperature: Optional[float] = None,
                         max_tokens: Optional[int] = None,
-                        stream: bool = False) -> Union[Dict[str, Any], Any]:
+                        stream: bool = False,
+                        session_id: Optional[str] = None) -> Union[Dict[str, Any], Any]:
         """
         Generate a chat completion response.
         
@@ -23,6 +30,8 @@ class LLMService(ABC):
             temperature: Optional temperature parameter for response randomness
             max_tokens: Optional maximum number of tokens to generate
             stream: Whether to stream the response
+            session_id: Optional conversation identifier; providers with
+                server-side chat state may use it to send only the new turn
             
         Returns:
             Either a completion response object or a stream
@@ -30,14 +39,25 @@ class LLMService(ABC):
         pass
     
     @abstractmethod
-    def process_image(self, image_data: Union[str, bytes]) -> str:
+    def process_image(self, image_data: Union[str, bytes, ImagePayload]) -> str:
         """
         Process an image and prepare it for inclusion in a message.
         
         Args:
-            image_data: Either a URL string or raw image bytes
+            image_data: A URL string, raw image bytes, or an ImagePayload
             
         Returns:
             Processed image data in the format expected by the LLM
         """
         pass
+    
+    def warmup(self) -> None:
+        """
+        Open the connection to the provider ahead of the first request.
+        Called at startup and periodically so pooled connections stay alive;
+        the default does nothing.
+        
+        Raises:
+            Exception: If the provider can't be reached
+        """
+        pass
@@ -0,0 +1,212 @@
+import re
+import time
+import threading
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Deque, Dict, List, Optional, Sequence
+
+from admission import latency_percentiles
+from image_renditions import latest_user_text
+from image_resolver import IMAGE_PART_TYPES
+
+# Turns that carry no real question: acknowledgements and "go on" prompts
+DEFAULT_FAST_PATTERN = (r"(yes|yeah|yep|no|nope|ok|okay|sure|right|cool|great|nice|got it|i see|"
+                        r"thanks|thank you|thanks a lot|tell me more|go on|continue|keep going|"
+                        r"and then|what else|hmm+|uh-?huh)[\s.!?,]*")
+
+# Latest user messages that refer back to the shared image (and so need the vision model)
+DEFAULT_IMAGE_PATTERN = (r"\b(image|picture|pic|photo|photograph|screenshot|drawing|diagram|chart|"
+                         r"see|seen|look|looks|looking|shown|showing|visible|color|colour|colors|colours|"
+                         r"zoom|closer|close-up|detail|details|background|foreground|corner|written)\b")
+
+@dataclass(frozen=True)
+class RouteDecision:
+    """The model chosen for a turn, the route that chose it and why, with the inputs it saw."""
+    route: str
+    model: str
+    reason: str
+    chars: int = 0
+    has_image: bool = False
+    needs_image: bool = False
+
+class RoutingPolicy:
+    """
+    Chooses the model of each chat turn.
+
+    Configured rules are tried first, in order; a rule applies when all of
+    its conditions hold (pattern: regex searched in the latest user message,
+    images: whether the turn needs the image, max_chars: maximum length of
+    the latest user message). Then:
+    - turns that need the image go to the vision model,
+    - trivial turns (matching the fast pattern, or no longer than
+      fast_max_chars) go to the fast model,
+    - everything else goes to the requested model.
+    Routes whose model is not configured fall through to the requested model,
+    so with nothing configured every turn keeps the requested model.
+
+    An image stays in the conversation once shared, so its presence alone
+    doesn't make a turn a vision turn: the turn needs the image when the
+    latest user message carries one or refers to it (image pattern), or when
+    the caller says so (e.g. the first turn after an upload).
+    """
+
+    def __init__(self,
+                 fast_model: Optional[str] = None,
+                 vision_model: Optional[str] = None,
+                 fast_pattern: Optional[str] = None,
+                 fast_max_chars: int = 0,
+                 image_pattern: Optional[str] = None,
+                 rules: Sequence[Dict[str, Any]] = ()):
+        """
+        Initialize the policy.
+
+        Args:
+            fast_model: Model for trivial turns (None disables the fast route)
+            vision_model: Model for turns with an image (None keeps the requested model)
+            fast_pattern: Regex that must match the whole latest user message
+                for the turn to count as trivial (case-insensitive)
+            fast_max_chars: Latest user messages up to this length count as
+                trivial too (0 disables the length check)
+            image_pattern: Regex searched in the latest user message to detect
+                a turn about the image (case-insensitive)
+            rules: Rules as dicts with "model" and optional "name", "pattern",
+                "images" and "max_chars"
+        """
+        self.fast_model = fast_model
+        self.vision_model = vision_model
+        self.fast_regex = re.compile(fast_pattern or DEFAULT_FAST_PATTERN, re.IGNORECASE)
+        self.fast_max_chars = fast_max_chars
+        self.image_regex = re.compile(image_pattern or DEFAULT_IMAGE_PATTERN, re.IGNORECASE)
+        self.rules = [
+            dict(rule, regex=re.compile(rule["pattern"], re.IGNORECASE) if rule.get("pattern") else None)
+            for rule in rules
+        ]
+
+    def route(self, messages: List[Dict[str, Any]], requested_model: str,
+              image_needed: bool = False) -> RouteDecision:
+        """
+        Pick the model for a turn.
+
+        Args:
+            messages: Conversation in OpenAI format, after image injection
+            requested_model: Model the client asked for (or the default model)
+            image_needed: Whether the caller knows the turn needs the image
+                (e.g. the first turn after an upload)
+
+        Returns:
+            The routing decision
+        """
+        text = latest_user_text(messages).strip()
+        has_image = has_image_parts(messages)
+        # "I see" or "ok" is no question about the image, whatever words it shares with one
+        refers_to_image = bool(self.image_regex.search(text)) and not self.fast_regex.fullmatch(text)
+        needs_image = has_image and (image_needed or latest_user_has_image(messages) or refers_to_image)
+
+        for index, rule in enumerate(self.rules):
+            if rule["regex"] is not None and not rule["regex"].search(text):
+                continue
+            if rule.get("images") is not None and rule["images"] != needs_image:
+                continue
+            if rule.get("max_chars") is not None and len(text) > rule["max_chars"]:
+                continue
+            name = rule.get("name") or f"rule{index}"
+            return RouteDecision(f"rule:{name}", rule["model"], f"matched rule {name}",
+                                 len(text), has_image, needs_image)
+
+        if needs_image:
+            return RouteDecision("vision", self.vision_model or requested_model, "turn is about the image",
+                                 len(text), has_image, needs_image)
+        if self.fast_model:
+            if self.fast_regex.fullmatch(text):
+                return RouteDecision("fast", self.fast_model, "trivial reply", len(text), has_image, needs_image)
+            if 0 < len(text) <= self.fast_max_chars:
+                return RouteDecision("fast", self.fast_model, f"short message ({len(text)} chars)",
+                                     len(text), has_image, needs_image)
+        return RouteDecision("default", requested_model, "no rule matched", len(text), has_image, needs_image)
+
+    def is_trivial(self, messages: List[Dict[str, Any]]) -> bool:
+        """Return whether the latest user message is a trivial turn (fast pattern or fast_max_chars)."""
+        text = latest_user_text(messages).strip()
+        return bool(self.fast_regex.fullmatch(text)) or 0 < len(text) <= self.fast_max_chars
+
+def has_image_parts(messages: List[Dict[str, Any]]) -> bool:
+    """Return whether any message carries an image part."""
+    return any(
+        isinstance(item, dict) and item.get("type") in IMAGE_PART_TYPES
+        for msg in messages if isinstance(msg.get("content"), list)
+        for item in msg["content"]
+    )
+
+def latest_user_has_image(messages: List[Dict[str, Any]]) -> bool:
+    """Return whether the latest user message itself carries an image part."""
+    for msg in reversed(messages):
+        if msg.get("role") == "user":
+            return isinstance(msg.get("content"), list) and any(
+                isinstance(item, dict) and item.get("type") in IMAGE_PART_TYPES for item in msg["content"]
+            )
+    return False
+
+class RouteStats:
+    """
+    Per-route counts and latencies, plus the most recent decisions, for tuning
+    the routing policy.
+    """
+
+    def __init__(self, window: int = 500, recent: int = 50):
+        self._lock = threading.Lock()
+        self._window = window
+        self._routes: Dict[str, Dict[str, Any]] = {}
+        self._recent: Deque[Dict[str, Any]] = deque(maxlen=recent)
+
+    def record(self, decision: RouteDecision, ttft_seconds: Optional[float],
+               latency_seconds: Optional[float]) -> None:
+        """
+        Record a routed turn once it is done.
+
+        Args:
+            decision: The routing decision
+            ttft_seconds: Time to the model's first token (None if unknown)
+            latency_seconds: Time to the end of the response (None if it failed)
+        """
+        with self._lock:
+            route = self._routes.setdefault(decision.route, {
+                "turns": 0,
+                "failed": 0,
+                "models": {},
+                "ttft": deque(maxlen=self._window),
+                "latency": deque(maxlen=self._window),
+            })
+            route["turns"] += 1
+            route["models"][decision.model] = route["models"].get(decision.model, 0) + 1
+            if ttft_seconds is not None:
+                route["ttft"].append(ttft_seconds)
+            if latency_seconds is not None:
+                route["latency"].append(latency_seconds)
+            else:
+                route["failed"] += 1
+            self._recent.append({
+                "at": time.time(),
+                "route": decision.route,
+                "model": decision.model,
+                "reason": decision.reason,
+                "chars": decision.chars,
+                "has_image": decision.has_image,
+                "needs_image": decision.needs_image,
+                "ttft_ms": round(ttft_seconds * 1000, 1) if ttft_seconds is not None else None,
+                "latency_ms": round(latency_seconds * 1000, 1) if latency_seconds is not None else None,
+            })
+
+    def stats(self) -> Dict[str, Any]:
+        """Return per-route turn counts, models and latency percentiles, and recent decisions."""
+        with self._lock:
+            routes = {
+                name: {
+                    "turns": route["turns"],
+                    "failed": route["failed"],
+                    "models": dict(route["models"]),
+                    "ttft_ms": latency_percentiles(list(route["ttft"])),
+                    "latency_ms": latency_percentiles(list(route["latency"])),
+                }
+                for name, route in self._routes.items()
+            }
+            return {"routes": routes, "recent": list(self._recent)}
@@ -1,12 +1,12 @@
 import os
 import base64
 from typing import Dict, List, Optional, Union, Any
-from openai import OpenAI, APIError
-import requests
-from io import BytesIO
-from PIL import Image
+from openai import OpenAI, APIError, APIStatusError
 
 from llm_service import LLMService
+from image_payload import ImagePayload
+from profiling import stage
+from deadline import call_timeout
 
 class OpenAIService(LLMService):
     """
@@ -14,22 +14,25 @@ class OpenAIService(LLMService):
     Handles communication with OpenAI's API for chat completions and image processing.
     """
     
-    def __init__(self, api_key: Optional[str] = None):
+    def __init__(self, api_key: Optional[str] = None, base_url: Optional[str] = None):
         """
         Initialize the OpenAI service with an API key.
         
         Args:
             api_key: OpenAI API key (will use environment variable if not provided)
+            base_url: API base URL (will use OPENAI_BASE_URL if set, e.g. for a local stand-in)
         """
         self.api_key = api_key or os.environ.get("OPENAI_API_KEY")
-        self.client = OpenAI(api_key=self.api_key)
+        self.base_url = base_url or os.environ.get("OPENAI_BASE_URL") or None
+        self.client = OpenAI(api_key=self.api_key, base_url=self.base_url)
     
     def chat_completion(self, 
                        messages: List[Dict[str, Any]], 
                        model: Optional[str] = None,
                        temperature: Optional[float] = 0.7,
                        max_tokens: Optional[int] = None,
-                       stream: bool = False) -> Union[Dict[str, Any], Any]:
+                       stream: bool = False,
+                       session_id: Optional[str] = None) -> Union[Dict[str, Any], Any]:
         """
         Generate a chat completion using OpenAI's API.
         
@@ -39,6 +42,7 @@ class OpenAIService(LLMService):
             temperature: Temperature parameter (default: 0.7)
             max_tokens: Maximum number of tokens to generate
             stream: Whether to stream the response
+            session_id: Unused; the OpenAI API is stateless
             
         Returns:
             Either a completion response object or a stream
@@ -47,9 +51,11 @@ class OpenAIService(LLMService):
             # Ensure we always have a model parameter
             model_name = model if model is not None else "gpt-4o"
             # Prepare parameters for the API call
+            with stage("openai.prepare_messages"):
+                prepared = self._prepare_messages(messages)
             params = {
                 "model": model_name,
-                "messages": messages,
+                "messages": prepared,
                 "temperature": temperature,
                 "stream": stream
             }
@@ -57,24 +63,49 @@ class OpenAIService(LLMService):
             # Add max_tokens if provided
             if max_tokens is not None:
                 params["max_tokens"] = max_tokens
+            
+            # Ask for a final usage chunk so streamed requests are accounted too
+            if stream:
+                params["stream_options"] = {"include_usage": True}
+            
+            # Within a voice turn, the request may only use what is left of its deadline;
+            # the SDK's retries would each get the full timeout again, so there are none
+            client = self.client
+            timeout = call_timeout(step="openai.request")
+            if timeout is not None:
+                client = client.with_options(timeout=timeout, max_retries=0)
                 
-            response = self.client.chat.completions.create(**params)
+            # For streams this ends when the response headers arrive
+            with stage("openai.request"):
+                response = client.chat.completions.create(**params)
             return response
         except APIError as e:
             # Log the error and re-raise
             print(f"OpenAI API Error: {str(e)}")
             raise
     
-    def process_image(self, image_data: Union[str, bytes]) -> str:
+    def warmup(self) -> None:
+        """Open a pooled connection to the API with a cheap model listing."""
+        try:
+            self.client.with_options(timeout=10.0, max_retries=0).models.list()
+        except APIStatusError:
+            # Any HTTP answer means the connection is up
+            pass
+    
+    def process_image(self, image_data: Union[str, bytes, ImagePayload]) -> str:
         """
         Process an image for inclusion in an OpenAI message.
         
         Args:
-            image_data: Either a URL string or raw image bytes
+            image_data: A URL string, raw image bytes, or an ImagePayload
             
         Returns:
             Processed image data in the format expected by OpenAI
         """
+        # ImagePayload memoizes its data URL, so repeated calls don't re-encode
+        if isinstance(image_data, ImagePayload):
+            return image_data.data_url()
+        
         # If image_data is a URL, return it directly as OpenAI supports image URLs
         if isinstance(image_data, str) and (image_data.startswith('http://') or image_data.startswith('https://')):
             return image_data
@@ -87,3 +118,42 @@ class OpenAIService(LLMService):
         
         # If it's a string but not a URL, assume it's already base64 encoded
         return image_data
+    
+    def _prepare_messages(self, messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Replace ImagePayload objects in image parts with data URLs for the API.
+        Messages without payloads are passed through unchanged (not copied).
+        
+        Args:
+            messages: List of message objects, possibly containing ImagePayloads
+            
+        Returns:
+            Messages that can be serialized for the OpenAI API
+        """
+        prepared = []
+        for msg in messages:
+            content = msg.get("content")
+            if not isinstance(content, list) or not any(self._has_payload(item) for item in content):
+                prepared.append(msg)
+                continue
+            
+            new_content = []
+            for item in content:
+                if item.get("type") == "image_data" and isinstance(item.get("image_data"), ImagePayload):
+                    item = {"type": "image_url", "image_url": {"url": self.process_image(item["image_data"])}}
+                elif self._has_payload(item):
+                    image_url = dict(item["image_url"], url=self.process_image(item["image_url"]["url"]))
+                    item = dict(item, image_url=image_url)
+                new_content.append(item)
+            prepared.append(dict(msg, content=new_content))
+        return prepared
+    
+    @staticmethod
+    def _has_payload(item: Any) -> bool:
+        """Check whether a content part carries an ImagePayload."""
+        if not isinstance(item, dict):
+            return False
+        if isinstance(item.get("image_data"), ImagePayload):
+            return True
+        image_url = item.get("image_url")
+        return isinstance(image_url, dict) and isinstance(image_url.get("url"), ImagePayload)
@@ -0,0 +1,356 @@
+import os
+import io
+import json
+import time
+import uuid
+import random
+import pstats
+import cProfile
+import threading
+import contextvars
+import logging
+from typing import Any, Dict, List, Mapping, Optional
+
+logger = logging.getLogger(__name__)
+
+MODES = ("stages", "cprofile")
+
+class _NullContext:
+    """Reusable no-op context manager returned while profiling is off."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+_NULL_CONTEXT = _NullContext()
+
+class NullProfile:
+    """Stand-in used for requests that are not profiled; every method is a no-op."""
+
+    enabled = False
+    profile_id = None
+
+    def stage(self, name: str) -> _NullContext:
+        return _NULL_CONTEXT
+
+    def accumulate(self, name: str) -> _NullContext:
+        return _NULL_CONTEXT
+
+    def lap(self, name: str) -> None:
+        pass
+
+    def mark(self, name: str) -> None:
+        pass
+
+    def annotate(self, **fields: Any) -> None:
+        pass
+
+    def finish(self) -> None:
+        pass
+
+NULL_PROFILE = NullProfile()
+
+_current: contextvars.ContextVar = contextvars.ContextVar("request_profile", default=NULL_PROFILE)
+
+def current_profile():
+    """Return the profile of the request running on this thread (NULL_PROFILE if none)."""
+    return _current.get()
+
+def stage(name: str):
+    """Time a block as a stage of the current request's profile (no-op if not profiling)."""
+    return _current.get().stage(name)
+
+def activate(recorder) -> None:
+    """Make a stage recorder (a profile, a trace or a group of them) current for this request."""
+    _current.set(recorder)
+
+class _GroupContext:
+    """Enters and exits the stage (or accumulator) contexts of every member of a group."""
+
+    __slots__ = ("contexts",)
+
+    def __init__(self, contexts: List[Any]):
+        self.contexts = contexts
+
+    def __enter__(self):
+        for context in self.contexts:
+            context.__enter__()
+        return self
+
+    def __exit__(self, *exc_info):
+        for context in reversed(self.contexts):
+            context.__exit__(*exc_info)
+        return False
+
+class StageGroup:
+    """
+    Several stage recorders driven by the same stage points, e.g. the
+    request's profile and its trace. Each recorder is still finished on its
+    own.
+    """
+
+    enabled = True
+
+    def __init__(self, *recorders: Any):
+        self.recorders = recorders
+
+    def stage(self, name: str) -> _GroupContext:
+        return _GroupContext([recorder.stage(name) for recorder in self.recorders])
+
+    def accumulate(self, name: str) -> _GroupContext:
+        return _GroupContext([recorder.accumulate(name) for recorder in self.recorders])
+
+    def lap(self, name: str) -> None:
+        for recorder in self.recorders:
+            recorder.lap(name)
+
+    def mark(self, name: str) -> None:
+        for recorder in self.recorders:
+            recorder.mark(name)
+
+    def annotate(self, **fields: Any) -> None:
+        for recorder in self.recorders:
+            recorder.annotate(**fields)
+
+    def finish(self) -> None:
+        for recorder in self.recorders:
+            recorder.finish()
+
+def join(*recorders: Any):
+    """
+    Combine stage recorders and make the result current.
+
+    Args:
+        *recorders: Profiles or traces (disabled ones, like NULL_PROFILE, are left out)
+
+    Returns:
+        NULL_PROFILE, the only enabled recorder, or a StageGroup of them
+    """
+    enabled = [recorder for recorder in recorders if recorder.enabled]
+    if not enabled:
+        combined = NULL_PROFILE
+    elif len(enabled) == 1:
+        combined = enabled[0]
+    else:
+        combined = StageGroup(*enabled)
+    _current.set(combined)
+    return combined
+
+class _Stage:
+    __slots__ = ("profile", "name", "start", "depth")
+
+    def __init__(self, profile: "RequestProfile", name: str):
+        self.profile = profile
+        self.name = name
+
+    def __enter__(self):
+        self.depth = self.profile._depth
+        self.profile._depth += 1
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        end = time.perf_counter()
+        self.profile._depth -= 1
+        self.profile.stages.append({
+            "name": self.name,
+            "start_ms": round((self.start - self.profile.started) * 1000, 3),
+            "duration_ms": round((end - self.start) * 1000, 3),
+            "depth": self.depth,
+        })
+        return False
+
+class _Accumulator:
+    __slots__ = ("profile", "name", "start")
+
+    def __init__(self, profile: "RequestProfile", name: str):
+        self.profile = profile
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        total = self.profile.totals.setdefault(self.name, {"count": 0, "total_ms": 0.0})
+        total["count"] += 1
+        total["total_ms"] += (time.perf_counter() - self.start) * 1000
+        return False
+
+class RequestProfile:
+    """
+    Stage timings (and optionally a cProfile capture) of one request.
+
+    stage() times a block, lap() closes a stage that started where the previous
+    lap ended (handy in long linear handlers), accumulate() sums many short
+    blocks (e.g. per-chunk serialization) and mark() records a point in time
+    such as the first chunk.
+    finish() writes everything as JSON (plus a .prof file in cprofile mode).
+    """
+
+    enabled = True
+
+    def __init__(self, directory: str, mode: str = "stages", name: str = "request"):
+        """
+        Initialize and activate the profile for the current thread.
+
+        Args:
+            directory: Directory the profile is written to
+            mode: 'stages' for stage timers only, 'cprofile' to also capture a
+                function-level profile
+            name: Label of the profiled operation
+        """
+        self.directory = directory
+        self.mode = mode
+        self.name = name
+        self.profile_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        self.started = time.perf_counter()
+        self.stages: List[Dict[str, Any]] = []
+        self.totals: Dict[str, Dict[str, float]] = {}
+        self.marks: Dict[str, float] = {}
+        self.fields: Dict[str, Any] = {}
+        self._depth = 0
+        self._lap_start = self.started
+        self._finished = False
+        self._lock = threading.Lock()
+        self._profiler: Optional[cProfile.Profile] = None
+        if mode == "cprofile":
+            self._profiler = cProfile.Profile()
+            try:
+                self._profiler.enable()
+            except ValueError:
+                # Another profiler is already active on this thread
+                self._profiler = None
+        _current.set(self)
+
+    def stage(self, name: str) -> _Stage:
+        return _Stage(self, name)
+
+    def accumulate(self, name: str) -> _Accumulator:
+        return _Accumulator(self, name)
+
+    def lap(self, name: str) -> None:
+        """Record the time since the previous lap (or the start) as a stage."""
+        now = time.perf_counter()
+        self.stages.append({
+            "name": name,
+            "start_ms": round((self._lap_start - self.started) * 1000, 3),
+            "duration_ms": round((now - self._lap_start) * 1000, 3),
+            "depth": self._depth,
+        })
+        self._lap_start = now
+
+    def mark(self, name: str) -> None:
+        """Record the first time a named point is reached."""
+        self.marks.setdefault(name, round((time.perf_counter() - self.started) * 1000, 3))
+
+    def annotate(self, **fields: Any) -> None:
+        """Attach context (provider, model, session...) to the profile."""
+        self.fields.update(fields)
+
+    def finish(self) -> Optional[str]:
+        """
+        Stop profiling and write the profile (idempotent).
+
+        Returns:
+            Path of the JSON profile, or None if it was already written or failed
+        """
+        with self._lock:
+            if self._finished:
+                return None
+            self._finished = True
+        total_ms = round((time.perf_counter() - self.started) * 1000, 3)
+        if _current.get() is self:
+            _current.set(NULL_PROFILE)
+
+        report = {
+            "profile_id": self.profile_id,
+            "name": self.name,
+            "mode": self.mode,
+            "total_ms": total_ms,
+            "fields": self.fields,
+            "stages": sorted(self.stages, key=lambda item: item["start_ms"]),
+            "totals": {name: {"count": v["count"], "total_ms": round(v["total_ms"], 3)}
+                       for name, v in self.totals.items()},
+            "marks": self.marks,
+        }
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            base = os.path.join(self.directory, self.profile_id)
+            if self._profiler is not None:
+                self._profiler.disable()
+                self._profiler.dump_stats(f"{base}.prof")
+                text = io.StringIO()
+                pstats.Stats(self._profiler, stream=text).sort_stats("cumulative").print_stats(30)
+                report["cprofile_top"] = text.getvalue().splitlines()
+                report["cprofile_file"] = f"{base}.prof"
+            with open(f"{base}.json", "w") as f:
+                json.dump(report, f, indent=2, default=str)
+        except Exception as e:
+            logger.error(f"[Profiling] Could not write profile {self.profile_id}: {str(e)}")
+            return None
+        logger.info(f"[Profiling] Wrote {base}.json ({total_ms} ms)")
+        return f"{base}.json"
+
+class Profiler:
+    """
+    Decides which requests are profiled. A request is profiled when it carries
+    the trigger header ('1' or 'stages' for stage timers, 'cprofile' for a
+    function-level profile too) or is picked by the sampling rate.
+    """
+
+    def __init__(self, directory: str = "profiles", sample_rate: float = 0.0,
+                 header: Optional[str] = "X-Profile", sample_mode: str = "stages"):
+        """
+        Initialize the profiler.
+
+        Args:
+            directory: Directory profiles are written to
+            sample_rate: Fraction of requests profiled without the header (0 to 1)
+            header: Request header that triggers profiling (None disables it)
+            sample_mode: Mode used for sampled requests
+        """
+        self.directory = directory
+        self.sample_rate = sample_rate
+        self.header = header
+        self.sample_mode = sample_mode
+        self.started_count = 0
+
+    def start(self, headers: Mapping[str, str], name: str = "request"):
+        """
+        Start profiling a request if it is triggered.
+
+        Args:
+            headers: Request headers
+            name: Label of the profiled operation
+
+        Returns:
+            A RequestProfile, or NULL_PROFILE when the request is not profiled
+        """
+        mode = None
+        if self.header:
+            value = (headers.get(self.header) or "").strip().lower()
+            if value in ("1", "true", "yes", "stages"):
+                mode = "stages"
+            elif value == "cprofile":
+                mode = "cprofile"
+        if mode is None and self.sample_rate > 0 and random.random() < self.sample_rate:
+            mode = self.sample_mode
+        if mode is None:
+            # Clear a profile left over from an earlier request on this thread
+            _current.set(NULL_PROFILE)
+            return NULL_PROFILE
+        self.started_count += 1
+        return RequestProfile(self.directory, mode=mode, name=name)
+
+    def stats(self) -> Dict[str, Any]:
+        """Return the profiling settings and how many requests were profiled."""
+        return {
+            "directory": self.directory,
+            "header": self.header or None,
+            "sample_rate": self.sample_rate,
+            "sample_mode": self.sample_mode,
+            "profiled": self.started_count,
+        }
@@ -0,0 +1,303 @@
+import os
+import json
+import gzip
+import time
+import hashlib
+import threading
+import logging
+from typing import Any, Dict, Iterator, List, Optional, Union
+
+from llm_service import LLMService
+from image_payload import ImagePayload
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_REPLAY_FILE = "recordings/llm_replay.jsonl.gz"
+
+class ReplayObject(dict):
+    """
+    A recorded response or chunk. It is a plain dict (so code that handles
+    Gemini's dict responses keeps working) that also allows attribute access
+    and model_dump(), like the OpenAI SDK objects it stands in for.
+    """
+
+    def __getattr__(self, name: str) -> Any:
+        try:
+            return _wrap(self[name])
+        except KeyError:
+            # SDK objects expose unset optional fields as None
+            return None
+
+    def model_dump(self) -> Dict[str, Any]:
+        return json.loads(json.dumps(self))
+
+def _wrap(value: Any) -> Any:
+    if isinstance(value, dict) and not isinstance(value, ReplayObject):
+        return ReplayObject(value)
+    if isinstance(value, list):
+        return [_wrap(item) for item in value]
+    return value
+
+def _to_jsonable(obj: Any) -> Any:
+    """Serialize a provider response or chunk for the recording file."""
+    if hasattr(obj, "model_dump"):
+        return obj.model_dump()
+    if isinstance(obj, bytes):
+        # Anthropic streams come back as raw SSE lines
+        return {"__bytes__": obj.decode("utf-8", errors="replace")}
+    return obj
+
+def _from_jsonable(obj: Any) -> Any:
+    if isinstance(obj, dict) and set(obj) == {"__bytes__"}:
+        return obj["__bytes__"].encode("utf-8")
+    return _wrap(obj)
+
+def _normalize(value: Any) -> Any:
+    """Make a request JSON-serializable, replacing images by their content hash."""
+    if isinstance(value, ImagePayload):
+        return {"image_sha256": value.sha256()}
+    if isinstance(value, bytes):
+        return {"image_sha256": hashlib.sha256(value).hexdigest()}
+    if isinstance(value, str) and value.startswith("data:") and len(value) > 256:
+        return {"image_sha256": hashlib.sha256(value.encode("utf-8")).hexdigest()}
+    if isinstance(value, dict):
+        return {k: _normalize(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_normalize(v) for v in value]
+    return value
+
+def request_key(messages: List[Dict[str, Any]], model: Optional[str],
+                temperature: Optional[float], max_tokens: Optional[int], stream: bool) -> str:
+    """
+    Compute the lookup key of a chat completion request.
+
+    Args:
+        messages: Conversation in OpenAI format (images are keyed by content hash)
+        model: Model identifier
+        temperature: Sampling temperature
+        max_tokens: Maximum number of tokens to generate
+        stream: Whether the response is streamed
+
+    Returns:
+        Hex digest identifying the request
+    """
+    request = {"messages": _normalize(messages), "model": model, "temperature": temperature,
+               "max_tokens": max_tokens, "stream": stream}
+    encoded = json.dumps(request, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+class ReplayService(LLMService):
+    """
+    Record-and-replay implementation of the LLMService interface.
+
+    In record mode every request is forwarded to a real provider and the
+    response is appended to a gzip-compressed JSONL file. Streamed responses
+    are stored chunk by chunk with each chunk's offset from the start of the
+    request, so the stream keeps its original shape.
+    In replay mode the recorded responses are served offline, with the
+    recorded timing divided by the speed factor (0 replays without delays).
+    Requests that were never recorded get the next recording of the same kind
+    in round-robin order, unless strict matching is enabled. Each such
+    fallback is logged as a warning and counted in stats(), because the
+    answer belongs to a different prompt.
+    """
+
+    def __init__(self,
+                 api_key: Optional[str] = None,
+                 path: Optional[str] = None,
+                 mode: Optional[str] = None,
+                 upstream: Optional[str] = None,
+                 speed: Optional[float] = None,
+                 strict: Optional[bool] = None):
+        """
+        Initialize the replay service. Unset arguments come from REPLAY_FILE,
+        REPLAY_MODE, REPLAY_UPSTREAM, REPLAY_SPEED and REPLAY_STRICT.
+
+        Args:
+            api_key: API key of the upstream provider (record mode only)
+            path: Recording file
+            mode: 'replay' (default) or 'record'
+            upstream: Provider to record from (default: openai)
+            speed: Replay speed factor (1.0 = original timing, 0 = no delays)
+            strict: Fail on requests that have no exact recording
+        """
+        self.path = path or os.environ.get("REPLAY_FILE") or DEFAULT_REPLAY_FILE
+        self.mode = (mode or os.environ.get("REPLAY_MODE") or "replay").lower()
+        if self.mode not in ("replay", "record"):
+            raise ValueError(f"Unsupported replay mode: {self.mode}. Use 'replay' or 'record'")
+        self.speed = speed if speed is not None else float(os.environ.get("REPLAY_SPEED") or 1.0)
+        if strict is None:
+            strict = (os.environ.get("REPLAY_STRICT") or "").lower() in ("1", "true", "yes", "on")
+        self.strict = strict
+
+        self.upstream: Optional[LLMService] = None
+        if self.mode == "record":
+            # Imported here to avoid a circular import with the factory
+            from llm_factory import create_llm_service
+            self.upstream = create_llm_service(upstream or os.environ.get("REPLAY_UPSTREAM") or "openai",
+                                               api_key=api_key)
+
+        self._lock = threading.Lock()
+        self._recordings: Optional[Dict[str, List[Dict[str, Any]]]] = None
+        self._by_kind: Dict[bool, List[Dict[str, Any]]] = {True: [], False: []}
+        self._cursor = {True: 0, False: 0}
+        self._stats = {"recorded": 0, "matched": 0, "fallbacks": 0, "missing": 0}
+
+    def chat_completion(self,
+                        messages: List[Dict[str, Any]],
+                        model: Optional[str] = None,
+                        temperature: Optional[float] = None,
+                        max_tokens: Optional[int] = None,
+                        stream: bool = False,
+                        session_id: Optional[str] = None) -> Union[Dict[str, Any], Any]:
+        """
+        Generate a chat completion by recording or replaying one.
+
+        Args:
+            messages: List of message objects with role and content
+            model: Optional model identifier
+            temperature: Optional temperature parameter
+            max_tokens: Optional maximum number of tokens to generate
+            stream: Whether to stream the response
+            session_id: Optional conversation identifier (passed upstream when recording)
+
+        Returns:
+            Either a completion response object or a stream of chunks
+
+        Raises:
+            LookupError: If replaying and no recording matches
+        """
+        key = request_key(messages, model, temperature, max_tokens, stream)
+        if self.mode == "record":
+            return self._record(key, messages, model, temperature, max_tokens, stream, session_id)
+        return self._replay(self._find(key, stream))
+
+    def warmup(self) -> None:
+        """Warm the upstream provider when recording, otherwise load the recordings."""
+        if self.upstream is not None:
+            self.upstream.warmup()
+            return
+        with self._lock:
+            if self._recordings is None:
+                self._load()
+    
+    def stats(self) -> Dict[str, Any]:
+        """Return the mode and how many requests were recorded, matched exactly or answered by a fallback."""
+        with self._lock:
+            return {"mode": self.mode, "strict": self.strict, "path": self.path, **self._stats}
+
+    def process_image(self, image_data: Union[str, bytes, ImagePayload]) -> str:
+        """
+        Process an image for inclusion in a message.
+
+        Args:
+            image_data: A URL string, raw image bytes, or an ImagePayload
+
+        Returns:
+            The upstream provider's format when recording, otherwise a URL or data URL
+        """
+        if self.upstream is not None:
+            return self.upstream.process_image(image_data)
+        if isinstance(image_data, ImagePayload):
+            return image_data.data_url()
+        if isinstance(image_data, bytes):
+            return ImagePayload(image_data).data_url()
+        return image_data
+
+    def _record(self, key: str, messages: List[Dict[str, Any]], model: Optional[str],
+                temperature: Optional[float], max_tokens: Optional[int], stream: bool,
+                session_id: Optional[str]) -> Any:
+        kwargs = {"messages": messages, "model": model, "max_tokens": max_tokens, "stream": stream}
+        if temperature is not None:
+            kwargs["temperature"] = temperature
+        if session_id is not None:
+            kwargs["session_id"] = session_id
+        start = time.perf_counter()
+        response = self.upstream.chat_completion(**kwargs)
+        entry = {"key": key, "model": model, "stream": stream, "recorded_at": time.time()}
+
+        if not stream or isinstance(response, dict):
+            # GeminiService answers stream=True with a single dict
+            entry["latency_ms"] = round((time.perf_counter() - start) * 1000, 1)
+            entry["response"] = _to_jsonable(response)
+            self._append(entry)
+            return response
+        return self._record_stream(entry, response, start)
+
+    def _record_stream(self, entry: Dict[str, Any], response: Any, start: float) -> Iterator[Any]:
+        chunks = []
+        for chunk in response:
+            chunks.append([round((time.perf_counter() - start) * 1000, 1), _to_jsonable(chunk)])
+            yield chunk
+        # Only complete streams are recorded; an abandoned one is discarded
+        entry["chunks"] = chunks
+        self._append(entry)
+
+    def _append(self, entry: Dict[str, Any]) -> None:
+        line = json.dumps(entry, separators=(",", ":")) + "\n"
+        with self._lock:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._stats["recorded"] += 1
+            # Each append is its own gzip member; gzip readers concatenate them
+            with gzip.open(self.path, "at", encoding="utf-8") as f:
+                f.write(line)
+            if self._recordings is not None:
+                self._index(entry)
+
+    def _load(self) -> None:
+        recordings: Dict[str, List[Dict[str, Any]]] = {}
+        self._recordings = recordings
+        if not os.path.exists(self.path):
+            logger.warning(f"[Replay] No recordings at {self.path}")
+            return
+        with gzip.open(self.path, "rt", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    self._index(json.loads(line))
+        logger.info(f"[Replay] Loaded {sum(len(v) for v in recordings.values())} recordings from {self.path}")
+
+    def _index(self, entry: Dict[str, Any]) -> None:
+        self._recordings.setdefault(entry["key"], []).append(entry)
+        self._by_kind[bool(entry.get("stream"))].append(entry)
+
+    def _find(self, key: str, stream: bool) -> Dict[str, Any]:
+        with self._lock:
+            if self._recordings is None:
+                self._load()
+            matches = self._recordings.get(key)
+            if matches:
+                self._stats["matched"] += 1
+                return matches[-1]
+            candidates = self._by_kind[stream]
+            if self.strict or not candidates:
+                self._stats["missing"] += 1
+                raise LookupError(f"No recording for request {key[:12]} (stream={stream}) in {self.path}")
+            entry = candidates[self._cursor[stream] % len(candidates)]
+            self._cursor[stream] += 1
+            self._stats["fallbacks"] += 1
+            fallbacks = self._stats["fallbacks"]
+        # Outside the lock; the response is for another prompt, so results built on it are suspect
+        logger.warning(f"[Replay] No recording for request {key[:12]} (stream={stream}), "
+                       f"answering with recording {entry['key'][:12]} instead ({fallbacks} fallbacks so far)")
+        return entry
+
+    def _replay(self, entry: Dict[str, Any]) -> Any:
+        if "chunks" not in entry:
+            self._sleep_until(time.perf_counter(), entry.get("latency_ms", 0))
+            return _from_jsonable(entry["response"])
+        return self._replay_stream(entry["chunks"])
+
+    def _replay_stream(self, chunks: List[List[Any]]) -> Iterator[Any]:
+        start = time.perf_counter()
+        for offset_ms, chunk in chunks:
+            self._sleep_until(start, offset_ms)
+            yield _from_jsonable(chunk)
+
+    def _sleep_until(self, start: float, offset_ms: float) -> None:
+        if self.speed <= 0:
+            return
+        delay = start + offset_ms / 1000.0 / self.speed - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
@@ -0,0 +1,174 @@
+import threading
+import time
+import logging
+from collections import deque
+from typing import Callable, Dict, Any, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+class SignedUrlPool:
+    """
+    Background-refreshed pool of pre-minted ElevenLabs signed conversation URLs.
+
+    URLs are minted ahead of demand by a daemon thread and handed out instantly.
+    Each URL is tracked against its expiry and discarded before it goes stale.
+    When the pool is empty, acquire() falls back to minting on demand.
+    Failed background mints are retried with exponential backoff (reset by
+    the next successful mint or by clear()).
+    """
+
+    def __init__(self,
+                 mint: Callable[[], str],
+                 depth: int = 2,
+                 refill_interval: float = 1.0,
+                 ttl: float = 900.0,
+                 min_remaining: float = 120.0,
+                 max_backoff: float = 300.0):
+        """
+        Initialize the pool.
+
+        Args:
+            mint: Function that requests a new signed URL from ElevenLabs
+            depth: Number of URLs to keep ready
+            refill_interval: Minimum number of seconds between two background mints
+            ttl: Lifetime of a signed URL in seconds
+            min_remaining: URLs with less lifetime than this left are not handed out
+            max_backoff: Maximum number of seconds between two background mints
+                after consecutive failures
+        """
+        self.mint = mint
+        self.depth = max(0, depth)
+        self.refill_interval = refill_interval
+        self.ttl = ttl
+        self.min_remaining = min_remaining
+        self.max_backoff = max_backoff
+
+        self._urls = deque()  # (url, expires_at) pairs, oldest first
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        # Bumped by clear(); a mint started under an older generation used old credentials
+        self._generation = 0
+        self._backoff = 0.0
+        self._consecutive_failures = 0
+        self._stats = {"pool_hits": 0, "pool_misses": 0, "minted": 0, "expired": 0, "mint_errors": 0, "discarded": 0}
+
+    def start(self) -> None:
+        """Start the background refill thread (no-op if already running or depth is 0)."""
+        if self.depth == 0 or (self._thread and self._thread.is_alive()):
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name="signed-url-pool", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop the background refill thread."""
+        self._stopped.set()
+        self._wakeup.set()
+
+    def acquire(self) -> Tuple[str, bool]:
+        """
+        Take a signed URL from the pool, minting one on demand if the pool is empty.
+
+        Returns:
+            Tuple of (signed URL, whether it came from the pool)
+
+        Raises:
+            Whatever the mint function raises when on-demand minting fails
+        """
+        url = None
+        with self._lock:
+            self._prune()
+            if self._urls:
+                url, _ = self._urls.popleft()
+                self._stats["pool_hits"] += 1
+            else:
+                self._stats["pool_misses"] += 1
+        # Let the refill thread top the pool back up right away
+        self._wakeup.set()
+
+        if url:
+            return url, True
+
+        logger.info("[SignedUrlPool] Pool empty, minting signed URL on demand")
+        return self.mint(), False
+
+    def clear(self) -> None:
+        """Discard all pre-minted URLs (e.g. after the credentials changed)."""
+        with self._lock:
+            self._urls.clear()
+            self._generation += 1
+            # New credentials deserve a fresh attempt
+            self._backoff = 0.0
+            self._consecutive_failures = 0
+        self._wakeup.set()
+
+    def stats(self) -> Dict[str, Any]:
+        """Return pool counters, the number of URLs currently ready and the current mint backoff."""
+        with self._lock:
+            self._prune()
+            return dict(self._stats, ready=len(self._urls), depth=self.depth,
+                        backoff_seconds=self._backoff, consecutive_failures=self._consecutive_failures)
+
+    def _prune(self) -> None:
+        """Drop URLs that no longer have enough lifetime left. Caller holds the lock."""
+        cutoff = time.monotonic() + min(self.min_remaining, self.ttl / 2)
+        while self._urls and self._urls[0][1] <= cutoff:
+            self._urls.popleft()
+            self._stats["expired"] += 1
+
+    def _needs_refill(self) -> bool:
+        with self._lock:
+            self._prune()
+            return len(self._urls) < self.depth
+
+    def _run(self) -> None:
+        """Refill loop: mint one URL per refill interval until the pool is full, backing off on failures."""
+        while not self._stopped.is_set():
+            if self._needs_refill():
+                with self._lock:
+                    generation = self._generation
+                try:
+                    url = self.mint()
+                    with self._lock:
+                        if generation != self._generation:
+                            # Credentials changed while minting: the URL is signed with the old key
+                            self._stats["discarded"] += 1
+                        else:
+                            self._urls.append((url, time.monotonic() + self.ttl))
+                            self._stats["minted"] += 1
+                            self._backoff = 0.0
+                            self._consecutive_failures = 0
+                    self._stopped.wait(self.refill_interval)
+                except Exception as e:
+                    with self._lock:
+                        self._stats["mint_errors"] += 1
+                        self._consecutive_failures += 1
+                        self._backoff = min(self.max_backoff, max(self.refill_interval, self._backoff * 2))
+                        backoff = self._backoff
+                    logger.warning(f"[SignedUrlPool] Background mint failed "
+                                   f"({self._consecutive_failures} in a row), retrying in {backoff:g}s: {str(e)}")
+                    self._wait_backoff(backoff, generation)
+                continue
+
+            # Pool is full: sleep until a URL is taken or the oldest one needs replacing
+            with self._lock:
+                next_expiry = self._urls[0][1] - min(self.min_remaining, self.ttl / 2) if self._urls else None
+            timeout = max(0.0, next_expiry - time.monotonic()) if next_expiry else None
+            self._wakeup.wait(timeout)
+            self._wakeup.clear()
+
+    def _wait_backoff(self, seconds: float, generation: int) -> None:
+        """Sleep after a failed mint; stop() or clear() (new credentials) cut the wait short."""
+        until = time.monotonic() + seconds
+        while not self._stopped.is_set():
+            with self._lock:
+                if generation != self._generation:
+                    return
+            remaining = until - time.monotonic()
+            if remaining <= 0:
+                return
+            # acquire() sets the wakeup too; that alone doesn't end the backoff
+            self._wakeup.wait(remaining)
+            self._wakeup.clear()
@@ -0,0 +1,220 @@
+import json
+import hashlib
+import threading
+import logging
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+_END = object()
+
+def request_fingerprint(request: Dict[str, Any]) -> str:
+    """
+    Compute a canonical key for a request, independent of key order and whitespace.
+
+    Args:
+        request: JSON-like description of the upstream call (provider, model,
+            sampling parameters and the final messages)
+
+    Returns:
+        Hex digest identifying the request
+    """
+    encoded = json.dumps(request, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+class Flight:
+    """
+    One upstream stream shared by every subscriber with the same key.
+
+    Items are kept in a buffer so a subscriber that joins late still gets the
+    stream from the start. There is no background thread: whichever
+    subscriber first needs an item that isn't buffered yet pulls it from the
+    upstream iterator, and the others wait for it. So the stream keeps going
+    when the leader's client disconnects, as long as anyone is still reading.
+    When the last subscriber leaves before the end, the upstream iterator is
+    closed.
+    """
+
+    def __init__(self, key: str, on_done: Callable[["Flight"], None]):
+        self.key = key
+        self._on_done = on_done
+        self._cond = threading.Condition()
+        self._buffer: List[Any] = []
+        self._producer: Optional[Iterator[Any]] = None
+        self._on_finish: Optional[Callable[[], Any]] = None
+        self._pulling = False
+        self._done = False
+        self._error: Optional[BaseException] = None
+        self._subscribers = 0
+
+    def start(self, producer: Iterator[Any], on_finish: Optional[Callable[[], Any]] = None) -> None:
+        """
+        Attach the upstream iterator (called once, by the leader).
+
+        Args:
+            producer: Iterator of items to fan out
+            on_finish: Called once when the flight completes or is abandoned
+        """
+        with self._cond:
+            if self._done:
+                # Every subscriber left before the upstream call returned
+                self._close_producer(producer)
+                if on_finish:
+                    on_finish()
+                return
+            self._producer = producer
+            self._on_finish = on_finish
+            self._cond.notify_all()
+
+    def fail(self, error: BaseException) -> None:
+        """End a flight whose upstream call could not be made; subscribers get the error."""
+        with self._cond:
+            if self._producer is not None or self._done:
+                return
+            self._error = error
+        self._finish()
+
+    def subscribe(self) -> "Subscription":
+        with self._cond:
+            self._subscribers += 1
+        return Subscription(self)
+
+    def _get(self, index: int) -> Any:
+        """Return item number index, pulling from upstream if needed, or _END."""
+        with self._cond:
+            while True:
+                if index < len(self._buffer):
+                    return self._buffer[index]
+                if self._done:
+                    if self._error is not None:
+                        raise self._error
+                    return _END
+                if self._producer is None or self._pulling:
+                    self._cond.wait()
+                    continue
+                self._pulling = True
+                producer = self._producer
+                break
+
+        try:
+            item = next(producer)
+        except StopIteration:
+            item = _END
+        except BaseException as e:
+            with self._cond:
+                self._pulling = False
+                self._error = e
+            self._finish()
+            raise
+
+        with self._cond:
+            self._pulling = False
+            if item is not _END:
+                self._buffer.append(item)
+                self._cond.notify_all()
+                return item
+        self._finish()
+        return _END
+
+    def _detach(self) -> None:
+        with self._cond:
+            self._subscribers -= 1
+            abandoned = self._subscribers == 0 and not self._done
+        if abandoned:
+            logger.info(f"[Single-flight] All subscribers left {self.key[:12]}, closing upstream")
+            self._finish(abandoned=True)
+
+    def _finish(self, abandoned: bool = False) -> None:
+        with self._cond:
+            if self._done and self._on_finish is None and self._producer is None:
+                return
+            self._done = True
+            producer, self._producer = self._producer, None
+            on_finish, self._on_finish = self._on_finish, None
+            self._cond.notify_all()
+        self._on_done(self)
+        if abandoned and producer is not None:
+            self._close_producer(producer)
+        if on_finish:
+            on_finish()
+
+    @staticmethod
+    def _close_producer(producer: Iterator[Any]) -> None:
+        close = getattr(producer, "close", None)
+        if close:
+            try:
+                close()
+            except ValueError:
+                # Still executing on another thread; it will finish on its own
+                pass
+
+class Subscription:
+    """A subscriber's view of a flight: iterate it, and close it when done."""
+
+    def __init__(self, flight: Flight):
+        self.flight = flight
+        self._closed = False
+        self._lock = threading.Lock()
+
+    def __iter__(self) -> Iterator[Any]:
+        try:
+            index = 0
+            while True:
+                item = self.flight._get(index)
+                if item is _END:
+                    return
+                yield item
+                index += 1
+        finally:
+            self.close()
+
+    def close(self) -> None:
+        """Leave the flight (idempotent)."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        self.flight._detach()
+
+class SingleFlight:
+    """Registry of in-flight upstream streams, keyed by request fingerprint."""
+
+    def __init__(self):
+        self._flights: Dict[str, Flight] = {}
+        self._lock = threading.Lock()
+        self._stats = {"leaders": 0, "followers": 0}
+
+    def subscribe(self, key: str) -> Tuple[Subscription, bool]:
+        """
+        Join the in-flight stream for a key, or become its leader.
+
+        Args:
+            key: Request fingerprint
+
+        Returns:
+            Tuple of (subscription, is_leader). The leader must call
+            subscription.flight.start() with the upstream iterator, or
+            subscription.flight.fail() if the upstream call can't be made.
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            # A flight that just ended (or was abandoned) is not joined
+            is_leader = flight is None or flight._done
+            if is_leader:
+                flight = Flight(key, self._remove)
+                self._flights[key] = flight
+                self._stats["leaders"] += 1
+            else:
+                self._stats["followers"] += 1
+            # Subscribe under the registry lock so the flight can't end in between
+            return flight.subscribe(), is_leader
+
+    def stats(self) -> Dict[str, Any]:
+        """Return the number of streams in flight and how many requests were coalesced."""
+        with self._lock:
+            return {"in_flight": len(self._flights), **self._stats}
+
+    def _remove(self, flight: Flight) -> None:
+        with self._lock:
+            if self._flights.get(flight.key) is flight:
+                del self._flights[flight.key]
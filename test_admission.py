@@ -0,0 +1,103 @@
+import sys
+import threading
+import time
+
+from admission import BATCH, INTERACTIVE, AdmissionRejected, ProviderGate
+
+def _queue_in_background(gate, priority):
+    """Start an acquire() on another thread; returns a dict filled with its ticket or rejection."""
+    outcome = {}
+
+    def run():
+        try:
+            outcome["ticket"] = gate.acquire(priority)
+        except AdmissionRejected as e:
+            outcome["rejected"] = e
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    outcome["thread"] = thread
+    return outcome
+
+def _wait_until(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("Timed out waiting for the gate")
+        time.sleep(0.01)
+
+def test_interactive_displaces_queued_batch():
+    """A full queue makes room for interactive traffic by rejecting the newest batch request."""
+    gate = ProviderGate("test", max_concurrent=1, max_queue=1, max_wait=5.0)
+    running = gate.acquire(INTERACTIVE)
+
+    batch = _queue_in_background(gate, BATCH)
+    _wait_until(lambda: gate.stats()["queued"]["batch"] == 1)
+
+    interactive = _queue_in_background(gate, INTERACTIVE)
+    batch["thread"].join(2.0)
+    assert "rejected" in batch, "queued batch request should have been displaced"
+    assert "displaced" in str(batch["rejected"])
+    assert batch["rejected"].retry_after >= 1
+    assert gate.stats()["displaced"] == 1
+
+    # The interactive request gets the slot as soon as it frees up
+    running.release()
+    interactive["thread"].join(2.0)
+    assert "ticket" in interactive
+    interactive["ticket"].release()
+    assert gate.stats()["in_flight"] == 0
+
+def test_full_queue_rejects_batch_with_retry_after():
+    """A batch request is rejected at once when the queue is full, with a Retry-After estimate."""
+    gate = ProviderGate("test", max_concurrent=1, max_queue=1, max_wait=5.0)
+    running = gate.acquire(BATCH)
+    queued = _queue_in_background(gate, BATCH)
+    _wait_until(lambda: gate.stats()["queued"]["batch"] == 1)
+
+    try:
+        gate.acquire(BATCH)
+        raise AssertionError("a batch request should be rejected while the queue is full")
+    except AdmissionRejected as e:
+        assert "full" in str(e)
+        # One running and one queued request, one slot: at least a second
+        assert e.retry_after >= 1
+    assert gate.stats()["rejected_full"] == 1
+
+    running.release()
+    queued["thread"].join(2.0)
+    queued["ticket"].release()
+
+def test_wait_timeout_leaves_the_queue():
+    """A request that waits longer than max_wait is rejected and no longer counted as queued."""
+    gate = ProviderGate("test", max_concurrent=1, max_queue=4, max_wait=0.1)
+    running = gate.acquire(INTERACTIVE)
+    try:
+        gate.acquire(INTERACTIVE)
+        raise AssertionError("the second request should time out")
+    except AdmissionRejected as e:
+        assert "Timed out" in str(e)
+    stats = gate.stats()
+    assert stats["rejected_timeout"] == 1
+    assert stats["queued"] == {"interactive": 0, "batch": 0}
+    running.release()
+
+def main():
+    """
+    Test script for the provider admission gate: queueing, displacement of
+    batch requests by interactive ones, and Retry-After estimates.
+    """
+    tests = [test_interactive_displaces_queued_batch, test_full_queue_rejects_batch_with_retry_after,
+             test_wait_timeout_leaves_the_queue]
+    failed = 0
+    for test in tests:
+        try:
+            test()
+            print(f"PASS {test.__name__}")
+        except AssertionError as e:
+            failed += 1
+            print(f"FAIL {test.__name__}: {str(e)}")
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+import sys
+
+from conversion_cache import ConversionCache, Incomplete
+
+class _Converter:
+    """Provider converter stand-in that records which messages it was asked to convert."""
+
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, messages):
+        self.calls.append([msg["content"] for msg in messages])
+        # System messages are dropped, like a provider without a system role would
+        return [None if msg["role"] == "system" else {"converted": msg["content"]} for msg in messages]
+
+def test_hit_returns_the_same_converted_message():
+    """A memoized message comes back as the very object converted on the earlier turn."""
+    cache = ConversionCache(max_sessions=4, max_messages=16)
+    converter = _Converter()
+    history = [{"role": "user", "content": "What is this?"}]
+
+    first = cache.convert("session", history, converter)
+    history += [{"role": "assistant", "content": "A cat. "}, {"role": "user", "content": "What color?"}]
+    second = cache.convert("session", history, converter)
+
+    assert second[0] is first[0]
+    # Only the two new messages were converted on the second turn
+    assert converter.calls == [["What is this?"], ["A cat. ", "What color?"]]
+    stats = cache.stats()
+    assert stats["hits"] == 1 and stats["misses"] == 3, stats
+
+def test_assistant_whitespace_still_hits():
+    """Our own replies come back trimmed by the client and still match their conversion."""
+    cache = ConversionCache(max_sessions=4, max_messages=16)
+    converter = _Converter()
+    cache.convert("session", [{"role": "assistant", "content": "Hello there. "}], converter)
+    cache.convert("session", [{"role": "assistant", "content": "Hello there."}], converter)
+    assert len(converter.calls) == 1
+
+def test_dropped_messages_and_sessions_are_separate():
+    """Dropped messages are left out of the result, and sessions never share conversions."""
+    cache = ConversionCache(max_sessions=4, max_messages=16)
+    converter = _Converter()
+    messages = [{"role": "system", "content": "Be brief."}, {"role": "user", "content": "Hi"}]
+    assert cache.convert("a", messages, converter) == [{"converted": "Hi"}]
+    cache.convert("b", messages, converter)
+    assert len(converter.calls) == 2
+
+def test_incomplete_conversion_is_retried():
+    """A message whose image failed to convert is used once, not memoized, and converted again next turn."""
+    cache = ConversionCache(max_sessions=4, max_messages=16)
+    attempts = []
+
+    def converter(messages):
+        attempts.append(len(messages))
+        converted = [{"converted": msg["content"]} for msg in messages]
+        # The image fetch fails on the first attempt only
+        return [Incomplete(converted[0])] + converted[1:] if len(attempts) == 1 else converted
+
+    history = [{"role": "user", "content": "[image] What is this?"}]
+    first = cache.convert("session", history, converter)
+    assert first == [{"converted": "[image] What is this?"}] and not first.complete
+    assert cache.stats()["incomplete"] == 1
+
+    history += [{"role": "assistant", "content": "I can't see it."}, {"role": "user", "content": "Try again"}]
+    second = cache.convert("session", history, converter)
+    assert second.complete
+    # The image message was converted again along with the two new ones
+    assert attempts == [1, 3], attempts
+
+def test_limits_evict_least_recently_used():
+    """Each session keeps at most max_messages conversions and at most max_sessions sessions are kept."""
+    cache = ConversionCache(max_sessions=1, max_messages=2)
+    converter = _Converter()
+    cache.convert("a", [{"role": "user", "content": text} for text in ("1", "2", "3")], converter)
+    cache.convert("b", [{"role": "user", "content": "x"}], converter)
+    stats = cache.stats()
+    assert stats["evicted_messages"] == 1 and stats["evicted_sessions"] == 1, stats
+
+def main():
+    """
+    Test script for the per-session conversion memo used by the Gemini and
+    Anthropic services.
+    """
+    tests = [test_hit_returns_the_same_converted_message, test_assistant_whitespace_still_hits,
+             test_dropped_messages_and_sessions_are_separate, test_incomplete_conversion_is_retried,
+             test_limits_evict_least_recently_used]
+    failed = 0
+    for test in tests:
+        try:
+            test()
+            print(f"PASS {test.__name__}")
+        except AssertionError as e:
+            failed += 1
+            print(f"FAIL {test.__name__}: {str(e)}")
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
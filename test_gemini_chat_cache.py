@@ -0,0 +1,153 @@
+import sys
+from types import SimpleNamespace
+
+import gemini_service
+from gemini_service import GeminiService
+
+class _FakeChat:
+    """Stands in for a Gemini ChatSession: keeps the history and answers every message."""
+
+    def __init__(self, model, history):
+        self.model = model
+        self.history = list(history)
+        self.sent = []
+
+    def send_message(self, content, generation_config=None, request_options=None):
+        self.sent.append(content)
+        self.history.append({"role": "user", "parts": content})
+        reply = f"reply {len(self.sent)}"
+        self.history.append({"role": "model", "parts": [reply]})
+        return SimpleNamespace(text=reply, usage_metadata=None)
+
+class _FakeModel:
+    """Stands in for genai.GenerativeModel and records every chat it starts."""
+
+    started = []
+
+    def __init__(self, model_name):
+        self.model_name = model_name
+
+    def start_chat(self, history):
+        chat = _FakeChat(self.model_name, history)
+        _FakeModel.started.append(chat)
+        return chat
+
+def _service():
+    gemini_service.genai.GenerativeModel = _FakeModel
+    _FakeModel.started = []
+    return GeminiService(api_key="test")
+
+def _turn(service, history, text, model="gemini-1.5-pro"):
+    """Send one user turn the way the voice agent does (full history) and add the reply to it."""
+    history.append({"role": "user", "content": text})
+    response = service.chat_completion(list(history), model=model, session_id="session")
+    history.append({"role": "assistant", "content": response["choices"][0]["message"]["content"]})
+    return response
+
+def test_miss_hit_rebuild_across_three_turns():
+    """First turn starts a chat, a follow-up continues it, an edited history rebuilds it."""
+    service = _service()
+    history = [{"role": "system", "content": "Be brief."}]
+
+    _turn(service, history, "What is in the picture?")
+    assert len(_FakeModel.started) == 1
+    assert service.stats()["chat_cache"]["misses"] == 1
+
+    _turn(service, history, "Thanks!")
+    stats = service.stats()["chat_cache"]
+    assert stats["hits"] == 1, stats
+    assert len(_FakeModel.started) == 1, "a follow-up must continue the cached chat"
+    assert _FakeModel.started[0].sent[-1] == ["Thanks!"], "only the new turn is sent"
+
+    # The client trimmed an earlier message: the cached history no longer matches
+    history[1]["content"] = "What is in this picture?"
+    _turn(service, history, "Tell me more")
+    stats = service.stats()["chat_cache"]
+    assert stats["rebuilds"] == 1, stats
+    assert len(_FakeModel.started) == 2
+
+def test_routed_model_keeps_the_cached_history():
+    """A turn routed to another model continues the cached history instead of missing."""
+    service = _service()
+    history = [{"role": "system", "content": "Be brief."}]
+    _turn(service, history, "Describe the image")
+    _turn(service, history, "ok", model="gemini-1.5-flash")
+
+    stats = service.stats()["chat_cache"]
+    assert stats["hits"] == 1 and stats["misses"] == 1, stats
+    flash_chat = _FakeModel.started[-1]
+    assert flash_chat.model == "gemini-1.5-flash"
+    # System prompt, first turn and its reply came over from the cached chat
+    assert len(flash_chat.history) == 3 + 2
+
+def test_history_ending_with_assistant_is_rebuilt():
+    """send_message posts a user turn, so a request ending with an assistant message is not a hit."""
+    service = _service()
+    history = [{"role": "system", "content": "Be brief."}]
+    _turn(service, history, "Hello")
+    service.chat_completion(history + [{"role": "assistant", "content": "Partial answer"}], session_id="session")
+    stats = service.stats()["chat_cache"]
+    assert stats["hits"] == 0 and stats["rebuilds"] == 1, stats
+
+def test_detail_turn_kept_in_history_continues_the_chat():
+    """The app re-inserts the full-resolution turn of a detail request on later turns, which keeps hitting."""
+    service = _service()
+    service.process_image = lambda image_data: {"mime_type": "image/jpeg", "data": b"jpeg"}
+    full_image = {"role": "user", "content": [
+        {"type": "text", "text": "(System note: Full-resolution version of the shared image.)"},
+        {"type": "image_url", "image_url": {"url": "http://localhost/serve_image/cat.jpg", "detail": "high"}}
+    ]}
+    history = [{"role": "system", "content": "Be brief."}]
+    _turn(service, history, "What is this?")
+    history.append(full_image)
+    _turn(service, history, "Zoom in on the corner")
+    _turn(service, history, "Thanks")
+
+    stats = service.stats()["chat_cache"]
+    assert stats["hits"] == 2 and stats["rebuilds"] == 0, stats
+    assert len(_FakeModel.started) == 1
+
+def test_chat_without_its_image_is_not_cached():
+    """A turn whose image failed to load is answered, but the next turn rebuilds the chat with the image."""
+    service = _service()
+    attempts = []
+
+    def process_image(image_data):
+        attempts.append(image_data)
+        if len(attempts) == 1:
+            raise TimeoutError("image fetch timed out")
+        return {"mime_type": "image/jpeg", "data": b"jpeg"}
+
+    service.process_image = process_image
+    history = [{"role": "system", "content": "Be brief."}, {"role": "user", "content": [
+        {"type": "text", "text": "(System note: The user has shared an image.)"},
+        {"type": "image_url", "image_url": {"url": "http://localhost/serve_image/cat.jpg"}}
+    ]}]
+    _turn(service, history, "What is this?")
+    _turn(service, history, "And now?")
+
+    assert len(attempts) == 2, "the image is fetched again on the next turn"
+    assert len(_FakeModel.started) == 2
+    image_parts = [part for msg in _FakeModel.started[-1].history for part in msg["parts"] if isinstance(part, dict)]
+    assert image_parts == [{"mime_type": "image/jpeg", "data": b"jpeg"}]
+
+def main():
+    """
+    Test script for the Gemini chat session cache: misses, hits and rebuilds
+    across turns, with the Gemini API replaced by an in-memory chat.
+    """
+    tests = [test_miss_hit_rebuild_across_three_turns, test_routed_model_keeps_the_cached_history,
+             test_history_ending_with_assistant_is_rebuilt, test_detail_turn_kept_in_history_continues_the_chat,
+             test_chat_without_its_image_is_not_cached]
+    failed = 0
+    for test in tests:
+        try:
+            test()
+            print(f"PASS {test.__name__}")
+        except AssertionError as e:
+            failed += 1
+            print(f"FAIL {test.__name__}: {str(e)}")
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+import sys
+
+from config import ConfigError, build_config
+from model_router import RoutingPolicy
+
+IMAGE_MESSAGE = {
+    "role": "user",
+    "content": [
+        {"type": "text", "text": "(System note: The user has shared an image.)"},
+        {"type": "image_url", "image_url": {"url": "http://localhost/serve_image/cat.jpg", "detail": "high"}}
+    ]
+}
+
+def _conversation(*user_texts):
+    """System prompt, the injected image, then alternating user turns and replies."""
+    messages = [{"role": "system", "content": "Be brief."}, IMAGE_MESSAGE]
+    for text in user_texts:
+        messages += [{"role": "user", "content": text}, {"role": "assistant", "content": "Sure."}]
+    return messages[:-1]
+
+def _policy():
+    return RoutingPolicy(fast_model="gpt-4o-mini", vision_model="gpt-4o", fast_max_chars=10)
+
+def test_image_in_history_is_not_a_vision_turn():
+    """Once the image has been discussed, an unrelated turn leaves the vision model."""
+    decision = _policy().route(_conversation("What is this?", "How do I bake bread at home?"), "gpt-4.1")
+    assert decision.route == "default", decision
+    assert decision.has_image and not decision.needs_image
+
+def test_turn_about_the_image_goes_to_vision():
+    """A turn that refers to the picture, or carries an image itself, is routed to the vision model."""
+    policy = _policy()
+    decision = policy.route(_conversation("Hello", "What colour is the car in the photo?"), "gpt-4.1")
+    assert decision.route == "vision" and decision.needs_image, decision
+
+    messages = _conversation("Hello") + [dict(IMAGE_MESSAGE)]
+    assert policy.route(messages, "gpt-4.1").route == "vision"
+
+def test_first_look_goes_to_vision():
+    """The caller marks the first turn after an upload as needing the image, whatever it says."""
+    decision = _policy().route(_conversation("ok"), "gpt-4.1", image_needed=True)
+    assert decision.route == "vision", decision
+    assert _policy().route(_conversation("ok"), "gpt-4.1").route == "fast"
+
+def test_trivial_reply_is_not_about_the_image():
+    """"I see" shares a word with image questions but is still a trivial reply."""
+    assert _policy().route(_conversation("Describe it", "I see"), "gpt-4.1").route == "fast"
+
+def test_routed_models_must_belong_to_the_provider():
+    """A routing model of another provider is rejected when the config is loaded."""
+    for env in ({"LLM_PROVIDER": "gemini", "ROUTING_VISION_MODEL": "gpt-4o"},
+                {"LLM_PROVIDER": "openai", "ROUTING_FAST_MODEL": "claude-3-5-haiku-latest"},
+                {"LLM_PROVIDER": "openai", "ROUTING_RULES": '[{"model": "gemini-1.5-flash"}]'},
+                {"LLM_PROVIDER": "replay", "REPLAY_UPSTREAM": "gemini", "ROUTING_FAST_MODEL": "gpt-4o-mini"}):
+        try:
+            build_config(env)
+            raise AssertionError(f"{env} should be rejected")
+        except ConfigError as e:
+            assert "is not a model of provider" in str(e)
+    config = build_config({"LLM_PROVIDER": "gemini", "ROUTING_FAST_MODEL": "gemini-1.5-flash"})
+    assert config.routing_fast_model == "gemini-1.5-flash"
+
+def main():
+    """
+    Test script for per-turn model routing: when a conversation with an image
+    goes to the vision model, and validation of the routed models.
+    """
+    tests = [test_image_in_history_is_not_a_vision_turn, test_turn_about_the_image_goes_to_vision,
+             test_first_look_goes_to_vision, test_trivial_reply_is_not_about_the_image,
+             test_routed_models_must_belong_to_the_provider]
+    failed = 0
+    for test in tests:
+        try:
+            test()
+            print(f"PASS {test.__name__}")
+        except AssertionError as e:
+            failed += 1
+            print(f"FAIL {test.__name__}: {str(e)}")
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+import sys
+import threading
+
+from single_flight import SingleFlight
+
+class _Upstream:
+    """Upstream stream that hands out items one by one and records whether it was closed."""
+
+    def __init__(self, items):
+        self.items = items
+        self.pulled = 0
+        self.closed = False
+        self.released = threading.Event()
+
+    def __iter__(self):
+        return self._generate()
+
+    def _generate(self):
+        try:
+            for item in self.items:
+                self.pulled += 1
+                yield item
+        finally:
+            self.closed = True
+
+def test_follower_joins_and_gets_the_whole_stream():
+    """A follower that joins after items were streamed still receives them from the start."""
+    flights = SingleFlight()
+    upstream = _Upstream(["a", "b", "c"])
+
+    leader, is_leader = flights.subscribe("key")
+    assert is_leader
+    leader.flight.start(iter(upstream), on_finish=upstream.released.set)
+    leader_items = iter(leader)
+    assert next(leader_items) == "a"
+
+    follower, is_leader = flights.subscribe("key")
+    assert not is_leader
+    assert list(follower) == ["a", "b", "c"]
+    assert list(leader_items) == ["b", "c"]
+
+    # Every item was pulled from upstream once, for both subscribers
+    assert upstream.pulled == 3
+    assert upstream.released.is_set()
+    assert flights.stats() == {"in_flight": 0, "leaders": 1, "followers": 1}
+
+def test_follower_leaving_keeps_the_stream_going():
+    """A subscriber leaving early doesn't end the stream for the others."""
+    flights = SingleFlight()
+    upstream = _Upstream(["a", "b", "c"])
+    leader, _ = flights.subscribe("key")
+    leader.flight.start(iter(upstream))
+    follower, _ = flights.subscribe("key")
+
+    follower_items = iter(follower)
+    assert next(follower_items) == "a"
+    follower_items.close()
+
+    assert not upstream.closed
+    assert list(leader) == ["a", "b", "c"]
+
+def test_upstream_closed_when_last_subscriber_leaves():
+    """When every subscriber leaves before the end, the upstream stream is closed."""
+    flights = SingleFlight()
+    upstream = _Upstream(["a", "b", "c"])
+    leader, _ = flights.subscribe("key")
+    leader.flight.start(iter(upstream), on_finish=upstream.released.set)
+    follower, _ = flights.subscribe("key")
+
+    leader_items = iter(leader)
+    assert next(leader_items) == "a"
+    leader_items.close()
+    assert not upstream.closed
+
+    follower_items = iter(follower)
+    assert next(follower_items) == "a"
+    assert next(follower_items) == "b"
+    follower_items.close()
+
+    assert upstream.closed
+    assert upstream.pulled == 2
+    assert upstream.released.is_set()
+    assert flights.stats()["in_flight"] == 0
+
+    # The next identical request starts a new flight instead of joining the abandoned one
+    _, is_leader = flights.subscribe("key")
+    assert is_leader
+
+def test_failed_upstream_call_reaches_followers():
+    """A leader that can't make the upstream call fails the flight for every subscriber."""
+    flights = SingleFlight()
+    leader, _ = flights.subscribe("key")
+    follower, _ = flights.subscribe("key")
+    leader.flight.fail(RuntimeError("provider down"))
+    for subscription in (leader, follower):
+        try:
+            list(subscription)
+            raise AssertionError("the upstream error should be raised")
+        except RuntimeError as e:
+            assert str(e) == "provider down"
+
+def main():
+    """
+    Test script for single-flight request coalescing: followers joining and
+    leaving a flight, and teardown of the upstream stream.
+    """
+    tests = [test_follower_joins_and_gets_the_whole_stream, test_follower_leaving_keeps_the_stream_going,
+             test_upstream_closed_when_last_subscriber_leaves, test_failed_upstream_call_reaches_followers]
+    failed = 0
+    for test in tests:
+        try:
+            test()
+            print(f"PASS {test.__name__}")
+        except AssertionError as e:
+            failed += 1
+            print(f"FAIL {test.__name__}: {str(e)}")
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
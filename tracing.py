@@ -0,0 +1,287 @@
+import os
+import re
+import json
+import time
+import random
+import threading
+import contextvars
+import logging
+from typing import Any, Dict, List, Mapping, Optional
+
+from profiling import NULL_PROFILE, activate
+
+logger = logging.getLogger(__name__)
+
+# W3C Trace Context: version-traceid-parentid-flags
+_TRACEPARENT = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+
+# The span that stages opened in this context nest under (copied into worker threads
+# along with the rest of the context)
+_active_span: contextvars.ContextVar = contextvars.ContextVar("active_span", default=None)
+
+def _new_id(nbytes: int) -> str:
+    return os.urandom(nbytes).hex()
+
+def _otlp_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+def _otlp_attributes(attributes: Mapping[str, Any]) -> List[Dict[str, Any]]:
+    return [{"key": key, "value": _otlp_value(value)} for key, value in attributes.items() if value is not None]
+
+class Span:
+    """One timed operation of a trace."""
+
+    __slots__ = ("trace_id", "span_id", "parent_id", "name", "start_ns", "end_ns", "attributes", "events", "error")
+
+    def __init__(self, trace_id: str, name: str, parent_id: Optional[str], start_ns: Optional[int] = None):
+        self.trace_id = trace_id
+        self.span_id = _new_id(8)
+        self.parent_id = parent_id
+        self.name = name
+        self.start_ns = start_ns if start_ns is not None else time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.attributes: Dict[str, Any] = {}
+        self.events: List[Dict[str, Any]] = []
+        self.error: Optional[str] = None
+
+    def end(self, end_ns: Optional[int] = None) -> None:
+        if self.end_ns is None:
+            self.end_ns = end_ns if end_ns is not None else time.time_ns()
+
+    def to_otlp(self) -> Dict[str, Any]:
+        """Return the span in OTLP/JSON form."""
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": 2 if self.parent_id is None else 1,  # SERVER for the request, INTERNAL below it
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns or self.start_ns),
+            "attributes": _otlp_attributes(self.attributes),
+            "events": [{"name": event["name"], "timeUnixNano": str(event["time_ns"])} for event in self.events],
+            "status": {"code": 2, "message": self.error} if self.error else {"code": 0},
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        return span
+
+class _SpanContext:
+    __slots__ = ("trace", "name", "span", "token")
+
+    def __init__(self, trace: "Trace", name: str):
+        self.trace = trace
+        self.name = name
+
+    def __enter__(self):
+        parent = _active_span.get()
+        if parent is None or parent.trace_id != self.trace.trace_id:
+            parent = self.trace.root
+        self.span = self.trace._open(self.name, parent.span_id)
+        self.token = _active_span.set(self.span)
+        return self.span
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc is not None and not isinstance(exc, GeneratorExit):
+            self.span.error = f"{exc_type.__name__}: {str(exc)}"
+        self.span.end()
+        try:
+            _active_span.reset(self.token)
+        except ValueError:
+            # Exited in another context than it was entered (e.g. across a generator)
+            pass
+        return False
+
+class _Accumulator:
+    __slots__ = ("trace", "name", "start")
+
+    def __init__(self, trace: "Trace", name: str):
+        self.trace = trace
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        elapsed_ms = (time.perf_counter() - self.start) * 1000
+        with self.trace._lock:
+            attributes = self.trace.root.attributes
+            attributes[f"{self.name}.count"] = attributes.get(f"{self.name}.count", 0) + 1
+            attributes[f"{self.name}.total_ms"] = round(attributes.get(f"{self.name}.total_ms", 0.0) + elapsed_ms, 3)
+        return False
+
+class Trace:
+    """
+    The spans of one request, driven by the same stage points as a profile:
+    stage() opens a child span (nested under the span open in the calling
+    context), lap() closes a span that started where the previous lap ended,
+    mark() adds an event to the request span the first time a point is
+    reached, accumulate() sums short repeated blocks into request span
+    attributes and annotate() sets request span attributes.
+    finish() ends the request span and exports the trace.
+    """
+
+    enabled = True
+
+    def __init__(self, tracer: "Tracer", name: str, trace_id: Optional[str] = None,
+                 parent_span_id: Optional[str] = None):
+        """
+        Initialize and activate the trace for the current request.
+
+        Args:
+            tracer: Tracer that exports the trace
+            name: Name of the request span
+            trace_id: Trace to continue (from an incoming traceparent), or None for a new one
+            parent_span_id: Caller's span the request span is a child of
+        """
+        self.tracer = tracer
+        self.trace_id = trace_id or _new_id(16)
+        self.root = Span(self.trace_id, name, parent_span_id)
+        self._spans: List[Span] = [self.root]
+        self._lap_start_ns = self.root.start_ns
+        self._marks: set = set()
+        self._lock = threading.Lock()
+        self._finished = False
+        _active_span.set(self.root)
+        activate(self)
+
+    @property
+    def traceparent(self) -> str:
+        """W3C traceparent of the request span, for response headers and outgoing calls."""
+        return f"00-{self.trace_id}-{self.root.span_id}-01"
+
+    def stage(self, name: str) -> _SpanContext:
+        return _SpanContext(self, name)
+
+    def accumulate(self, name: str) -> _Accumulator:
+        return _Accumulator(self, name)
+
+    def lap(self, name: str) -> None:
+        """Record the time since the previous lap (or the start) as a span."""
+        now = time.time_ns()
+        span = self._open(name, self.root.span_id, start_ns=self._lap_start_ns)
+        span.end(now)
+        self._lap_start_ns = now
+
+    def mark(self, name: str) -> None:
+        """Add an event to the request span the first time a named point is reached."""
+        with self._lock:
+            if name in self._marks:
+                return
+            self._marks.add(name)
+            self.root.events.append({"name": name, "time_ns": time.time_ns()})
+
+    def annotate(self, **fields: Any) -> None:
+        """Attach context (provider, model, session...) to the request span."""
+        with self._lock:
+            self.root.attributes.update(fields)
+
+    def finish(self) -> None:
+        """End the request span and export the trace (idempotent)."""
+        with self._lock:
+            if self._finished:
+                return
+            self._finished = True
+            self.root.end()
+            spans = list(self._spans)
+        self.tracer.export(spans)
+
+    def _open(self, name: str, parent_id: str, start_ns: Optional[int] = None) -> Span:
+        span = Span(self.trace_id, name, parent_id, start_ns)
+        with self._lock:
+            self._spans.append(span)
+        return span
+
+class Tracer:
+    """
+    Decides which requests are traced and exports their spans.
+
+    A request is traced when its incoming traceparent header has the sampled
+    flag set (its trace id is continued) or when it is picked by the
+    sampling rate. Each finished trace is appended to a JSON Lines file as
+    one OTLP/JSON export request (resourceSpans), the format read by the
+    OpenTelemetry Collector's otlpjsonfile receiver. The file is rotated to
+    <path>.1 when it grows past max_bytes.
+    """
+
+    def __init__(self, path: str = "traces/spans.jsonl", sample_rate: float = 0.0,
+                 service_name: str = "image-reader", max_bytes: int = 64 * 1024 * 1024):
+        """
+        Initialize the tracer.
+
+        Args:
+            path: JSON Lines file traces are appended to
+            sample_rate: Fraction of requests traced without a sampled traceparent (0 to 1)
+            service_name: service.name resource attribute of the exported spans
+            max_bytes: Size at which the file is rotated
+        """
+        self.path = path
+        self.sample_rate = sample_rate
+        self.service_name = service_name
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._stats = {"traced": 0, "exported": 0, "spans": 0, "errors": 0}
+
+    def start(self, headers: Mapping[str, str], name: str = "request"):
+        """
+        Start tracing a request if it is sampled.
+
+        Args:
+            headers: Request headers
+            name: Name of the request span
+
+        Returns:
+            A Trace, or NULL_PROFILE when the request is not traced
+        """
+        trace_id = parent_span_id = None
+        sampled = False
+        match = _TRACEPARENT.match((headers.get("traceparent") or "").strip().lower())
+        if match:
+            trace_id, parent_span_id, flags = match.groups()
+            sampled = bool(int(flags, 16) & 0x01)
+        if not sampled and not (self.sample_rate > 0 and random.random() < self.sample_rate):
+            _active_span.set(None)
+            activate(NULL_PROFILE)
+            return NULL_PROFILE
+        with self._lock:
+            self._stats["traced"] += 1
+        return Trace(self, name, trace_id=trace_id, parent_span_id=parent_span_id)
+
+    def export(self, spans: List[Span]) -> None:
+        """Append a finished trace to the file."""
+        record = {
+            "resourceSpans": [{
+                "resource": {"attributes": _otlp_attributes({"service.name": self.service_name})},
+                "scopeSpans": [{
+                    "scope": {"name": "image-reader.tracing"},
+                    "spans": [span.to_otlp() for span in sorted(spans, key=lambda span: span.start_ns)],
+                }],
+            }]
+        }
+        line = json.dumps(record, separators=(",", ":"), default=str) + "\n"
+        try:
+            with self._lock:
+                directory = os.path.dirname(self.path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                if self.max_bytes > 0 and os.path.exists(self.path) and os.path.getsize(self.path) >= self.max_bytes:
+                    os.replace(self.path, f"{self.path}.1")
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(line)
+                self._stats["exported"] += 1
+                self._stats["spans"] += len(spans)
+        except OSError as e:
+            with self._lock:
+                self._stats["errors"] += 1
+            logger.error(f"[Tracing] Could not export trace {spans[0].trace_id}: {str(e)}")
+
+    def stats(self) -> Dict[str, Any]:
+        """Return the tracing settings and how many traces were exported."""
+        with self._lock:
+            return {"path": self.path, "sample_rate": self.sample_rate, **self._stats}
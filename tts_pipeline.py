@@ -0,0 +1,162 @@
+import re
+import queue
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+# A sentence ends at terminal punctuation (optionally followed by closing quotes
+# or brackets) and then whitespace. Text after the last boundary is kept buffered.
+SENTENCE_BOUNDARY = re.compile(r'[.!?]+["\')\]]*\s+')
+
+class SentenceSplitter:
+    """
+    Incrementally splits streamed text into complete sentences.
+    Very short fragments are merged into the following sentence so that
+    abbreviations and interjections don't become their own TTS requests.
+    """
+
+    def __init__(self, min_length: int = 20):
+        """
+        Initialize the splitter.
+
+        Args:
+            min_length: Minimum number of characters in an emitted sentence
+        """
+        self.min_length = min_length
+        self._buffer = ""
+
+    def feed(self, text: str) -> List[str]:
+        """
+        Add streamed text and return any sentences that are now complete.
+
+        Args:
+            text: The next piece of streamed text
+
+        Returns:
+            List of complete sentences (possibly empty)
+        """
+        self._buffer += text
+        sentences = []
+        start = 0
+        for match in SENTENCE_BOUNDARY.finditer(self._buffer):
+            candidate = self._buffer[start:match.end()].strip()
+            if len(candidate) >= self.min_length:
+                sentences.append(candidate)
+                start = match.end()
+        self._buffer = self._buffer[start:]
+        return sentences
+
+    def flush(self) -> Optional[str]:
+        """
+        Return whatever text remains once the stream has finished.
+
+        Returns:
+            The trailing sentence, or None if nothing is left
+        """
+        remainder = self._buffer.strip()
+        self._buffer = ""
+        return remainder or None
+
+def iter_completion_text(llm_response: Any) -> Iterator[str]:
+    """
+    Yield the text deltas of a streamed chat completion.
+
+    Args:
+        llm_response: A stream of OpenAI chunk objects, or a single chunk dict
+            (GeminiService returns one dict when stream=True)
+
+    Yields:
+        The content of each chunk that carries text
+    """
+    chunks = [llm_response] if isinstance(llm_response, dict) else llm_response
+    for chunk in chunks:
+        if isinstance(chunk, dict):
+            choices = chunk.get("choices") or []
+            delta = (choices[0].get("delta") or {}) if choices else {}
+            content = delta.get("content")
+        else:
+            content = None
+            if chunk.choices and chunk.choices[0].delta:
+                content = chunk.choices[0].delta.content
+        if content:
+            yield content
+
+def pipeline_speech(text_stream: Iterable[str],
+                    synthesize: Callable[[str], Dict[str, Any]],
+                    max_workers: int = 2) -> Iterator[Tuple[int, str, Dict[str, Any]]]:
+    """
+    Synthesize speech sentence by sentence while the text is still streamed.
+
+    The text stream is read on its own thread. Each complete sentence goes to a
+    worker pool as soon as it is seen. Each segment is yielded as soon as it
+    and all segments before it are synthesized, even while the LLM is still
+    working on its next chunk, so the first audio is ready long before the
+    LLM has finished. Segments are yielded strictly in order.
+
+    Args:
+        text_stream: Iterable of streamed text deltas
+        synthesize: Function that turns one sentence into a TTS result dictionary
+        max_workers: Number of concurrent TTS requests
+
+    Yields:
+        Tuples of (segment index, sentence text, TTS result)
+    """
+    # Sentences from the reader, finished TTS requests and the end (or failure) of the
+    # text stream all arrive on one queue, so the loop below wakes up for whichever is first
+    events: "queue.Queue[Tuple[str, Any]]" = queue.Queue()
+    stop = threading.Event()
+
+    def read():
+        splitter = SentenceSplitter()
+        try:
+            for text in text_stream:
+                for sentence in splitter.feed(text):
+                    events.put(("sentence", sentence))
+                if stop.is_set():
+                    break
+            else:
+                remainder = splitter.flush()
+                if remainder:
+                    events.put(("sentence", remainder))
+            events.put(("end", None))
+        except BaseException as e:
+            events.put(("error", e))
+        finally:
+            # Release the stream (and whatever it holds) on this thread, where it runs
+            close = getattr(text_stream, "close", None)
+            if close is not None:
+                close()
+
+    pending = []
+    next_index = 0
+    reading = True
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # Run in a copy of the caller's context so TTS calls land in the request's trace
+        reader = threading.Thread(target=contextvars.copy_context().run, args=(read,),
+                                  name="tts-pipeline-reader", daemon=True)
+        reader.start()
+        try:
+            while reading or pending:
+                while pending and pending[0][1].done():
+                    sentence, future = pending.pop(0)
+                    yield next_index, sentence, future.result()
+                    next_index += 1
+                if not reading and not pending:
+                    break
+                kind, value = events.get()
+                if kind == "sentence":
+                    future = executor.submit(contextvars.copy_context().run, synthesize, value)
+                    future.add_done_callback(lambda _: events.put(("synthesized", None)))
+                    pending.append((value, future))
+                elif kind == "end":
+                    reading = False
+                elif kind == "error":
+                    raise value
+        finally:
+            # The consumer went away (or the stream failed): stop reading at the next
+            # chunk and drop the sentences that haven't been sent to TTS yet
+            stop.set()
+            for _, future in pending:
+                future.cancel()
@@ -0,0 +1,457 @@
+import os
+import json
+import math
+import time
+import queue
+import sqlite3
+import threading
+import logging
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# USD per million tokens: (input, cached input, output). Matched by model-name prefix,
+# longest prefix first. Costs are estimates; unknown models report no cost.
+MODEL_PRICES = {
+    "gpt-4o-mini": (0.15, 0.075, 0.60),
+    "gpt-4o": (2.50, 1.25, 10.00),
+    "gpt-4.1-mini": (0.40, 0.10, 1.60),
+    "gpt-4.1": (2.00, 0.50, 8.00),
+    "gemini-1.5-flash": (0.075, 0.01875, 0.30),
+    "gemini-1.5-pro": (1.25, 0.3125, 5.00),
+    "gemini-2.0-flash": (0.10, 0.025, 0.40),
+    "claude-3-opus": (15.00, 1.50, 75.00),
+    "claude-3-5-sonnet": (3.00, 0.30, 15.00),
+    "claude-3-haiku": (0.25, 0.03, 1.25),
+}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS usage (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created_at REAL NOT NULL,
+    session_id TEXT,
+    provider TEXT NOT NULL,
+    model TEXT,
+    endpoint TEXT,
+    stream INTEGER NOT NULL,
+    prompt_tokens INTEGER NOT NULL,
+    completion_tokens INTEGER NOT NULL,
+    image_tokens INTEGER NOT NULL,
+    cached_tokens INTEGER NOT NULL,
+    images INTEGER NOT NULL,
+    usage_reported INTEGER NOT NULL,
+    latency_ms REAL,
+    ttft_ms REAL
+);
+CREATE INDEX IF NOT EXISTS usage_session ON usage (session_id, created_at);
+"""
+
+_COLUMNS = ("created_at", "session_id", "provider", "model", "endpoint", "stream", "prompt_tokens",
+            "completion_tokens", "image_tokens", "cached_tokens", "images", "usage_reported",
+            "latency_ms", "ttft_ms")
+
+def model_price(model: Optional[str]) -> Optional[Tuple[float, float, float]]:
+    """Return (input, cached input, output) USD per million tokens for a model, if known."""
+    if not model:
+        return None
+    name = model.lower().split("/")[-1]
+    for prefix in sorted(MODEL_PRICES, key=len, reverse=True):
+        if name.startswith(prefix):
+            return MODEL_PRICES[prefix]
+    return None
+
+def estimate_cost(model: Optional[str], prompt_tokens: int, cached_tokens: int,
+                  completion_tokens: int) -> Optional[float]:
+    """Estimate the cost of a request in USD, or None for unknown models."""
+    price = model_price(model)
+    if price is None:
+        return None
+    input_price, cached_price, output_price = price
+    uncached = max(0, prompt_tokens - cached_tokens)
+    return (uncached * input_price + cached_tokens * cached_price + completion_tokens * output_price) / 1e6
+
+def estimate_image_tokens(path: str, detail: str = "high") -> int:
+    """
+    Estimate the prompt tokens of an image with OpenAI's tiling rule: 85 tokens
+    at low detail, otherwise 85 plus 170 per 512px tile after scaling to fit
+    2048x2048 with the short side at most 768px.
+
+    Args:
+        path: Image file (only the header is read)
+        detail: 'low', 'high' or 'auto'
+
+    Returns:
+        Estimated token count (0 if the image can't be read)
+    """
+    if detail == "low":
+        return 85
+    try:
+        # Imported lazily: only the writer thread estimates image tokens
+        from PIL import Image
+        with Image.open(path) as image:
+            width, height = image.size
+    except Exception:
+        return 0
+    scale = min(1.0, 2048 / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, 768 / min(width, height))
+    width, height = width * scale, height * scale
+    return 85 + 170 * math.ceil(width / 512) * math.ceil(height / 512)
+
+def _get(obj: Any, name: str, default: Any = None) -> Any:
+    """Read a field from a dict or an SDK object."""
+    if obj is None:
+        return default
+    if isinstance(obj, dict):
+        return obj.get(name, default)
+    return getattr(obj, name, default)
+
+def normalize_usage(usage: Any) -> Dict[str, int]:
+    """
+    Map a provider usage block to prompt, completion, cached and image tokens.
+    Understands OpenAI usage (also produced by GeminiService), Gemini
+    usage_metadata and Anthropic usage.
+
+    Args:
+        usage: Usage dict or SDK object
+
+    Returns:
+        Dict with prompt_tokens, completion_tokens, cached_tokens and image_tokens
+    """
+    details = _get(usage, "prompt_tokens_details") or {}
+    if _get(usage, "input_tokens") is not None:
+        # Anthropic: cached reads are reported separately from input_tokens
+        cached = (_get(usage, "cache_read_input_tokens") or 0)
+        prompt = (_get(usage, "input_tokens") or 0) + cached + (_get(usage, "cache_creation_input_tokens") or 0)
+        completion = _get(usage, "output_tokens") or 0
+    elif _get(usage, "prompt_token_count") is not None or _get(usage, "promptTokenCount") is not None:
+        # Gemini usage_metadata (SDK object or REST JSON)
+        prompt = _get(usage, "prompt_token_count") or _get(usage, "promptTokenCount") or 0
+        completion = _get(usage, "candidates_token_count") or _get(usage, "candidatesTokenCount") or 0
+        cached = _get(usage, "cached_content_token_count") or _get(usage, "cachedContentTokenCount") or 0
+        details = {"image_tokens": gemini_image_tokens(usage)}
+    else:
+        prompt = _get(usage, "prompt_tokens") or 0
+        completion = _get(usage, "completion_tokens") or 0
+        cached = _get(details, "cached_tokens") or 0
+    return {
+        "prompt_tokens": int(prompt),
+        "completion_tokens": int(completion),
+        "cached_tokens": int(cached),
+        "image_tokens": int(_get(details, "image_tokens") or 0),
+    }
+
+def gemini_image_tokens(usage_metadata: Any) -> int:
+    """Sum the IMAGE-modality prompt tokens of a Gemini usage_metadata block."""
+    total = 0
+    for entry in _get(usage_metadata, "prompt_tokens_details") or _get(usage_metadata, "promptTokensDetails") or []:
+        modality = _get(entry, "modality")
+        if "IMAGE" in str(getattr(modality, "name", modality)).upper():
+            total += _get(entry, "token_count") or _get(entry, "tokenCount") or 0
+    return total
+
+class UsageTracker:
+    """
+    Collects the usage of one request. observe() is called with the response
+    (or each streamed chunk) and finish() hands the record to the ledger.
+    Both only touch memory; the database write happens on the ledger's thread.
+    """
+
+    def __init__(self, ledger: "UsageLedger", provider: str, model: Optional[str],
+                 session_id: Optional[str] = None, endpoint: Optional[str] = None,
+                 stream: bool = False, images: Optional[List[Tuple[Optional[str], str]]] = None):
+        self.ledger = ledger
+        self.provider = provider
+        self.model = model
+        self.session_id = session_id
+        self.endpoint = endpoint
+        self.stream = stream
+        self.images = images or []
+        self.usage: Dict[str, int] = {}
+        self.started = time.perf_counter()
+        self.first_token_at: Optional[float] = None
+        self._finished = False
+
+    def add_image(self, path: Optional[str], detail: str = "high") -> None:
+        """Note an image sent with the request (path is used to estimate its tokens)."""
+        self.images.append((path, detail))
+
+    def observe(self, item: Any) -> None:
+        """Pick up usage and first-token time from a response, chunk or Anthropic SSE line."""
+        if isinstance(item, bytes):
+            self._observe_anthropic_event(item)
+            return
+        usage = _get(item, "usage") or _get(item, "usage_metadata") or _get(item, "usageMetadata")
+        if usage:
+            normalized = normalize_usage(usage)
+            # GeminiService reports -1 when the response carried no usage
+            if normalized["prompt_tokens"] >= 0:
+                self.usage = normalized
+        if self.first_token_at is None:
+            choices = _get(item, "choices") or []
+            delta = _get(choices[0], "delta") if choices else None
+            if delta is not None and _get(delta, "content"):
+                self.first_token_at = time.perf_counter()
+
+    def watch(self, stream: Any) -> Any:
+        """
+        Observe a streamed response as it is consumed and finish when it ends.
+
+        Args:
+            stream: Iterable of chunks, or a single dict (GeminiService's stream)
+
+        Returns:
+            An iterable yielding the same chunks
+        """
+        if isinstance(stream, dict):
+            self.observe(stream)
+            self.finish()
+            return stream
+        return self._watch(stream)
+
+    def _watch(self, stream: Iterable[Any]) -> Iterable[Any]:
+        for chunk in stream:
+            self.observe(chunk)
+            yield chunk
+        self.finish()
+
+    def _observe_anthropic_event(self, line: bytes) -> None:
+        if not line.startswith(b"data:"):
+            return
+        try:
+            event = json.loads(line[5:])
+        except ValueError:
+            return
+        if event.get("type") == "message_start":
+            usage = (event.get("message") or {}).get("usage") or {}
+            self.usage = normalize_usage(usage)
+        elif event.get("type") == "message_delta" and event.get("usage"):
+            merged = dict(self.usage)
+            merged["completion_tokens"] = int(event["usage"].get("output_tokens") or 0)
+            self.usage = merged
+        elif event.get("type") == "content_block_delta" and self.first_token_at is None:
+            self.first_token_at = time.perf_counter()
+
+    def finish(self) -> None:
+        """Queue the record (idempotent)."""
+        if self._finished:
+            return
+        self._finished = True
+        now = time.perf_counter()
+        self.ledger.record({
+            "created_at": time.time(),
+            "session_id": self.session_id,
+            "provider": self.provider,
+            "model": self.model,
+            "endpoint": self.endpoint,
+            "stream": int(self.stream),
+            "usage": self.usage,
+            "images": list(self.images),
+            "latency_ms": round((now - self.started) * 1000, 1),
+            "ttft_ms": round((self.first_token_at - self.started) * 1000, 1) if self.first_token_at else None,
+        })
+
+class UsageLedger:
+    """
+    Write-behind usage ledger backed by SQLite.
+
+    record() only appends to a bounded in-memory queue; a daemon thread writes
+    batches to the database (estimating image tokens from the image headers
+    when the provider doesn't report them). If the queue is full, records are
+    dropped and counted rather than slowing requests down.
+    """
+
+    def __init__(self, db_path: str, flush_interval: float = 1.0, batch_size: int = 500,
+                 max_queue: int = 10000):
+        """
+        Initialize the ledger.
+
+        Args:
+            db_path: SQLite database file
+            flush_interval: Maximum seconds a record waits before it is written
+            batch_size: Maximum records per transaction
+            max_queue: Maximum buffered records
+        """
+        self.db_path = db_path
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self._queue: "queue.Queue[Dict[str, Any]]" = queue.Queue(maxsize=max_queue)
+        self._flush_requests: "queue.Queue[threading.Event]" = queue.Queue()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        self._writer: Optional[sqlite3.Connection] = None
+        self._stats = {"recorded": 0, "written": 0, "dropped": 0, "write_errors": 0}
+
+        directory = os.path.dirname(os.path.abspath(db_path))
+        os.makedirs(directory, exist_ok=True)
+        conn = self._connect()
+        try:
+            conn.executescript(_SCHEMA)
+        finally:
+            conn.close()
+
+    def start(self) -> None:
+        """Start the background writer thread."""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name="usage-ledger", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Write pending records and stop the writer thread."""
+        self._stopped.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+
+    def tracker(self, provider: str, model: Optional[str], **kwargs) -> UsageTracker:
+        """Create a tracker for one request (see UsageTracker for the arguments)."""
+        return UsageTracker(self, provider, model, **kwargs)
+
+    def record(self, entry: Dict[str, Any]) -> None:
+        """Queue a usage record without blocking."""
+        try:
+            self._queue.put_nowait(entry)
+            self._stats["recorded"] += 1
+        except queue.Full:
+            self._stats["dropped"] += 1
+
+    def flush(self, timeout: float = 5.0) -> None:
+        """Wait until the records queued so far are written (used before queries)."""
+        if not self._thread or not self._thread.is_alive():
+            self._write(self._drain())
+            return
+        done = threading.Event()
+        self._flush_requests.put(done)
+        done.wait(timeout)
+
+    def session_totals(self, session_id: str) -> Dict[str, Any]:
+        """
+        Return the usage totals of a session, overall and per provider and model.
+
+        Args:
+            session_id: Session identifier
+
+        Returns:
+            Dict with 'total' and 'by_model' entries, including estimated cost
+        """
+        self.flush()
+        rows = self._query("""
+            SELECT provider, model, COUNT(*), SUM(prompt_tokens), SUM(completion_tokens),
+                   SUM(image_tokens), SUM(cached_tokens), SUM(images), AVG(latency_ms), AVG(ttft_ms),
+                   MIN(created_at), MAX(created_at)
+            FROM usage WHERE session_id = ? GROUP BY provider, model ORDER BY provider, model
+        """, (session_id,))
+        by_model = [self._totals_row(row[2:], provider=row[0], model=row[1]) for row in rows]
+        total = {key: sum(item[key] for item in by_model)
+                 for key in ("requests", "prompt_tokens", "completion_tokens", "image_tokens",
+                             "cached_tokens", "images")}
+        costs = [item["cost_usd"] for item in by_model if item["cost_usd"] is not None]
+        total["cost_usd"] = round(sum(costs), 6) if costs else None
+        total["first_request"] = min((item["first_request"] for item in by_model), default=None)
+        total["last_request"] = max((item["last_request"] for item in by_model), default=None)
+        return {"session_id": session_id, "total": total, "by_model": by_model}
+
+    def top_sessions(self, limit: int = 20, since: Optional[float] = None) -> List[Dict[str, Any]]:
+        """Return the sessions with the most tokens, most first."""
+        self.flush()
+        rows = self._query("""
+            SELECT session_id, COUNT(*), SUM(prompt_tokens), SUM(completion_tokens), SUM(image_tokens),
+                   SUM(cached_tokens), SUM(images)
+            FROM usage WHERE session_id IS NOT NULL AND created_at >= ?
+            GROUP BY session_id ORDER BY SUM(prompt_tokens) + SUM(completion_tokens) DESC LIMIT ?
+        """, (since or 0.0, limit))
+        keys = ("requests", "prompt_tokens", "completion_tokens", "image_tokens", "cached_tokens", "images")
+        return [dict(session_id=row[0], **dict(zip(keys, row[1:]))) for row in rows]
+
+    def stats(self) -> Dict[str, Any]:
+        """Return queue depth and recorded, written and dropped counts."""
+        return {"queued": self._queue.qsize(), **self._stats}
+
+    def _totals_row(self, row: Iterable[Any], provider: str, model: Optional[str]) -> Dict[str, Any]:
+        (requests, prompt, completion, image, cached, images, latency, ttft, first, last) = row
+        cost = estimate_cost(model, prompt or 0, cached or 0, completion or 0)
+        return {
+            "provider": provider,
+            "model": model,
+            "requests": requests,
+            "prompt_tokens": prompt or 0,
+            "completion_tokens": completion or 0,
+            "image_tokens": image or 0,
+            "cached_tokens": cached or 0,
+            "images": images or 0,
+            "avg_latency_ms": round(latency, 1) if latency is not None else None,
+            "avg_ttft_ms": round(ttft, 1) if ttft is not None else None,
+            "cost_usd": round(cost, 6) if cost is not None else None,
+            "first_request": first,
+            "last_request": last,
+        }
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_path, timeout=10)
+
+    def _query(self, sql: str, params: Tuple[Any, ...]) -> List[Tuple[Any, ...]]:
+        # One read connection per request thread
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+        return conn.execute(sql, params).fetchall()
+
+    def _drain(self) -> List[Dict[str, Any]]:
+        batch = []
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _row(self, entry: Dict[str, Any]) -> Tuple[Any, ...]:
+        usage = entry.get("usage") or {}
+        image_tokens = usage.get("image_tokens") or 0
+        if not image_tokens and entry["images"]:
+            # The provider didn't break out image tokens; estimate them
+            image_tokens = sum(estimate_image_tokens(path, detail) if path else 0
+                               for path, detail in entry["images"])
+        values = dict(entry,
+                      prompt_tokens=usage.get("prompt_tokens", 0),
+                      completion_tokens=usage.get("completion_tokens", 0),
+                      cached_tokens=usage.get("cached_tokens", 0),
+                      image_tokens=image_tokens,
+                      images=len(entry["images"]),
+                      usage_reported=int(bool(usage)))
+        return tuple(values[column] for column in _COLUMNS)
+
+    def _write(self, batch: List[Dict[str, Any]]) -> None:
+        if not batch:
+            return
+        try:
+            rows = [self._row(entry) for entry in batch]
+            with self._write_lock:
+                if self._writer is None:
+                    self._writer = sqlite3.connect(self.db_path, timeout=10, check_same_thread=False)
+                with self._writer:
+                    self._writer.executemany(f"INSERT INTO usage ({', '.join(_COLUMNS)}) "
+                                             f"VALUES ({', '.join('?' for _ in _COLUMNS)})", rows)
+            self._stats["written"] += len(rows)
+        except Exception as e:
+            self._stats["write_errors"] += 1
+            logger.error(f"[Usage] Could not write {len(batch)} usage records: {str(e)}")
+
+    def _run(self) -> None:
+        while True:
+            try:
+                done = self._flush_requests.get(timeout=self.flush_interval)
+            except queue.Empty:
+                done = None
+            while True:
+                batch = self._drain()
+                if not batch:
+                    break
+                self._write(batch)
+            if done is not None:
+                done.set()
+            if self._stopped.is_set():
+                return
@@ -0,0 +1,81 @@
+import time
+import uuid
+import threading
+from collections import deque
+from typing import Any, Deque, Dict, Optional
+
+from admission import latency_percentiles
+
+def ack_chunk(text: str, model: Optional[str]) -> Dict[str, Any]:
+    """
+    Build the acknowledgement sent ahead of the model's answer on vision turns.
+
+    It is an ordinary chat.completion.chunk carrying the assistant role and
+    the spoken text, so the voice agent starts speaking it right away; the
+    model's chunks that follow simply continue the same message.
+
+    Args:
+        text: Acknowledgement to speak (e.g. "Let me take a look.")
+        model: Model name reported in the chunk
+
+    Returns:
+        Chunk dict in OpenAI's streaming format
+    """
+    # Trailing space so the spoken text runs on into the model's first words
+    return {
+        "id": f"chatcmpl-ack-{uuid.uuid4().hex[:12]}",
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [
+            {
+                "index": 0,
+                "delta": {"role": "assistant", "content": text.rstrip() + " "},
+                "finish_reason": None
+            }
+        ]
+    }
+
+class TtftStats:
+    """
+    Perceived versus actual time to first token of streamed turns.
+
+    Perceived TTFT is when the client got its first content (the
+    acknowledgement, if one was sent); actual TTFT is when the model's first
+    token arrived. Both are measured from the arrival of the request and kept
+    for the most recent turns, separately for acknowledged and direct turns.
+    """
+
+    def __init__(self, window: int = 500):
+        self._lock = threading.Lock()
+        self._perceived: Dict[str, Deque[float]] = {kind: deque(maxlen=window) for kind in ("acknowledged", "direct")}
+        self._actual: Dict[str, Deque[float]] = {kind: deque(maxlen=window) for kind in ("acknowledged", "direct")}
+        self._counts = {"acknowledged": 0, "direct": 0}
+
+    def record(self, acknowledged: bool, perceived_seconds: float, actual_seconds: Optional[float]) -> None:
+        """
+        Record a turn.
+
+        Args:
+            acknowledged: Whether an acknowledgement was sent ahead of the model
+            perceived_seconds: Time until the first content went out
+            actual_seconds: Time until the model's first token (None if it never came)
+        """
+        kind = "acknowledged" if acknowledged else "direct"
+        with self._lock:
+            self._counts[kind] += 1
+            self._perceived[kind].append(perceived_seconds)
+            if actual_seconds is not None:
+                self._actual[kind].append(actual_seconds)
+
+    def stats(self) -> Dict[str, Any]:
+        """Return turn counts and perceived/actual TTFT percentiles per kind of turn."""
+        with self._lock:
+            return {
+                kind: {
+                    "turns": self._counts[kind],
+                    "perceived_ttft_ms": latency_percentiles(list(self._perceived[kind])),
+                    "actual_ttft_ms": latency_percentiles(list(self._actual[kind]))
+                }
+                for kind in self._counts
+            }
@@ -0,0 +1,144 @@
+import time
+import threading
+import logging
+from typing import Any, Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+class DependencyWarmer:
+    """
+    Keeps connections to external dependencies (LLM provider, ElevenLabs) warm
+    and tracks whether they are reachable.
+
+    Each pass runs every dependency's warm-up callable on a daemon thread: the
+    first pass right at start, so the first user turn doesn't pay connection
+    setup, and then every interval seconds, so pooled connections aren't
+    closed for being idle. The time each call takes is reported as the
+    dependency's connect latency.
+
+    The instance is ready once every dependency has been warmed successfully;
+    after that it only turns unready when a dependency fails
+    failure_threshold passes in a row, so a single blip doesn't take the
+    instance out of the load balancer.
+    """
+
+    def __init__(self,
+                 targets: Callable[[], Dict[str, Callable[[], Any]]],
+                 interval: float = 45.0,
+                 failure_threshold: int = 3):
+        """
+        Initialize the warmer.
+
+        Args:
+            targets: Returns the current dependencies as {name: warm-up callable};
+                called on every pass so configuration reloads are picked up
+            interval: Seconds between passes (0 warms once at start only)
+            failure_threshold: Consecutive failures before a warmed dependency
+                makes the instance unready
+        """
+        self.targets = targets
+        self.interval = interval
+        self.failure_threshold = failure_threshold
+
+        self._status: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._passes = 0
+
+    def start(self) -> None:
+        """Start the background thread; the first pass runs immediately."""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name="dependency-warmer", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop the background thread."""
+        self._stopped.set()
+        self._wake.set()
+
+    def trigger(self) -> None:
+        """Run a pass now (e.g. after the configured provider changed)."""
+        self._wake.set()
+
+    def run_once(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Warm every dependency once.
+
+        Returns:
+            Status of each dependency
+        """
+        targets = self.targets()
+        for name, warm in targets.items():
+            start = time.perf_counter()
+            try:
+                warm()
+                error = None
+            except Exception as e:
+                error = f"{type(e).__name__}: {str(e)}"
+            elapsed_ms = round((time.perf_counter() - start) * 1000, 1)
+            self._record(name, elapsed_ms, error)
+
+        with self._lock:
+            # Dependencies that are no longer configured don't block readiness
+            for name in list(self._status):
+                if name not in targets:
+                    del self._status[name]
+            self._passes += 1
+            return {name: dict(status) for name, status in self._status.items()}
+
+    def readiness(self) -> Tuple[bool, Dict[str, Any]]:
+        """
+        Report whether the instance should receive traffic.
+
+        Returns:
+            Tuple of (ready, report with the status of each dependency)
+        """
+        with self._lock:
+            dependencies = {name: dict(status) for name, status in self._status.items()}
+            passes = self._passes
+        ready = passes > 0 and all(status["ready"] for status in dependencies.values())
+        return ready, {"ready": ready, "passes": passes, "dependencies": dependencies}
+
+    def stats(self) -> Dict[str, Any]:
+        """Return the readiness report (for /metrics)."""
+        return self.readiness()[1]
+
+    def _record(self, name: str, elapsed_ms: float, error: Optional[str]) -> None:
+        with self._lock:
+            status = self._status.setdefault(name, {
+                "ready": False,
+                "warmed": False,
+                "connect_ms": None,
+                "last_ok": None,
+                "consecutive_failures": 0,
+                "error": None,
+            })
+            if error is None:
+                status.update(warmed=True, ready=True, connect_ms=elapsed_ms, last_ok=time.time(),
+                              consecutive_failures=0, error=None)
+                return
+            status["consecutive_failures"] += 1
+            status["error"] = error
+            if not status["warmed"] or status["consecutive_failures"] >= self.failure_threshold:
+                status["ready"] = False
+        logger.warning(f"[Warmup] {name} failed ({status['consecutive_failures']} in a row): {error}")
+
+    def _run(self) -> None:
+        while not self._stopped.is_set():
+            try:
+                report = self.run_once()
+                logger.info("[Warmup] " + ", ".join(
+                    f"{name}: {status['connect_ms']} ms" if status["error"] is None else f"{name}: failed"
+                    for name, status in report.items()))
+            except Exception as e:
+                logger.error(f"[Warmup] Pass failed: {str(e)}")
+            if self.interval <= 0:
+                # Only the startup pass; later passes run on trigger()
+                self._wake.wait()
+            else:
+                self._wake.wait(self.interval)
+            self._wake.clear()